@@ -1,39 +1,70 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from datetime import datetime, timedelta, date
+from functools import wraps
 from werkzeug.utils import secure_filename
 import os
 import uuid
 import secrets
 import json
+import sys
+import time
+import click
+from sqlalchemy import event
 
-from models import db, User, City, Activity, Trip, Stop, ItineraryActivity, Budget, SavedDestination
-from sqlalchemy import text
+from models import db, User, City, Activity, Trip, Stop, ItineraryActivity, ItineraryDay, Budget, SavedDestination, normalize_activity_name
 from config import Config
+from catalogue import FORMATS as CATALOGUE_FORMATS, KINDS as CATALOGUE_KINDS, CatalogueError, detect_format, export_catalogue, import_catalogue, open_file
+from compression import COMPRESSION_CACHE_KEY, cached_response, init_cache_invalidation, init_compression, invalidate_after_commit
+from concurrency import StaleDataError, if_match_failed, precondition_failed, with_etag
+from database import READ_ENGINES_KEY, RoutingSession, build_engine_options, icontains, init_engines, insert_ignoring_conflicts, prefer_reader, reader_engine
+from dataset import Scale, generate as generate_synthetic_dataset
+from events import init_events, queue_event, sse_response
+from fieldsets import Fieldset
+from forecast import ForecastError, forecast_trip, rates_from_config
 from groq_service import GroqService
-
-def _ensure_ai_itinerary_column():
-    """Add ai_itinerary column to trips if missing (SQLite-friendly, no migration tooling)."""
-    engine = db.engine
-    with engine.connect() as conn:
-        result = conn.execute(text("PRAGMA table_info(trips);"))
-        rows = result.fetchall()
-        # If table not yet created, skip
-        if not rows:
-            return
-        columns = {row[1] for row in rows}
-        if 'ai_itinerary' not in columns:
-            conn.execute(text("ALTER TABLE trips ADD COLUMN ai_itinerary TEXT;"))
-            conn.commit()
+from instrumentation import init_query_instrumentation
+from itinerary_batch import ItineraryBatch, ItineraryBatchError
+from llm_usage import GROUP_COLUMNS as LLM_USAGE_GROUP_COLUMNS, init_llm_usage, quota_exceeded, quota_exceeded_response, usage_report
+from ordering import REBALANCE_KEY_LENGTH, key_for_position, needs_rebalance, rebalance_trip_stops, schedule_rebalance, spread_keys, trip_stop_keys
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, init_metrics, metrics_authorized, record_llm_call, render_metrics
+from migrations import run_migrations
+from profiling import PROFILER_KEY, init_profiling
+from serialization import FastJSONProvider, listing_response
+from sync import changes_since, init_sync, snapshot, trip_change_seq, trip_of
+from trip_export import RENDERER_KEY as TRIP_PDF_RENDERER_KEY, RendererBusy, download_name, init_trip_exports, load_trip, render_ics, trip_document
+from user_export import FORMATS as USER_EXPORT_FORMATS, UserExport
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config)
+app.json = FastJSONProvider(app)
 
 # Initialize extensions
-CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173", "http://localhost:5174", "http://127.0.0.1:5173", "http://127.0.0.1:5174"]}}, supports_credentials=True)
+CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173", "http://localhost:5174", "http://127.0.0.1:5173", "http://127.0.0.1:5174"]}}, supports_credentials=True, expose_headers=['ETag'])
 db.init_app(app)
+init_engines(app, db)
+init_compression(app)
+init_cache_invalidation(RoutingSession)
+init_events(app, RoutingSession)
+init_sync(RoutingSession)
+init_query_instrumentation(app)
+
+
+def metric_engines():
+    """Engines reported by /metrics, labelled without their URLs"""
+    engines = {'primary': db.engine}
+    for index, engine in enumerate(app.extensions[READ_ENGINES_KEY]['engines']):
+        if engine is not db.engine:
+            engines[f'reader-{index}'] = engine
+    return engines
+
+
+init_metrics(app, metric_engines, cache_entries=lambda: len(app.extensions[COMPRESSION_CACHE_KEY].entries))
+init_profiling(app)
+init_trip_exports(app)
 
 # Session-based auth
 login_manager = LoginManager(app)
@@ -54,8 +85,109 @@ def create_access_token(identity):
     # Session cookie handles auth; token retained only for response compatibility
     return 'session-token'
 
+def admin_required(f):
+    """Restrict an endpoint to the accounts listed in ADMIN_EMAILS"""
+    @wraps(f)
+    @login_required
+    def decorated(*args, **kwargs):
+        if (current_user.email or '').lower() not in app.config['ADMIN_EMAILS']:
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+def shared_trip_cache_prefix(share_code):
+    """Cache key prefix of a public trip's responses (one per query string)"""
+    return f'shared_trip:/api/trips/shared/{share_code}?'
+
+# Everything GET /api/trips/shared/<code> shows of a trip
+SHARED_TRIP_MODELS = (Trip, Stop, ItineraryActivity, Budget, ItineraryDay)
+
+# Bounds on ?itinerary_days= selections
+MAX_ITINERARY_DAY = 366
+MAX_DAY_SELECTION_PARTS = 50
+
+@event.listens_for(RoutingSession, 'before_flush')
+def invalidate_changed_shared_trips(session, flush_context, instances):
+    """Drop the cached public copies of trips a flush changes, once it commits"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, SHARED_TRIP_MODELS):
+            continue
+        trip = trip_of(obj)
+        if trip is not None and trip.share_code:
+            invalidate_after_commit(session, shared_trip_cache_prefix(trip.share_code))
+
+
+def trip_activities_cost(trip_id):
+    """Sum of a trip's itinerary activity costs (an override of 0 falls back to the activity cost)"""
+    activities_cost = db.session.query(
+        db.func.coalesce(db.func.sum(
+            db.func.coalesce(db.func.nullif(ItineraryActivity.estimated_cost_override, 0), Activity.estimated_cost)
+        ), 0.0)
+    ).select_from(ItineraryActivity).join(Activity, ItineraryActivity.activity_id == Activity.id).join(
+        Stop, ItineraryActivity.stop_id == Stop.id
+    ).filter(Stop.trip_id == trip_id).scalar()
+    return float(activities_cost)
+
+
+def save_generated_activities(city_id, suggestions):
+    """Insert AI-suggested activities for a city in one statement; returns how many were new
+    
+    Names the city already has (compared by normalize_activity_name) are
+    skipped by the unique index, so concurrent requests cannot add duplicates.
+    """
+    rows = []
+    for act_data in suggestions:
+        if not isinstance(act_data, dict):
+            continue
+        name = act_data.get('name') or 'Activity'
+        rows.append({
+            'city_id': city_id,
+            'name': name,
+            'name_key': normalize_activity_name(name),
+            'description': act_data.get('description', ''),
+            'category': act_data.get('category', 'sightseeing'),
+            'estimated_cost': act_data.get('estimated_cost', 1000),
+            'duration_hours': act_data.get('duration_hours', 2.0)
+        })
+    if not rows:
+        return 0
+    
+    statement = insert_ignoring_conflicts(db.engine, Activity.__table__, ['city_id', 'name_key'])
+    inserted = db.session.execute(statement.values(rows)).rowcount
+    db.session.commit()
+    return inserted
+
+
+def _day_number(text):
+    if not text.strip().isdecimal() or int(text) < 1:
+        raise ValueError(f"itinerary_days: '{text.strip()}' is not a day number (1, 2, ...)")
+    return int(text)
+
+
+def parse_day_numbers(value):
+    """Parse a day selection like '1-3,5' into a list of day numbers (None = all days)"""
+    if not value:
+        return None
+    parts = [part.strip() for part in value.split(',') if part.strip()]
+    if len(parts) > MAX_DAY_SELECTION_PARTS:
+        raise ValueError(f'itinerary_days: at most {MAX_DAY_SELECTION_PARTS} days or ranges')
+    days = set()
+    for part in parts:
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start, end = _day_number(start), _day_number(end)
+            if start > end:
+                raise ValueError(f"itinerary_days: range '{part}' ends before it starts")
+            # Days past the longest possible itinerary cannot match, so skip them
+            days.update(range(start, min(end, MAX_ITINERARY_DAY) + 1))
+        elif _day_number(part) <= MAX_ITINERARY_DAY:
+            days.add(int(part))
+    return sorted(days)
+
 # Initialize Groq service
 groq_service = GroqService(app.config['GROQ_API_KEY'])
+groq_service.listeners.append(record_llm_call)
+init_llm_usage(app, groq_service)
 
 # Create upload folder
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -136,6 +268,7 @@ def logout():
 
 @app.route('/api/auth/me', methods=['GET'])
 @login_required
+@prefer_reader
 def get_current_user():
     """Get current authenticated user"""
     try:
@@ -206,9 +339,36 @@ def delete_account():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/users/export', methods=['GET'])
+@login_required
+def export_user_data():
+    """Stream all of the user's data as NDJSON (?format=ndjson, default) or a zip archive (?format=zip)"""
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in USER_EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(USER_EXPORT_FORMATS)}"}), 400
+        
+        export = UserExport(
+            reader_engine() or db.engine, get_jwt_identity(), app.json.dumps_bytes, app.config['USER_EXPORT_CHUNK_SIZE']
+        )
+        # Rows are read while the body is sent, on the export's own connection
+        body = export.zip() if export_format == 'zip' else export.ndjson()
+        response = app.response_class(body, mimetype=USER_EXPORT_FORMATS[export_format])
+        response.headers['Content-Disposition'] = (
+            f'attachment; filename="globetrotter-export-{date.today().isoformat()}.{export_format}"'
+        )
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ==================== CITY ENDPOINTS ====================
 
 @app.route('/api/cities/search', methods=['GET'])
+@prefer_reader
 def search_cities():
     """Search cities by name, country, or region"""
     try:
@@ -216,27 +376,28 @@ def search_cities():
         country = request.args.get('country', '').strip()
         region = request.args.get('region', '').strip()
         limit = request.args.get('limit', 20, type=int)
+        fieldset = Fieldset.from_request('city')
         
-        cities_query = City.query
+        cities_query = fieldset.apply(City.query, City, 'city')
         
         if query:
             cities_query = cities_query.filter(
                 db.or_(
-                    City.name.ilike(f'%{query}%'),
-                    City.country.ilike(f'%{query}%')
+                    icontains(City.name, query),
+                    icontains(City.country, query)
                 )
             )
         
         if country:
-            cities_query = cities_query.filter(City.country.ilike(f'%{country}%'))
+            cities_query = cities_query.filter(icontains(City.country, country))
         
         if region:
-            cities_query = cities_query.filter(City.region.ilike(f'%{region}%'))
+            cities_query = cities_query.filter(icontains(City.region, region))
         
         cities = cities_query.order_by(City.popularity_score.desc()).limit(limit).all()
         
         return jsonify({
-            'cities': [city.to_dict() for city in cities],
+            'cities': [city.to_dict(fieldset=fieldset) for city in cities],
             'count': len(cities)
         }), 200
         
@@ -245,21 +406,24 @@ def search_cities():
 
 
 @app.route('/api/cities/<int:city_id>', methods=['GET'])
+@prefer_reader
 def get_city(city_id):
     """Get city details"""
     try:
-        city = City.query.get(city_id)
+        fieldset = Fieldset.from_request('city')
+        city = fieldset.apply(City.query, City, 'city').get(city_id)
         
         if not city:
             return jsonify({'error': 'City not found'}), 404
         
-        return jsonify({'city': city.to_dict()}), 200
+        return jsonify({'city': city.to_dict(fieldset=fieldset)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/cities/<int:city_id>/info', methods=['GET'])
+@cached_response('city_info', 'CITY_INFO_CACHE_SECONDS')
 def get_city_ai_info(city_id):
     """Get AI-generated city information"""
     try:
@@ -280,9 +444,14 @@ def get_city_ai_info(city_id):
 # ==================== ACTIVITY ENDPOINTS ====================
 
 @app.route('/api/activities/suggest', methods=['POST'])
+@login_required
 def suggest_activities():
     """Get AI-suggested activities for a city"""
     try:
+        user_id = get_jwt_identity()
+        if quota_exceeded(user_id):
+            return quota_exceeded_response(user_id)
+        
         data = request.json
         city_name = data.get('city_name')
         interests = data.get('interests', [])
@@ -303,14 +472,16 @@ def suggest_activities():
 
 @app.route('/api/trips', methods=['GET'])
 @login_required
+@prefer_reader
 def get_user_trips():
     """Get all trips for current user"""
     try:
         user_id = get_jwt_identity()
-        trips = Trip.query.filter_by(user_id=user_id).order_by(Trip.created_at.desc()).all()
+        fieldset = Fieldset.from_request('trip')
+        trips = fieldset.apply(Trip.query, Trip, 'trip').filter_by(user_id=user_id).order_by(Trip.created_at.desc()).all()
         
         return jsonify({
-            'trips': [trip.to_dict() for trip in trips],
+            'trips': [trip.to_dict(fieldset=fieldset) for trip in trips],
             'count': len(trips)
         }), 200
         
@@ -369,11 +540,13 @@ def create_trip():
 
 @app.route('/api/trips/<int:trip_id>', methods=['GET'])
 @login_required
+@prefer_reader
 def get_trip(trip_id):
     """Get trip details"""
     try:
         user_id = get_jwt_identity()
-        trip = Trip.query.get(trip_id)
+        fieldset = Fieldset.from_request('trip')
+        trip = fieldset.apply(Trip.query, Trip, 'trip', always=('user_id', 'version')).get(trip_id)
         
         if not trip:
             return jsonify({'error': 'Trip not found'}), 404
@@ -381,7 +554,13 @@ def get_trip(trip_id):
         if trip.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        return jsonify({'trip': trip.to_dict(include_stops=True)}), 200
+        try:
+            itinerary_days = parse_day_numbers(request.args.get('itinerary_days'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        response = jsonify({'trip': trip.to_dict(include_stops=True, itinerary_days=itinerary_days, fieldset=fieldset)})
+        return with_etag(response, trip), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -401,6 +580,9 @@ def update_trip(trip_id):
         if trip.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
+        if if_match_failed(trip):
+            return precondition_failed(trip)
+        
         data = request.json
         
         if 'name' in data:
@@ -413,16 +595,24 @@ def update_trip(trip_id):
             trip.end_date = datetime.fromisoformat(data['end_date']).date()
         if 'cover_photo_url' in data:
             trip.cover_photo_url = data['cover_photo_url']
+        was_public = trip.is_public
         if 'is_public' in data:
             trip.is_public = data['is_public']
         
+        db.session.flush()
+        queue_event(db.session, trip.id, 'trip.updated', trip.to_dict())
+        if was_public and not trip.is_public:
+            queue_event(db.session, trip.id, 'trip.unshared', {'id': trip.id})
         db.session.commit()
         
-        return jsonify({
+        return with_etag(jsonify({
             'message': 'Trip updated successfully',
             'trip': trip.to_dict(include_stops=True)
-        }), 200
+        }), trip), 200
         
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed(Trip.query.get(trip_id))
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -443,7 +633,9 @@ def delete_trip(trip_id):
             return jsonify({'error': 'Unauthorized'}), 403
         
         db.session.delete(trip)
+        queue_event(db.session, trip_id, 'trip.deleted', {'id': trip_id})
         db.session.commit()
+        app.extensions[TRIP_PDF_RENDERER_KEY].discard(trip_id)
         
         return jsonify({'message': 'Trip deleted successfully'}), 200
         
@@ -452,6 +644,75 @@ def delete_trip(trip_id):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/trips/<int:trip_id>/export.ics', methods=['GET'])
+@login_required
+@prefer_reader
+def export_trip_calendar(trip_id):
+    """Trip stops and itinerary activities as an iCalendar file"""
+    try:
+        user_id = get_jwt_identity()
+        trip = load_trip(trip_id)
+        
+        if not trip:
+            return jsonify({'error': 'Trip not found'}), 404
+        
+        if trip.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        name = download_name(trip, 'ics')
+        response = app.response_class(render_ics(trip_document(trip)), mimetype='text/calendar')
+        response.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+        response.set_etag(f'trip-{trip.id}-{trip.version}-{trip_change_seq(user_id, trip.id)}')
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/trips/<int:trip_id>/export.pdf', methods=['GET'])
+@login_required
+@prefer_reader
+def export_trip_pdf(trip_id):
+    """Trip, budget and AI itinerary as a PDF; 202 while the PDF is still being rendered"""
+    try:
+        user_id = get_jwt_identity()
+        trip = Trip.query.get(trip_id)
+        
+        if not trip:
+            return jsonify({'error': 'Trip not found'}), 404
+        
+        if trip.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        renderer = app.extensions[TRIP_PDF_RENDERER_KEY]
+        version = (trip.version, trip_change_seq(user_id, trip.id))
+        name = download_name(trip, 'pdf')
+        # The document is only read when this version has no render on disk or in progress
+        path, done = renderer.request(trip.id, version, lambda: trip_document(load_trip(trip_id)))
+        if path is None:
+            done.wait(app.config['TRIP_PDF_WAIT_SECONDS'])
+            error = renderer.error(renderer.path(trip.id, version))
+            if error:
+                return jsonify({'error': f'Rendering the PDF failed: {error}'}), 500
+            if done.is_set():
+                path = renderer.path(trip.id, version)
+        if path is None:
+            response = jsonify({'status': 'rendering', 'message': 'The PDF is being rendered, try again shortly'})
+            response.headers['Retry-After'] = '2'
+            return response, 202
+        
+        response = send_file(path, mimetype='application/pdf', as_attachment=True, download_name=name, max_age=0)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+        
+    except RendererBusy as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ==================== STOP (CITY) ENDPOINTS ====================
 
 @app.route('/api/trips/<int:trip_id>/stops', methods=['POST'])
@@ -478,23 +739,22 @@ def add_stop(trip_id):
         if not city_id or not start_date or not end_date:
             return jsonify({'error': 'city_id, start_date, and end_date are required'}), 400
         
-        # Determine order index (supports inserting in the middle)
-        max_order = db.session.query(db.func.max(Stop.order_index)).filter_by(trip_id=trip_id).scalar() or 0
+        # Determine order (supports inserting in the middle); only the new row is written
+        keys = trip_stop_keys(trip_id)
         if insert_order is None:
-            order_index = max_order + 1
+            order_index = len(keys) + 1
         else:
             try:
                 order_index = int(insert_order)
             except ValueError:
                 return jsonify({'error': 'order_index must be an integer'}), 400
-            order_index = max(1, min(order_index, max_order + 1))
-            if order_index <= max_order:
-                # Shift existing stops down to make room
-                Stop.query.filter(Stop.trip_id == trip_id, Stop.order_index >= order_index).update({Stop.order_index: Stop.order_index + 1}, synchronize_session=False)
+            order_index = max(1, min(order_index, len(keys) + 1))
+        sort_key = key_for_position(keys, order_index)
         
         stop = Stop(
             trip_id=trip_id,
             city_id=city_id,
+            sort_key=sort_key,
             order_index=order_index,
             start_date=start_date,
             end_date=end_date,
@@ -502,11 +762,16 @@ def add_stop(trip_id):
         )
         
         db.session.add(stop)
+        db.session.flush()
+        queue_event(db.session, trip_id, 'stop.added', stop.to_dict(include_activities=True, order_index=order_index))
         db.session.commit()
         
+        if needs_rebalance(sort_key):
+            schedule_rebalance(trip_id)
+        
         return jsonify({
             'message': 'Stop added successfully',
-            'stop': stop.to_dict(include_activities=True)
+            'stop': stop.to_dict(include_activities=True, fieldset=Fieldset.from_request('stop'), order_index=order_index)
         }), 201
         
     except Exception as e:
@@ -528,6 +793,9 @@ def update_stop(stop_id):
         if stop.trip.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
+        if if_match_failed(stop):
+            return precondition_failed(stop)
+        
         data = request.json
         
         if 'start_date' in data:
@@ -536,38 +804,35 @@ def update_stop(stop_id):
             stop.end_date = datetime.fromisoformat(data['end_date']).date()
         if 'notes' in data:
             stop.notes = data['notes']
+        moved_key = None
         if 'order_index' in data:
-            total = Stop.query.filter_by(trip_id=stop.trip_id).count()
             try:
                 new_order = int(data['order_index'])
             except ValueError:
                 return jsonify({'error': 'order_index must be an integer'}), 400
-            new_order = max(1, min(new_order, total))
-            old_order = stop.order_index
-            if new_order != old_order:
-                if new_order < old_order:
-                    # Shift down: increment those in target range
-                    Stop.query.filter(
-                        Stop.trip_id == stop.trip_id,
-                        Stop.order_index >= new_order,
-                        Stop.order_index < old_order
-                    ).update({Stop.order_index: Stop.order_index + 1}, synchronize_session=False)
-                else:
-                    # Shift up: decrement those between old and new
-                    Stop.query.filter(
-                        Stop.trip_id == stop.trip_id,
-                        Stop.order_index <= new_order,
-                        Stop.order_index > old_order
-                    ).update({Stop.order_index: Stop.order_index - 1}, synchronize_session=False)
-                stop.order_index = new_order
+            # Place between the neighbours at the new position; other stops keep their keys
+            with db.session.no_autoflush:
+                others = trip_stop_keys(stop.trip_id, exclude_id=stop.id)
+                new_order = max(1, min(new_order, len(others) + 1))
+                if stop.position() != new_order:
+                    moved_key = key_for_position(others, new_order)
+                    stop.sort_key = moved_key
         
+        db.session.flush()
+        queue_event(db.session, stop.trip_id, 'stop.moved' if moved_key else 'stop.updated', stop.to_dict())
         db.session.commit()
         
-        return jsonify({
+        if needs_rebalance(moved_key):
+            schedule_rebalance(stop.trip_id)
+        
+        return with_etag(jsonify({
             'message': 'Stop updated successfully',
-            'stop': stop.to_dict(include_activities=True)
-        }), 200
+            'stop': stop.to_dict(include_activities=True, fieldset=Fieldset.from_request('stop'))
+        }), stop), 200
         
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed(Stop.query.get(stop_id))
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -588,6 +853,7 @@ def delete_stop(stop_id):
             return jsonify({'error': 'Unauthorized'}), 403
         
         db.session.delete(stop)
+        queue_event(db.session, stop.trip_id, 'stop.removed', {'id': stop.id, 'trip_id': stop.trip_id})
         db.session.commit()
         
         return jsonify({'message': 'Stop deleted successfully'}), 200
@@ -633,6 +899,8 @@ def add_activity_to_stop(stop_id):
         )
         
         db.session.add(itinerary_activity)
+        db.session.flush()
+        queue_event(db.session, stop.trip_id, 'activity.added', itinerary_activity.to_dict())
         db.session.commit()
         
         return jsonify({
@@ -660,6 +928,10 @@ def remove_activity_from_itinerary(activity_id):
             return jsonify({'error': 'Unauthorized'}), 403
         
         db.session.delete(itinerary_activity)
+        queue_event(db.session, itinerary_activity.stop.trip_id, 'activity.removed', {
+            'id': itinerary_activity.id,
+            'stop_id': itinerary_activity.stop_id
+        })
         db.session.commit()
         
         return jsonify({'message': 'Activity removed from itinerary'}), 200
@@ -669,10 +941,52 @@ def remove_activity_from_itinerary(activity_id):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/trips/<int:trip_id>/itinerary', methods=['PATCH'])
+@login_required
+def patch_itinerary(trip_id):
+    """Apply a batch of stop and activity operations in one transaction"""
+    try:
+        user_id = get_jwt_identity()
+        trip = Trip.query.get(trip_id)
+        
+        if not trip:
+            return jsonify({'error': 'Trip not found'}), 404
+        
+        if trip.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        data = request.json or {}
+        
+        batch = ItineraryBatch(trip)
+        try:
+            created = batch.apply(data.get('operations'))
+        except ItineraryBatchError as e:
+            db.session.rollback()
+            return jsonify({'error': e.message, 'operation_index': e.index}), e.status
+        
+        for event_type, data in batch.events:
+            queue_event(db.session, trip_id, event_type, data)
+        db.session.commit()
+        
+        if batch.needs_rebalance:
+            schedule_rebalance(trip_id)
+        
+        return jsonify({
+            'message': 'Itinerary updated successfully',
+            'created': created,
+            'trip': load_trip(trip_id).to_dict(include_stops=True, fieldset=Fieldset.from_request('trip'))
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 # ==================== ACTIVITY SEARCH & BROWSE ENDPOINTS ====================
 
 @app.route('/api/cities/<int:city_id>/activities', methods=['GET'])
 @login_required
+@prefer_reader
 def browse_activities_by_city(city_id):
     """Browse activities in a city with filters"""
     try:
@@ -687,6 +1001,7 @@ def browse_activities_by_city(city_id):
         max_duration = request.args.get('max_duration', type=float)
         limit = request.args.get('limit', 20, type=int)
         offset = request.args.get('offset', 0, type=int)
+        fieldset = Fieldset.from_request('activity')
         
         query = Activity.query.filter_by(city_id=city_id)
         
@@ -703,24 +1018,14 @@ def browse_activities_by_city(city_id):
         # Get total count
         total_count = query.count()
         
-        # If no activities in DB, generate using Groq
-        if total_count == 0:
+        # If no activities in DB, generate using Groq (within the user's AI quota)
+        if total_count == 0 and not quota_exceeded(get_jwt_identity()):
             try:
                 ai_activities = groq_service.suggest_activities(city.name, ['cultural', 'adventure', 'food'], budget_per_activity=1500)
                 
                 # Save generated activities to database
                 if ai_activities and 'activities' in ai_activities:
-                    for act_data in ai_activities['activities']:
-                        new_activity = Activity(
-                            city_id=city_id,
-                            name=act_data.get('name', 'Activity'),
-                            description=act_data.get('description', ''),
-                            category=act_data.get('category', 'sightseeing'),
-                            estimated_cost=act_data.get('estimated_cost', 1000),
-                            duration_hours=act_data.get('duration_hours', 2.0)
-                        )
-                        db.session.add(new_activity)
-                    db.session.commit()
+                    save_generated_activities(city_id, ai_activities['activities'])
                     # Re-query after adding activities
                     query = Activity.query.filter_by(city_id=city_id)
                     if category:
@@ -731,16 +1036,17 @@ def browse_activities_by_city(city_id):
                         query = query.filter(Activity.duration_hours <= max_duration)
                     total_count = query.count()
             except Exception as groq_err:
+                db.session.rollback()
                 print(f"Groq error generating activities: {groq_err}")
                 # Continue with empty results if Groq fails
                 pass
         
         # Apply pagination
-        activities = query.order_by(Activity.estimated_cost).limit(limit).offset(offset).all()
+        activities = fieldset.apply(query, Activity, 'activity').order_by(Activity.estimated_cost).limit(limit).offset(offset).all()
         
-        return jsonify({
-            'city': city.to_dict(),
-            'activities': [a.to_dict() for a in activities],
+        return listing_response({
+            'city': city.to_dict(fieldset=fieldset),
+            'activities': [a.to_dict(fieldset=fieldset) for a in activities],
             'pagination': {
                 'total': total_count,
                 'limit': limit,
@@ -748,7 +1054,7 @@ def browse_activities_by_city(city_id):
                 'has_more': (offset + limit) < total_count
             },
             'available_categories': ['sightseeing', 'food', 'adventure', 'culture', 'shopping']
-        }), 200
+        }, 'activities')
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -756,6 +1062,7 @@ def browse_activities_by_city(city_id):
 
 @app.route('/api/activities/search', methods=['GET'])
 @login_required
+@prefer_reader
 def search_activities():
     """Search activities across all cities"""
     try:
@@ -765,14 +1072,15 @@ def search_activities():
         city_id = request.args.get('city_id', type=int)
         limit = request.args.get('limit', 20, type=int)
         offset = request.args.get('offset', 0, type=int)
+        fieldset = Fieldset.from_request('activity')
         
         query = Activity.query
         
         # Text search on name and description
         if query_str:
             query = query.filter(
-                (Activity.name.ilike(f'%{query_str}%')) |
-                (Activity.description.ilike(f'%{query_str}%'))
+                (icontains(Activity.name, query_str)) |
+                (icontains(Activity.description, query_str))
             )
         
         # Filter by category
@@ -789,8 +1097,8 @@ def search_activities():
         
         total_count = query.count()
         
-        # If no results found and searching by city, try Groq
-        if total_count == 0 and city_id:
+        # If no results found and searching by city, try Groq (within the user's AI quota)
+        if total_count == 0 and city_id and not quota_exceeded(get_jwt_identity()):
             try:
                 city = City.query.get(city_id)
                 if city:
@@ -804,23 +1112,13 @@ def search_activities():
                     
                     # Save generated activities to database
                     if ai_activities and 'activities' in ai_activities:
-                        for act_data in ai_activities['activities']:
-                            new_activity = Activity(
-                                city_id=city_id,
-                                name=act_data.get('name', 'Activity'),
-                                description=act_data.get('description', ''),
-                                category=act_data.get('category', 'sightseeing'),
-                                estimated_cost=act_data.get('estimated_cost', 1000),
-                                duration_hours=act_data.get('duration_hours', 2.0)
-                            )
-                            db.session.add(new_activity)
-                        db.session.commit()
+                        save_generated_activities(city_id, ai_activities['activities'])
                         # Re-query after adding activities
                         query = Activity.query
                         if query_str:
                             query = query.filter(
-                                (Activity.name.ilike(f'%{query_str}%')) |
-                                (Activity.description.ilike(f'%{query_str}%'))
+                                (icontains(Activity.name, query_str)) |
+                                (icontains(Activity.description, query_str))
                             )
                         if category:
                             query = query.filter_by(category=category)
@@ -830,20 +1128,21 @@ def search_activities():
                             query = query.filter_by(city_id=city_id)
                         total_count = query.count()
             except Exception as groq_err:
+                db.session.rollback()
                 print(f"Groq error generating activities: {groq_err}")
                 pass
         
-        activities = query.order_by(Activity.estimated_cost).limit(limit).offset(offset).all()
+        activities = fieldset.apply(query, Activity, 'activity').order_by(Activity.estimated_cost).limit(limit).offset(offset).all()
         
-        return jsonify({
-            'activities': [a.to_dict() for a in activities],
+        return listing_response({
+            'activities': [a.to_dict(fieldset=fieldset) for a in activities],
             'pagination': {
                 'total': total_count,
                 'limit': limit,
                 'offset': offset,
                 'has_more': (offset + limit) < total_count
             }
-        }), 200
+        }, 'activities')
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -851,15 +1150,22 @@ def search_activities():
 
 @app.route('/api/activities/categories', methods=['GET'])
 @login_required
+@prefer_reader
 def get_activity_categories():
     """Get all available activity categories with stats"""
     try:
         categories = ['sightseeing', 'food', 'adventure', 'culture', 'shopping']
         
+        rows = db.session.query(
+            Activity.category,
+            db.func.count(Activity.id),
+            db.func.avg(Activity.estimated_cost)
+        ).filter(Activity.category.in_(categories)).group_by(Activity.category).all()
+        aggregates = {category: (count, avg_cost) for category, count, avg_cost in rows}
+        
         stats = {}
         for cat in categories:
-            count = Activity.query.filter_by(category=cat).count()
-            avg_cost = db.session.query(db.func.avg(Activity.estimated_cost)).filter_by(category=cat).scalar()
+            count, avg_cost = aggregates.get(cat, (0, None))
             stats[cat] = {
                 'count': count,
                 'average_cost': float(avg_cost) if avg_cost else 0
@@ -883,6 +1189,10 @@ def refresh_activities_for_city(city_id):
         if not city:
             return jsonify({'error': 'City not found'}), 404
         
+        user_id = get_jwt_identity()
+        if quota_exceeded(user_id):
+            return quota_exceeded_response(user_id)
+        
         # Get interests from request or use defaults
         data = request.json or {}
         interests = data.get('interests', ['cultural', 'adventure', 'food'])
@@ -894,37 +1204,19 @@ def refresh_activities_for_city(city_id):
             
             new_activities_count = 0
             if ai_activities and 'activities' in ai_activities:
-                for act_data in ai_activities['activities']:
-                    # Check if activity already exists
-                    existing = Activity.query.filter_by(
-                        city_id=city_id,
-                        name=act_data.get('name', '')
-                    ).first()
-                    
-                    if not existing:
-                        new_activity = Activity(
-                            city_id=city_id,
-                            name=act_data.get('name', 'Activity'),
-                            description=act_data.get('description', ''),
-                            category=act_data.get('category', 'sightseeing'),
-                            estimated_cost=act_data.get('estimated_cost', 1000),
-                            duration_hours=act_data.get('duration_hours', 2.0)
-                        )
-                        db.session.add(new_activity)
-                        new_activities_count += 1
-                
-                if new_activities_count > 0:
-                    db.session.commit()
+                # Activities the city already has are skipped
+                new_activities_count = save_generated_activities(city_id, ai_activities['activities'])
             
             # Get all activities for the city
-            all_activities = Activity.query.filter_by(city_id=city_id).all()
+            fieldset = Fieldset.from_request('activity')
+            all_activities = fieldset.apply(Activity.query, Activity, 'activity').filter_by(city_id=city_id).all()
             
-            return jsonify({
+            return listing_response({
                 'message': f'Refreshed activities for {city.name}',
                 'new_activities_added': new_activities_count,
                 'total_activities': len(all_activities),
-                'activities': [a.to_dict() for a in all_activities]
-            }), 200
+                'activities': [a.to_dict(fieldset=fieldset) for a in all_activities]
+            }, 'activities')
             
         except Exception as groq_err:
             return jsonify({
@@ -939,6 +1231,7 @@ def refresh_activities_for_city(city_id):
 
 @app.route('/api/trips/<int:trip_id>/budget', methods=['GET'])
 @login_required
+@prefer_reader
 def get_trip_budget(trip_id):
     """Get budget for a trip"""
     try:
@@ -951,32 +1244,10 @@ def get_trip_budget(trip_id):
         if trip.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        if not trip.budget:
-            # Create budget if not exists
-            budget = Budget(trip_id=trip_id)
-            db.session.add(budget)
-            db.session.commit()
-        
-        # Calculate activities cost
-        activities_cost = 0
-        for stop in trip.stops:
-            for activity in stop.itinerary_activities:
-                activities_cost += activity.estimated_cost_override or activity.activity.estimated_cost
-        
-        trip.budget.activities_cost = activities_cost
-        
-        # Calculate total
-        trip.budget.total_budget = (
-            trip.budget.transport_cost +
-            trip.budget.accommodation_cost +
-            trip.budget.food_cost +
-            trip.budget.activities_cost +
-            trip.budget.misc_cost
-        )
-        
-        db.session.commit()
-        
-        return jsonify({'budget': trip.budget.to_dict()}), 200
+        # Read-only: the live activities cost is reported, not stored (PUT stores it)
+        budget = trip.budget or Budget.empty(trip_id)
+        response = jsonify({'budget': budget.to_dict(activities_cost=trip_activities_cost(trip_id))})
+        return with_etag(response, trip.budget), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -996,8 +1267,14 @@ def update_trip_budget(trip_id):
         if trip.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
+        if if_match_failed(trip.budget):
+            return precondition_failed(trip.budget)
+        
+        # Queried before any change so the budget is flushed (and versioned) once
+        activities_cost = trip_activities_cost(trip_id)
+        
         if not trip.budget:
-            budget = Budget(trip_id=trip_id)
+            budget = Budget.empty(trip_id)
             db.session.add(budget)
         else:
             budget = trip.budget
@@ -1016,26 +1293,89 @@ def update_trip_budget(trip_id):
             budget.currency = data['currency']
         
         # Recalculate total
-        budget.total_budget = (
-            budget.transport_cost +
-            budget.accommodation_cost +
-            budget.food_cost +
-            budget.activities_cost +
-            budget.misc_cost
-        )
+        budget.recalculate(activities_cost)
         
+        db.session.flush()
+        queue_event(db.session, trip_id, 'budget.changed', budget.to_dict())
         db.session.commit()
         
-        return jsonify({
+        return with_etag(jsonify({
             'message': 'Budget updated successfully',
             'budget': budget.to_dict()
-        }), 200
+        }), budget), 200
         
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed(Budget.query.filter_by(trip_id=trip_id).first())
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+def budget_forecast_response(trip, specs, scenario_stops=True):
+    baseline, scenarios = forecast_trip(trip.id, specs, rates_from_config(app.config), scenario_stops)
+    body = {
+        'currency': trip.budget.currency if trip.budget else 'INR',
+        'budget_total': trip.budget.total_budget if trip.budget else None,
+        'forecast': baseline,
+    }
+    if specs:
+        body['scenarios'] = scenarios
+    return jsonify(body)
+
+
+@app.route('/api/trips/<int:trip_id>/budget/forecast', methods=['GET'])
+@login_required
+@prefer_reader
+def get_budget_forecast(trip_id):
+    """Projected trip costs from city cost indexes, stop lengths and distances"""
+    try:
+        user_id = get_jwt_identity()
+        trip = Trip.query.get(trip_id)
+        
+        if not trip:
+            return jsonify({'error': 'Trip not found'}), 404
+        
+        if trip.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        return budget_forecast_response(trip, []), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/trips/<int:trip_id>/budget/forecast', methods=['POST'])
+@login_required
+@prefer_reader
+def forecast_budget_scenarios(trip_id):
+    """Projected trip costs for what-if scenarios (nothing is saved)"""
+    try:
+        user_id = get_jwt_identity()
+        trip = Trip.query.get(trip_id)
+        
+        if not trip:
+            return jsonify({'error': 'Trip not found'}), 404
+        
+        if trip.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        specs = data.get('scenarios', [])
+        if isinstance(specs, list) and len(specs) > app.config['FORECAST_MAX_SCENARIOS']:
+            return jsonify({'error': f"At most {app.config['FORECAST_MAX_SCENARIOS']} scenarios per request"}), 400
+        
+        return budget_forecast_response(trip, specs, bool(data.get('include_stops', True))), 200
+        
+    except ForecastError as e:
+        body = {'error': e.message}
+        if e.index is not None:
+            body['scenario_index'] = e.index
+        return jsonify(body), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ==================== AI ITINERARY GENERATION ====================
 
 @app.route('/api/trips/<int:trip_id>/generate-itinerary', methods=['POST'])
@@ -1052,6 +1392,9 @@ def generate_ai_itinerary(trip_id):
         if trip.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
+        if quota_exceeded(user_id):
+            return quota_exceeded_response(user_id)
+        
         data = request.json
         budget_min = data.get('budget_min', 1000)
         budget_max = data.get('budget_max', 5000)
@@ -1079,7 +1422,12 @@ def generate_ai_itinerary(trip_id):
         )
 
         # Persist AI itinerary to trip for future display
-        trip.ai_itinerary = json.dumps(itinerary_data)
+        trip.set_ai_itinerary(itinerary_data)
+        queue_event(db.session, trip.id, 'itinerary.generated', {
+            'id': trip.id,
+            'ai_day_count': trip.ai_day_count,
+            'ai_total_cost': trip.ai_total_cost
+        })
         db.session.commit()
         
         return jsonify({
@@ -1094,8 +1442,54 @@ def generate_ai_itinerary(trip_id):
 # ==================== SHARED/PUBLIC TRIP ENDPOINTS ====================
 
 @app.route('/api/trips/shared/<share_code>', methods=['GET'])
+@cached_response('shared_trip', 'SHARED_TRIP_CACHE_SECONDS')
+@prefer_reader
 def get_shared_trip(share_code):
     """Get public/shared trip"""
+    try:
+        fieldset = Fieldset.from_request('trip')
+        trip = fieldset.apply(Trip.query, Trip, 'trip', always=('is_public',)).filter_by(share_code=share_code).first()
+        
+        if not trip:
+            return jsonify({'error': 'Trip not found'}), 404
+        
+        if not trip.is_public:
+            return jsonify({'error': 'Trip is not public'}), 403
+        
+        try:
+            itinerary_days = parse_day_numbers(request.args.get('itinerary_days'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({'trip': trip.to_dict(include_stops=True, itinerary_days=itinerary_days, fieldset=fieldset)}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/trips/<int:trip_id>/events', methods=['GET'])
+@login_required
+def stream_trip_events(trip_id):
+    """Stream a trip's change events (Server-Sent Events)"""
+    try:
+        user_id = get_jwt_identity()
+        trip = Trip.query.get(trip_id)
+        
+        if not trip:
+            return jsonify({'error': 'Trip not found'}), 404
+        
+        if trip.user_id != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        return sse_response(trip.id)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/trips/shared/<share_code>/events', methods=['GET'])
+def stream_shared_trip_events(share_code):
+    """Stream a public trip's change events; ends when the trip stops being public"""
     try:
         trip = Trip.query.filter_by(share_code=share_code).first()
         
@@ -1105,7 +1499,7 @@ def get_shared_trip(share_code):
         if not trip.is_public:
             return jsonify({'error': 'Trip is not public'}), 403
         
-        return jsonify({'trip': trip.to_dict(include_stops=True)}), 200
+        return sse_response(trip.id, end_on=('trip.deleted', 'trip.unshared'))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1136,12 +1530,14 @@ def copy_trip(trip_id):
         db.session.add(new_trip)
         db.session.flush()
         
-        # Copy stops
-        for stop in original_trip.stops:
+        # Copy stops (with freshly spaced sort keys)
+        stop_keys = spread_keys(len(original_trip.stops))
+        for position, stop in enumerate(original_trip.stops, start=1):
             new_stop = Stop(
                 trip_id=new_trip.id,
                 city_id=stop.city_id,
-                order_index=stop.order_index,
+                sort_key=stop_keys[position - 1],
+                order_index=position,
                 start_date=stop.start_date,
                 end_date=stop.end_date,
                 notes=stop.notes
@@ -1191,14 +1587,16 @@ def copy_trip(trip_id):
 
 @app.route('/api/saved-destinations', methods=['GET'])
 @login_required
+@prefer_reader
 def get_saved_destinations():
     """Get user's saved destinations"""
     try:
         user_id = get_jwt_identity()
-        saved = SavedDestination.query.filter_by(user_id=user_id).order_by(SavedDestination.saved_at.desc()).all()
+        fieldset = Fieldset.from_request('saved_destination')
+        saved = fieldset.apply(SavedDestination.query, SavedDestination, 'saved_destination').filter_by(user_id=user_id).order_by(SavedDestination.saved_at.desc()).all()
         
         return jsonify({
-            'destinations': [item.to_dict() for item in saved],
+            'destinations': [item.to_dict(fieldset=fieldset) for item in saved],
             'count': len(saved)
         }), 200
         
@@ -1261,21 +1659,49 @@ def remove_saved_destination(saved_id):
         return jsonify({'error': str(e)}), 500
 
 
+# ==================== SYNC ====================
+
+@app.route('/api/sync', methods=['GET'])
+@login_required
+@prefer_reader
+def sync_changes():
+    """Trips, stops, itinerary activities, budgets and saved destinations changed since a cursor"""
+    try:
+        user_id = get_jwt_identity()
+        since = request.args.get('since')
+        
+        # No cursor: everything, plus the cursor to continue from
+        if since is None:
+            return jsonify(snapshot(user_id)), 200
+        
+        try:
+            since = int(since)
+            limit = int(request.args.get('limit', 500))
+        except ValueError:
+            return jsonify({'error': 'since and limit must be integers'}), 400
+        limit = max(1, min(limit, 1000))
+        
+        return jsonify(changes_since(user_id, since, limit)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ==================== DASHBOARD/STATS ENDPOINTS ====================
 
 @app.route('/api/dashboard/stats', methods=['GET'])
 @login_required
+@prefer_reader
 def get_dashboard_stats():
     """Get dashboard statistics"""
     try:
         user_id = get_jwt_identity()
         
-        # Count trips
-        total_trips = Trip.query.filter_by(user_id=user_id).count()
-        upcoming_trips = Trip.query.filter(
-            Trip.user_id == user_id,
-            Trip.start_date >= date.today()
-        ).count()
+        # Count trips (total and upcoming in one pass)
+        total_trips, upcoming_trips = db.session.query(
+            db.func.count(Trip.id),
+            db.func.coalesce(db.func.sum(db.case((Trip.start_date >= date.today(), 1), else_=0)), 0)
+        ).filter(Trip.user_id == user_id).one()
         
         # Recent trips
         recent_trips = Trip.query.filter_by(user_id=user_id).order_by(Trip.updated_at.desc()).limit(5).all()
@@ -1299,14 +1725,17 @@ def get_dashboard_stats():
 
 
 @app.route('/api/popular-cities', methods=['GET'])
+@cached_response('popular_cities', 'POPULAR_CITIES_CACHE_SECONDS')
+@prefer_reader
 def get_popular_cities():
     """Get popular cities"""
     try:
         limit = request.args.get('limit', 10, type=int)
-        cities = City.query.order_by(City.popularity_score.desc()).limit(limit).all()
+        fieldset = Fieldset.from_request('city')
+        cities = fieldset.apply(City.query, City, 'city').order_by(City.popularity_score.desc()).limit(limit).all()
         
         return jsonify({
-            'cities': [city.to_dict() for city in cities]
+            'cities': [city.to_dict(fieldset=fieldset) for city in cities]
         }), 200
         
     except Exception as e:
@@ -1324,13 +1753,68 @@ def health_check():
     }), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this process"""
+    if not metrics_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return app.response_class(render_metrics(), content_type=METRICS_CONTENT_TYPE), 200
+
+
+# ==================== ADMIN ENDPOINTS ====================
+
+@app.route('/api/admin/llm-usage', methods=['GET'])
+@admin_required
+@prefer_reader
+def get_llm_usage_report():
+    """Groq calls, tokens, latency and estimated cost, grouped by day, user and method"""
+    try:
+        days = request.args.get('days', 30, type=int)
+        if days is None or not 1 <= days <= 366:
+            return jsonify({'error': 'days must be between 1 and 366'}), 400
+        
+        group_by = [name.strip() for name in request.args.get('group_by', 'day,user,method').split(',') if name.strip()]
+        unknown = [name for name in group_by if name not in LLM_USAGE_GROUP_COLUMNS]
+        if unknown or len(set(group_by)) != len(group_by):
+            return jsonify({'error': f"group_by must be distinct values of: {', '.join(LLM_USAGE_GROUP_COLUMNS)}"}), 400
+        
+        return jsonify(usage_report(days, group_by)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/profiling', methods=['GET'])
+@admin_required
+def get_profiling_settings():
+    """Sampling profiler settings of this process"""
+    return jsonify(app.extensions[PROFILER_KEY].settings()), 200
+
+
+@app.route('/api/admin/profiling', methods=['PUT'])
+@admin_required
+def update_profiling_settings():
+    """Turn the sampling profiler on or off, or change what it samples (this process only)"""
+    try:
+        profiler = app.extensions[PROFILER_KEY]
+        error = profiler.update(request.get_json(silent=True) or {})
+        if error:
+            return jsonify({'error': error}), 400
+        
+        return jsonify(profiler.settings()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ==================== DATABASE INITIALIZATION ====================
 
 @app.cli.command()
 def init_db():
     """Initialize database"""
     db.create_all()
-    _ensure_ai_itinerary_column()
+    run_migrations(db.engine, verbose=True)
     print("Database initialized successfully!")
 
 
@@ -1429,10 +1913,160 @@ def seed_db():
     print("Database seeded with sample data and activities!")
 
 
+@app.cli.command()
+def migrate_db():
+    """Apply pending schema migrations"""
+    applied = run_migrations(db.engine, verbose=True)
+    if not applied:
+        print("Database schema is up to date.")
+
+
+@app.cli.command()
+def rebalance_stops():
+    """Respace stop sort keys of trips whose keys have grown long"""
+    trip_ids = [row[0] for row in db.session.query(Stop.trip_id).group_by(Stop.trip_id).having(
+        db.func.max(db.func.length(Stop.sort_key)) > REBALANCE_KEY_LENGTH
+    )]
+    for trip_id in trip_ids:
+        rebalance_trip_stops(trip_id)
+        db.session.commit()
+    print(f"Rebalanced stops of {len(trip_ids)} trip(s).")
+
+
+@app.cli.command('generate-dataset')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--cities', default=500, show_default=True)
+@click.option('--activities', default=10000, show_default=True)
+@click.option('--trips', default=3000, show_default=True)
+@click.option('--stops-per-trip', default=4.0, show_default=True, help='Average stops per trip')
+@click.option('--activities-per-stop', default=3.0, show_default=True, help='Average itinerary activities per stop')
+@click.option('--saved-per-user', default=3.0, show_default=True, help='Average saved destinations per user')
+@click.option('--seed', default=42, show_default=True, help='Same seed and sizes give the same data')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per insert transaction')
+def generate_dataset(users, cities, activities, trips, stops_per_trip, activities_per_stop, saved_per_user, seed, batch_size):
+    """Add a synthetic dataset for performance testing (see dataset.py)"""
+    if min(users, cities, activities, trips) < 0 or batch_size < 1:
+        raise click.BadParameter('sizes cannot be negative and --batch-size must be positive')
+    if trips and not users:
+        raise click.BadParameter('--trips needs at least one user')
+    if (trips or users and saved_per_user) and not cities:
+        raise click.BadParameter('trips and saved destinations need at least one city')
+
+    scale = Scale(
+        users=users, cities=cities, activities=activities, trips=trips, stops_per_trip=stops_per_trip,
+        activities_per_stop=activities_per_stop, saved_per_user=saved_per_user
+    )
+    started = time.perf_counter()
+    last_report = [started]
+
+    def report(counts):
+        now = time.perf_counter()
+        if now - last_report[0] >= 2:
+            last_report[0] = now
+            print(f"  {now - started:6.1f}s  " + ', '.join(f'{table} {count}' for table, count in counts.items()))
+
+    result = generate_synthetic_dataset(db.engine, scale, seed=seed, batch_size=batch_size, progress=report)
+    elapsed = time.perf_counter() - started
+    rows = sum(result['counts'].values())
+    print(f"Inserted {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s):")
+    for table, count in result['counts'].items():
+        print(f"  {table:22} {count}")
+    print(f"Users sign in as dataset-user-<id>@example.com (ids {result['users'][0]}-{result['users'][1]}).")
+
+
+@app.cli.command('import-catalogue')
+@click.argument('kind', type=click.Choice(CATALOGUE_KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(CATALOGUE_FORMATS), help='Default: from the file extension')
+@click.option('--chunk-size', default=5000, show_default=True, help='Records per transaction')
+def import_catalogue_command(kind, path, file_format, chunk_size):
+    """Upsert cities or activities from a CSV or NDJSON file ('-' for stdin, see catalogue.py)"""
+    if chunk_size < 1:
+        raise click.BadParameter('--chunk-size must be positive')
+    try:
+        file_format = detect_format(path, file_format)
+    except CatalogueError as e:
+        raise click.UsageError(str(e))
+    started = time.perf_counter()
+    last_report = [started]
+
+    def report(result):
+        now = time.perf_counter()
+        if now - last_report[0] >= 2:
+            last_report[0] = now
+            print(f"  {now - started:6.1f}s  read {result['read']}, inserted {result['inserted']}, "
+                  f"updated {result['updated']}, skipped {result['skipped']}")
+
+    f = open_file(path, 'r')
+    try:
+        result = import_catalogue(db.engine, kind, f, file_format, chunk_size=chunk_size, progress=report)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    elapsed = time.perf_counter() - started
+    for line_number, message in result['errors']:
+        print(f"  line {line_number}: {message}")
+    if result['skipped'] > len(result['errors']):
+        print(f"  ... and {result['skipped'] - len(result['errors'])} more")
+    print(f"Read {result['read']} {kind} in {elapsed:.1f}s ({result['read'] / elapsed if elapsed else 0:.0f}/s): "
+          f"{result['inserted']} inserted, {result['updated']} updated, {result['skipped']} skipped.")
+
+
+@app.cli.command('export-catalogue')
+@click.argument('kind', type=click.Choice(CATALOGUE_KINDS))
+@click.argument('path')
+@click.option('--format', 'file_format', type=click.Choice(CATALOGUE_FORMATS), help='Default: from the file extension')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows fetched at a time')
+def export_catalogue_command(kind, path, file_format, chunk_size):
+    """Write all cities or activities to a CSV or NDJSON file ('-' for stdout)"""
+    if chunk_size < 1:
+        raise click.BadParameter('--chunk-size must be positive')
+    try:
+        file_format = detect_format(path, file_format)
+    except CatalogueError as e:
+        raise click.UsageError(str(e))
+    started = time.perf_counter()
+    last_report = [started]
+
+    # Progress goes to stderr so the export can be piped from stdout
+    def report(count):
+        now = time.perf_counter()
+        if now - last_report[0] >= 2:
+            last_report[0] = now
+            click.echo(f"  {now - started:6.1f}s  {count} {kind}", err=True)
+
+    f = open_file(path, 'w')
+    try:
+        count = export_catalogue(db.engine, kind, f, file_format, chunk_size=chunk_size, progress=report)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        else:
+            f.flush()
+    click.echo(f"Exported {count} {kind} in {time.perf_counter() - started:.1f}s.", err=True)
+
+
+@app.cli.command('profile', context_settings={'ignore_unknown_options': True})
+@click.argument('command_name')
+@click.argument('args', nargs=-1, type=click.UNPROCESSED)
+@click.pass_context
+def profile_command(ctx, command_name, args):
+    """Run another command (e.g. seed-db) under the sampling profiler"""
+    command = app.cli.get_command(ctx, command_name)
+    if command is None:
+        raise click.UsageError(f"No such command '{command_name}'.")
+    with app.extensions[PROFILER_KEY].profile(command_name) as collector:
+        command.main(list(args), prog_name=command_name, standalone_mode=False, obj=ctx.obj)
+    if collector.filename:
+        print(f"Profile written to {os.path.join(app.config['PROFILING_OUTPUT_DIR'], collector.filename)}")
+    else:
+        print("No samples collected (the command finished within one sampling interval).")
+
+
 # ==================== RUN SERVER ====================
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-        _ensure_ai_itinerary_column()
+        run_migrations(db.engine)
     app.run(debug=True, port=5000, host='0.0.0.0')
@@ -0,0 +1,110 @@
+"""
+Budget forecast benchmark: vectorized scenarios vs. a per-stop Python loop.
+
+Builds a synthetic trip and a batch of what-if scenarios, then times
+forecast.compute() over the whole batch against the same formulas
+evaluated stop by stop, and checks both give the same totals.
+
+Usage: python benchmarks/budget_forecast.py [--stops 12] [--scenarios 500] [--repeat 20]
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+from datetime import date
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from config import Config
+from forecast import EARTH_RADIUS_KM, compute, rates_from_config
+
+START = date(2026, 1, 1).toordinal()
+
+
+def make_scenarios(stops, count):
+    rng = np.random.default_rng(42)
+    shape = (count, stops)
+    order = np.argsort(rng.random(shape), axis=1)
+    return SimpleNamespace(
+        start=np.take_along_axis(np.broadcast_to(rng.integers(START, START + 365, stops), shape), order, axis=1).copy(),
+        nights=np.take_along_axis(np.broadcast_to(rng.integers(1, 6, stops), shape), order, axis=1).copy(),
+        cost_index=np.take_along_axis(np.broadcast_to(rng.uniform(0.5, 2.0, stops), shape), order, axis=1).copy(),
+        latitude=np.take_along_axis(np.broadcast_to(rng.uniform(-60, 60, stops), shape), order, axis=1).copy(),
+        longitude=np.take_along_axis(np.broadcast_to(rng.uniform(-180, 180, stops), shape), order, axis=1).copy(),
+        activities_cost=rng.uniform(0, 5000, shape),
+        activity_hours=rng.uniform(0, 12, shape),
+    )
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(max(a, 0.0), 1.0)))
+
+
+def loop_totals(scenarios, rates):
+    """The forecast formulas, one stop at a time"""
+    start = scenarios.start.tolist()
+    nights = scenarios.nights.tolist()
+    cost_index = scenarios.cost_index.tolist()
+    latitude = scenarios.latitude.tolist()
+    longitude = scenarios.longitude.tolist()
+    activities = scenarios.activities_cost.tolist()
+    hours = scenarios.activity_hours.tolist()
+
+    totals = []
+    for s in range(len(nights)):
+        total = 0.0
+        for i in range(len(nights[s])):
+            days = max(nights[s][i], 1)
+            ci = cost_index[s][i]
+            season = sum(
+                rates['month_factors'][date.fromordinal(start[s][i] + day).month - 1] for day in range(days)
+            ) / days
+            distance = haversine(latitude[s][i - 1], longitude[s][i - 1], latitude[s][i], longitude[s][i]) if i else 0.0
+            total += nights[s][i] * rates['accommodation_per_night'] * ci * season
+            total += days * rates['food_per_day'] * ci
+            total += (days * rates['local_transport_per_day'] + hours[s][i] * rates['transport_per_activity_hour']) * ci
+            total += distance * rates['travel_per_km'] + activities[s][i]
+        totals.append(total)
+    return totals
+
+
+def vectorized_totals(scenarios, rates):
+    costs, _ = compute(scenarios, rates)
+    return sum(costs.values()).sum(axis=1)
+
+
+def timed(f, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = f()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=12)
+    parser.add_argument('--scenarios', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rates = rates_from_config(vars(Config))
+    scenarios = make_scenarios(args.stops, args.scenarios)
+
+    loop_time, expected = timed(lambda: loop_totals(scenarios, rates), args.repeat)
+    vector_time, actual = timed(lambda: vectorized_totals(scenarios, rates), args.repeat)
+    assert np.allclose(expected, actual), 'vectorized totals differ from the loop'
+
+    print(f'{args.scenarios} scenarios x {args.stops} stops')
+    print(f'  python loop:  {loop_time * 1000:8.2f} ms')
+    print(f'  numpy arrays: {vector_time * 1000:8.2f} ms  ({loop_time / vector_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+JSON encoding benchmark for the largest API payloads.
+
+Encodes a synthetic full trip graph (GET /api/trips/<id>) and an activity
+listing (GET /api/activities/search) with the stdlib and orjson backends
+of FastJSONProvider, and compares decode + re-encode of a stored AI
+itinerary against splicing its encoded text with RawJSON. The activity
+listing is also encoded in the columnar format and as MessagePack.
+
+Usage: python benchmarks/json_serialization.py [--stops 12] [--activities 10] [--days 14] [--repeat 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from serialization import FastJSONProvider, RawJSON, msgpack, orjson, splice_json_array, to_columnar
+
+
+def make_city(i):
+    return {
+        'id': i, 'name': f'City {i}', 'country': 'Country', 'region': 'Region',
+        'description': 'A long description of the city. ' * 8, 'cost_index': 1.2,
+        'popularity_score': 80, 'latitude': 12.34, 'longitude': 56.78, 'image_url': None,
+    }
+
+
+def make_activity(i, city_id):
+    return {
+        'id': i, 'city_id': city_id, 'name': f'Activity {i}', 'description': 'Something to do. ' * 6,
+        'category': 'culture', 'estimated_cost': 1500.0, 'duration_hours': 2.5, 'image_url': None,
+    }
+
+
+def make_itinerary(days):
+    return {
+        'days': [{
+            'day': d, 'title': f'Day {d}',
+            'activities': [{'name': f'Stop {d}.{a}', 'time': 'morning', 'description': 'Visit. ' * 10,
+                            'cost': 500, 'duration': 2.5, 'category': 'sightseeing'} for a in range(4)],
+            'accommodation': {'name': 'Hotel', 'cost': 3000, 'description': 'Nice hotel'},
+            'meals': [{'type': t, 'suggestion': 'Restaurant', 'cost': 400} for t in ('breakfast', 'lunch', 'dinner')],
+        } for d in range(1, days + 1)],
+        'budget_breakdown': {'accommodation': 21000, 'food': 7000, 'total': 45000},
+        'tips': ['Tip one', 'Tip two', 'Tip three'],
+    }
+
+
+def make_trip(stops, activities, itinerary):
+    return {'trip': {
+        'id': 1, 'name': 'Trip', 'description': 'Trip description',
+        'stops': [{
+            'id': s, 'trip_id': 1, 'city_id': s, 'city': make_city(s), 'order_index': s,
+            'start_date': '2026-01-01', 'end_date': '2026-01-03', 'notes': 'notes', 'duration_days': 3,
+            'activities': [{
+                'id': s * 100 + a, 'stop_id': s, 'activity_id': a, 'activity': make_activity(a, s),
+                'day_number': 1, 'time_of_day': 'morning', 'custom_notes': '', 'estimated_cost': 1500.0,
+            } for a in range(activities)],
+        } for s in range(stops)],
+        'ai_itinerary': itinerary,
+    }}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=12)
+    parser.add_argument('--activities', type=int, default=10)
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    itinerary = make_itinerary(args.days)
+    days = itinerary.pop('days')
+    meta_text = json.dumps(itinerary, separators=(',', ':'))
+    day_texts = [json.dumps(day, separators=(',', ':')) for day in days]
+    itinerary['days'] = days
+
+    listing = {'activities': [make_activity(i, 1) for i in range(500)], 'pagination': {'total': 500}}
+
+    backends = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    for backend in backends:
+        app = Flask(__name__)
+        app.config['JSON_BACKEND'] = backend
+        provider = FastJSONProvider(app)
+
+        def decode_reencode():
+            # What Trip.to_dict used to do with the stored itinerary text
+            stored = json.loads(splice_json_array(meta_text, 'days', day_texts))
+            return provider.dumps_bytes(make_trip(args.stops, args.activities, stored))
+
+        def spliced():
+            raw = RawJSON(splice_json_array(meta_text, 'days', day_texts))
+            return provider.dumps_bytes(make_trip(args.stops, args.activities, raw))
+
+        def activity_listing():
+            return provider.dumps_bytes(listing)
+
+        def activity_columnar():
+            return provider.dumps_bytes({**listing, 'activities': to_columnar(listing['activities'])})
+
+        size = len(spliced())
+        for name, fn in [('trip (decode+encode)', decode_reencode), ('trip (spliced)', spliced),
+                         ('activity listing', activity_listing), ('activity columnar', activity_columnar)]:
+            seconds = timeit.timeit(fn, number=args.repeat) / args.repeat
+            print(f'{backend:<7} {name:<22} {seconds * 1000:8.3f} ms')
+        print(f'{backend:<7} trip payload size      {size / 1024:8.1f} KB')
+        print(f'{backend:<7} listing size (rows)    {len(activity_listing()) / 1024:8.1f} KB')
+        print(f'{backend:<7} listing size (columns) {len(activity_columnar()) / 1024:8.1f} KB')
+
+    if msgpack is not None:
+        seconds = timeit.timeit(lambda: msgpack.packb(listing), number=args.repeat) / args.repeat
+        print(f'msgpack activity listing       {seconds * 1000:8.3f} ms')
+        print(f'msgpack listing size (rows)    {len(msgpack.packb(listing)) / 1024:8.1f} KB')
+
+
+if __name__ == '__main__':
+    main()
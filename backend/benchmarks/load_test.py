@@ -0,0 +1,336 @@
+"""
+Load test: scripted API workloads against a synthetic dataset.
+
+Creates a fresh database (SQLite in a temporary directory unless
+--database-url is given), fills it with dataset.generate() and replays
+each workload through Flask test clients on --concurrency threads, one
+signed-in dataset user per thread. GroqService answers from a local
+stub (--llm-latency-ms simulates the API's latency), so nothing leaves
+the machine.
+
+Per workload it reports p50/p95/p99 latency, throughput and the SQL
+statements per request, counted by instrumentation.py and read from the
+Server-Timing header. --save-baseline writes the results as JSON;
+--compare reads a baseline back and exits with status 1 when a
+workload's p95 grew by more than --tolerance or it runs more queries.
+
+Usage: python benchmarks/load_test.py [--users 50] [--requests 200] [--concurrency 4]
+           [--workloads trip_detail,search] [--save-baseline FILE] [--compare FILE]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SERVER_TIMING_QUERIES = re.compile(r'^db;.*desc="(\d+) queries"')
+SEARCH_TERMS = ('museum', 'tour', 'market', 'old', 'night', 'temple', 'food', 'walk')
+
+
+class StubCompletions:
+    """Stands in for groq.Groq().chat.completions, answering with canned JSON"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, messages, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = messages[-1]['content']
+        days = re.search(r'(\d+)-day travel itinerary', prompt)
+        if days:
+            body = {
+                'days': [
+                    {
+                        'day': day,
+                        'title': f'Day {day}',
+                        'activities': [
+                            {'name': f'Activity {day}.{n}', 'time': time_of_day, 'cost': 500, 'duration': 2.0, 'category': 'culture'}
+                            for n, time_of_day in enumerate(('morning', 'afternoon', 'evening'))
+                        ],
+                        'accommodation': {'name': 'Hotel', 'cost': 3000},
+                        'meals': [{'type': 'dinner', 'suggestion': 'Restaurant', 'cost': 400}],
+                    }
+                    for day in range(1, int(days.group(1)) + 1)
+                ],
+                'budget_breakdown': {'total': 10000},
+                'tips': ['Book early'],
+            }
+        elif 'Suggest 10 activities' in prompt:
+            body = {'activities': [
+                {'name': f'Suggested activity {n}', 'description': '', 'category': 'sightseeing',
+                 'estimated_cost': 800, 'duration_hours': 2.0}
+                for n in range(10)
+            ]}
+        else:
+            body = {'description': 'A city', 'must_see': [], 'local_tips': []}
+        content = json.dumps(body)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4),
+        )
+
+
+# Each workload takes (client, session state, rng) and returns the response
+def trip_detail(client, state, rng):
+    return client.get(f"/api/trips/{rng.choice(state['trip_ids'])}")
+
+
+def trip_list(client, state, rng):
+    return client.get('/api/trips')
+
+
+def search(client, state, rng):
+    return client.get(f'/api/activities/search?q={rng.choice(SEARCH_TERMS)}&limit=20')
+
+
+def city_activities(client, state, rng):
+    return client.get(f"/api/cities/{rng.randint(*state['cities'])}/activities?limit=20")
+
+
+def dashboard(client, state, rng):
+    return client.get('/api/dashboard/stats')
+
+
+def budget(client, state, rng):
+    return client.get(f"/api/trips/{rng.choice(state['trip_ids'])}/budget")
+
+
+def forecast(client, state, rng):
+    return client.get(f"/api/trips/{rng.choice(state['trip_ids'])}/budget/forecast")
+
+
+def copy(client, state, rng):
+    return client.post(f"/api/trips/{rng.choice(state['trip_ids'])}/copy")
+
+
+def generate_itinerary(client, state, rng):
+    return client.post(
+        f"/api/trips/{rng.choice(state['trip_ids'])}/generate-itinerary",
+        json={'budget_min': 20000, 'budget_max': 60000, 'preferences': ['culture']}
+    )
+
+
+WORKLOADS = {
+    workload.__name__: workload
+    for workload in (trip_detail, trip_list, search, city_activities, dashboard, budget, forecast, copy, generate_itinerary)
+}
+DEFAULT_WORKLOADS = ('trip_detail', 'search', 'dashboard', 'budget', 'copy')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def query_count(response):
+    for value in response.headers.getlist('Server-Timing'):
+        match = SERVER_TIMING_QUERIES.match(value)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def sign_in(app, count, password, dataset):
+    """Logged-in test clients for the first count generated users that have trips, with their trip ids"""
+    from models import Trip
+
+    first_trip, last_trip = dataset['trips']
+    with app.app_context():
+        user_ids = [row[0] for row in Trip.query.with_entities(Trip.user_id).filter(
+            Trip.id.between(first_trip, last_trip)
+        ).group_by(Trip.user_id).order_by(Trip.user_id).limit(count)]
+    if len(user_ids) < count:
+        raise SystemExit(f'Only {len(user_ids)} generated users have trips; add --trips or lower --concurrency')
+
+    sessions = []
+    for user_id in user_ids:
+        client = app.test_client()
+        response = client.post('/api/auth/login', json={
+            'email': f'dataset-user-{user_id}@example.com', 'password': password
+        })
+        if response.status_code != 200:
+            raise SystemExit(f'Login failed for user {user_id}: {response.get_data(as_text=True)}')
+        with app.app_context():
+            trip_ids = [row[0] for row in Trip.query.with_entities(Trip.id).filter_by(user_id=user_id)]
+        sessions.append((client, {'trip_ids': trip_ids, 'cities': dataset['cities']}))
+    return sessions
+
+
+def run_workload(name, sessions, requests, warmup, seed):
+    workload = WORKLOADS[name]
+    latencies = []
+    queries = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = [requests // len(sessions) + (1 if i < requests % len(sessions) else 0) for i in range(len(sessions))]
+
+    def worker(index):
+        client, state = sessions[index]
+        rng = random.Random(f'{seed}-{name}-{index}')
+        for _ in range(warmup):
+            workload(client, state, rng)
+        barrier.wait()
+        own_latencies, own_queries, own_errors = [], [], 0
+        for _ in range(per_thread[index]):
+            start = time.perf_counter()
+            response = workload(client, state, rng)
+            own_latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                own_errors += 1
+            count = query_count(response)
+            if count is not None:
+                own_queries.append(count)
+        with lock:
+            latencies.extend(own_latencies)
+            queries.extend(own_queries)
+            errors[0] += own_errors
+
+    barrier = threading.Barrier(len(sessions) + 1)
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(sessions))]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'queries': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against a baseline; returns the regressed workload names"""
+    regressions = []
+    print(f"\nAgainst baseline ({baseline.get('created_at', 'unknown date')}, tolerance {tolerance:.0%}):")
+    for name, result in results['workloads'].items():
+        base = baseline['workloads'].get(name)
+        if base is None:
+            print(f'  {name:20} (not in baseline)')
+            continue
+        change = result['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0.0
+        problems = []
+        if change > tolerance:
+            problems.append(f'p95 +{change:.0%}')
+        if result['queries'] is not None and base.get('queries') is not None and result['queries'] > base['queries']:
+            problems.append(f"queries {base['queries']} -> {result['queries']}")
+        if result['errors'] > base.get('errors', 0):
+            problems.append(f"errors {base.get('errors', 0)} -> {result['errors']}")
+        status = 'REGRESSION: ' + ', '.join(problems) if problems else 'ok'
+        print(f"  {name:20} p95 {base['p95_ms']:9.2f} -> {result['p95_ms']:9.2f} ms ({change:+.0%})  {status}")
+        if problems:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--cities', type=int, default=500)
+    parser.add_argument('--activities', type=int, default=10000)
+    parser.add_argument('--trips', type=int, default=150)
+    parser.add_argument('--stops-per-trip', type=float, default=5, help='average')
+    parser.add_argument('--activities-per-stop', type=float, default=4, help='average')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per workload')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per thread and workload')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workloads', default=','.join(DEFAULT_WORKLOADS),
+                        help=f"comma-separated, from: {', '.join(WORKLOADS)}")
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--database-url', help='an empty database to use instead of a temporary SQLite file')
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth against the baseline')
+    args = parser.parse_args()
+
+    workloads = [name.strip() for name in args.workloads.split(',') if name.strip()]
+    unknown = [name for name in workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(unknown)}")
+    if args.concurrency > args.users:
+        parser.error('--concurrency cannot exceed --users (one signed-in user per thread)')
+
+    # The app reads its configuration at import time
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load_test.db')}"
+    os.environ['SQL_TIMING_HEADERS'] = 'true'
+    os.environ['SQL_LOG_REQUESTS'] = 'none'
+    os.environ['LLM_DAILY_TOKEN_QUOTA'] = '0'
+
+    import app as appmod
+    from dataset import DATASET_PASSWORD, Scale, generate
+    from migrations import run_migrations
+
+    app, db = appmod.app, appmod.db
+    appmod.groq_service.client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions(args.llm_latency_ms / 1000)))
+
+    scale = Scale(
+        users=args.users, cities=args.cities, activities=args.activities, trips=args.trips,
+        stops_per_trip=args.stops_per_trip, activities_per_stop=args.activities_per_stop,
+    )
+    start = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        run_migrations(db.engine)
+        dataset = generate(db.engine, scale, seed=args.seed)
+        dialect = db.engine.dialect.name
+    rows = sum(dataset['counts'].values())
+    print(f'Generated {rows} rows in {time.perf_counter() - start:.1f}s ({dialect}): '
+          + ', '.join(f'{table} {count}' for table, count in dataset['counts'].items()))
+
+    sessions = sign_in(app, args.concurrency, DATASET_PASSWORD, dataset)
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'database': dialect,
+        'scale': scale.to_dict(),
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'workloads': {},
+    }
+    print(f"\n{'workload':20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'queries':>8} {'errors':>7}")
+    for name in workloads:
+        result = results['workloads'][name] = run_workload(name, sessions, args.requests, args.warmup, args.seed)
+        queries = '-' if result['queries'] is None else f"{result['queries']:.1f}"
+        print(f"{name:20} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f} "
+              f"{result['rps']:8.1f} {queries:>8} {result['errors']:7}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nBaseline saved to {args.save_baseline}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != results['scale'] or baseline.get('concurrency') != results['concurrency']:
+            print('\nWarning: the baseline was recorded at a different scale or concurrency')
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Mixed read/write concurrency benchmark for the SQLite connection profile.
+
+Runs the same workload against a fresh database file twice: once with
+SQLite defaults (rollback journal, synchronous=FULL) and once with the
+profile from Config.SQLITE_PRAGMAS, then prints throughput for both.
+
+Usage: python benchmarks/sqlite_concurrency.py [--readers 8] [--writers 2] [--seconds 5]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from database import apply_sqlite_pragmas
+
+ROWS = 5000
+
+
+def make_engine(path, pragmas, read_only=False):
+    engine = create_engine(
+        f'sqlite:///{path}',
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        connect_args={'check_same_thread': False, 'timeout': 5},
+    )
+    if pragmas:
+        apply_sqlite_pragmas(engine, pragmas, read_only=read_only)
+    return engine
+
+
+def setup(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE stops (id INTEGER PRIMARY KEY, trip_id INTEGER NOT NULL, "
+            "order_index INTEGER NOT NULL, notes TEXT)"
+        ))
+        conn.execute(text("CREATE INDEX idx_stops_trip_id ON stops(trip_id)"))
+        conn.execute(
+            text("INSERT INTO stops (trip_id, order_index, notes) VALUES (:t, :o, :n)"),
+            [{'t': i % 500, 'o': i, 'n': 'note ' * 20} for i in range(ROWS)]
+        )
+
+
+def run_profile(name, pragmas, readers, writers, seconds):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    writer_engine = make_engine(path, pragmas)
+    setup(writer_engine)
+    reader_engine = make_engine(path, pragmas, read_only=bool(pragmas))
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def reader(seed):
+        n = 0
+        i = seed
+        while time.perf_counter() < deadline:
+            with reader_engine.connect() as conn:
+                conn.execute(text("SELECT * FROM stops WHERE trip_id = :t ORDER BY order_index"), {'t': i % 500}).fetchall()
+            n += 1
+            i += 7
+        with lock:
+            counts['reads'] += n
+
+    def writer(seed):
+        n = errors = 0
+        i = seed
+        while time.perf_counter() < deadline:
+            try:
+                with writer_engine.begin() as conn:
+                    conn.execute(text("UPDATE stops SET order_index = order_index + 1 WHERE trip_id = :t"), {'t': i % 500})
+                n += 1
+            except OperationalError:
+                errors += 1
+            i += 13
+        with lock:
+            counts['writes'] += n
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    writer_engine.dispose()
+    reader_engine.dispose()
+
+    print(f"{name:<8} reads/s={counts['reads'] / seconds:>9.1f}  "
+          f"writes/s={counts['writes'] / seconds:>8.1f}  lock errors={counts['errors']}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds}s per profile")
+    default = run_profile('default', None, args.readers, args.writers, args.seconds)
+    tuned = run_profile('tuned', Config.SQLITE_PRAGMAS, args.readers, args.writers, args.seconds)
+
+    for key in ('reads', 'writes'):
+        if default[key]:
+            print(f"{key}: {tuned[key] / default[key]:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Streaming import and export of the city and activity catalogue.
+
+`flask import-catalogue` and `flask export-catalogue` read and write CSV
+(with a header row) or NDJSON (one JSON object per line). Records are
+read, matched and written chunk_size at a time, one transaction per
+chunk, so memory use does not grow with the size of the file.
+
+Import is an upsert. Cities are matched on (country, name) and
+activities on (city, normalized name), the unique key of the activities
+table; matching rows are updated and the rest are inserted. An activity names its city with city_country and city_name
+(as in exported files), or with city_id. Only the fields a record
+carries are written: an empty CSV cell or a missing NDJSON key leaves
+the stored value alone, while an NDJSON null clears it. Unknown fields
+are ignored. Records that fail validation or name an unknown city are
+skipped and reported with their line number; the rest of the file is
+still imported.
+"""
+
+import csv
+import itertools
+import json
+import os
+import sys
+
+from sqlalchemy import bindparam
+
+from models import db, Activity, City, normalize_activity_name
+
+FORMATS = ('csv', 'ndjson')
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+# Field -> converter. Cities need name and country, activities name and a city reference
+CITY_FIELDS = {
+    'name': str,
+    'country': str,
+    'region': str,
+    'description': str,
+    'cost_index': float,
+    'popularity_score': int,
+    'latitude': float,
+    'longitude': float,
+    'image_url': str,
+}
+ACTIVITY_FIELDS = {
+    'name': str,
+    'description': str,
+    'category': str,
+    'estimated_cost': float,
+    'duration_hours': float,
+    'image_url': str,
+}
+ACTIVITY_CITY_FIELDS = {'city_id': int, 'city_country': str, 'city_name': str}
+KINDS = ('cities', 'activities')
+PLACEHOLDERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}  # DB-API paramstyle -> marker
+MAX_LOOKUP_KEYS = 4096  # keys per lookup statement, within SQLite's bind parameter limit
+MAX_ERRORS = 100  # skipped records kept for the report; the rest are only counted
+
+
+class CatalogueError(Exception):
+    """The file cannot be read at all (e.g. its format is unknown)"""
+
+
+class RecordError(ValueError):
+    """One record is invalid and is skipped"""
+
+
+def detect_format(path, file_format=None):
+    """The explicit file_format, else the one implied by path's extension"""
+    if file_format:
+        return file_format
+    file_format = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise CatalogueError(f'Cannot tell the format of {path!r}; pass --format ({", ".join(FORMATS)})')
+    return file_format
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _grouped_by_keys(rows):
+    """Rows split into lists with the same keys, as executemany needs"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return groups.values()
+
+
+# ---------------------------------------------------------------- reading
+
+def _read_csv(f):
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None:
+        return
+    for record in reader:
+        # Empty cells mean "not given"; None comes from rows shorter than the header
+        yield reader.line_num, {key: value for key, value in record.items() if key and value not in ('', None)}
+
+
+def _read_ndjson(f):
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, RecordError(f'invalid JSON: {e}')
+            continue
+        if not isinstance(record, dict):
+            yield line_number, RecordError('expected a JSON object')
+            continue
+        yield line_number, record
+
+
+def read_records(f, file_format):
+    """(line number, record dict or RecordError) for each record in f"""
+    return _read_csv(f) if file_format == 'csv' else _read_ndjson(f)
+
+
+def _convert(record, fields):
+    row = {}
+    for field, converter in fields.items():
+        if field not in record:
+            continue
+        value = record[field]
+        if value is None:
+            row[field] = None
+            continue
+        if isinstance(value, (bool, dict, list)):
+            raise RecordError(f'{field} has an invalid value {value!r}')
+        try:
+            value = converter(value.strip() if isinstance(value, str) else value)
+        except (TypeError, ValueError):
+            raise RecordError(f'{field} has an invalid value {value!r}')
+        row[field] = value
+    return row
+
+
+def _required(row, *fields):
+    for field in fields:
+        if not row.get(field):
+            raise RecordError(f'{field} is required')
+
+
+def _city_row(record):
+    row = _convert(record, CITY_FIELDS)
+    _required(row, 'name', 'country')
+    return row
+
+
+def _activity_row(record):
+    row = _convert(record, ACTIVITY_FIELDS)
+    _required(row, 'name')
+    row['name_key'] = normalize_activity_name(row['name'])
+    ref = _convert(record, ACTIVITY_CITY_FIELDS)
+    if ref.get('city_country') and ref.get('city_name'):
+        row['_city'] = (ref['city_country'], ref['city_name'])
+    elif ref.get('city_id'):
+        row['city_id'] = ref['city_id']
+    else:
+        raise RecordError('city_country and city_name (or city_id) are required')
+    return row
+
+
+# ---------------------------------------------------------------- upserts
+
+def _existing_ids(conn, table, key_columns, keys):
+    """{key tuple: id} for rows of table matching keys (the oldest row wins on duplicates)
+
+    The keys are joined as a VALUES list, so the planner probes the key
+    index once per key (SQLite scans the whole table for a long
+    (a, b) IN (...) list). The statement is written for the driver
+    directly: compiling thousands of bind parameters on every chunk
+    costs more than running the query.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    placeholder = PLACEHOLDERS[conn.dialect.paramstyle]
+    values_row = '(' + ', '.join([placeholder] * len(key_columns)) + ')'
+    columns = [quote(column) for column in key_columns]
+    select = (
+        f"SELECT t.id, {', '.join(f't.{column}' for column in columns)} "
+        f"FROM {quote(table.name)} t JOIN lookup_keys k ON "
+        + ' AND '.join(f't.{column} = k.{column}' for column in columns)
+        + " ORDER BY t.id DESC"
+    )
+
+    existing = {}
+    keys = list(keys)
+    for start in range(0, len(keys), MAX_LOOKUP_KEYS):
+        batch = keys[start:start + MAX_LOOKUP_KEYS]
+        # Padding to a power of two (repeating a key) keeps the number of
+        # distinct statements, and the driver's prepared statement cache, small
+        batch += batch[-1:] * (max(16, 1 << (len(batch) - 1).bit_length()) - len(batch))
+        statement = f"WITH lookup_keys ({', '.join(columns)}) AS (VALUES {', '.join([values_row] * len(batch))}) {select}"
+        for row in conn.exec_driver_sql(statement, tuple(value for key in batch for value in key)):
+            existing[tuple(row[1:])] = row[0]
+    return existing
+
+
+def _write(conn, table, inserts, updates):
+    for rows in _grouped_by_keys(inserts):
+        conn.execute(table.insert(), rows)
+    # The id is bound as _id, so the remaining keys become the SET clause
+    statement = table.update().where(table.c.id == bindparam('_id'))
+    for rows in _grouped_by_keys(updates):
+        conn.execute(statement, rows)
+
+
+def _split(rows, existing, key):
+    """Keyed rows split into inserts and updates (a key repeated in the chunk keeps its last row)"""
+    latest = {}
+    for line_number, row in rows:
+        latest[key(row)] = row
+    inserts, updates = [], []
+    for row_key, row in latest.items():
+        if row_key in existing:
+            updates.append(dict(row, _id=existing[row_key]))
+        else:
+            inserts.append(row)
+    return inserts, updates
+
+
+def _upsert_cities(conn, rows, errors):
+    key = lambda row: (row['country'], row['name'])
+    existing = _existing_ids(conn, City.__table__, ('country', 'name'), {key(row) for _, row in rows})
+    inserts, updates = _split(rows, existing, key)
+    _write(conn, City.__table__, inserts, updates)
+    return len(inserts), len(updates)
+
+
+def _upsert_activities(conn, rows, errors):
+    names = {row['_city'] for _, row in rows if '_city' in row}
+    city_ids = _existing_ids(conn, City.__table__, ('country', 'name'), names)
+    ids = {row['city_id'] for _, row in rows if 'city_id' in row}
+    known_ids = set(conn.scalars(db.select(City.id).where(City.id.in_(ids)))) if ids else set()
+
+    resolved = []
+    for line_number, row in rows:
+        if '_city' in row:
+            city = row.pop('_city')
+            if city not in city_ids:
+                errors.append((line_number, f'unknown city {city[1]!r} in {city[0]!r}'))
+                continue
+            row['city_id'] = city_ids[city]
+        elif row['city_id'] not in known_ids:
+            errors.append((line_number, f'unknown city_id {row["city_id"]}'))
+            continue
+        resolved.append((line_number, row))
+
+    key = lambda row: (row['city_id'], row['name_key'])
+    existing = _existing_ids(conn, Activity.__table__, ('city_id', 'name_key'), {key(row) for _, row in resolved})
+    inserts, updates = _split(resolved, existing, key)
+    _write(conn, Activity.__table__, inserts, updates)
+    return len(inserts), len(updates)
+
+
+def import_catalogue(engine, kind, f, file_format, chunk_size=5000, progress=None):
+    """Upsert the kind ('cities' or 'activities') records read from f
+
+    Returns {'read', 'inserted', 'updated', 'skipped', 'errors'}; errors
+    holds (line number, message) for the first MAX_ERRORS skipped
+    records. progress, if given, is called with the running totals after
+    each chunk.
+    """
+    parse, upsert = (_city_row, _upsert_cities) if kind == 'cities' else (_activity_row, _upsert_activities)
+    result = {'read': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'errors': []}
+
+    for chunk in _chunks(read_records(f, file_format), chunk_size):
+        rows = []
+        errors = []
+        for line_number, record in chunk:
+            try:
+                if isinstance(record, RecordError):
+                    raise record
+                rows.append((line_number, parse(record)))
+            except RecordError as e:
+                errors.append((line_number, str(e)))
+        inserted = updated = 0
+        if rows:
+            with engine.begin() as conn:
+                inserted, updated = upsert(conn, rows, errors)
+
+        result['read'] += len(chunk)
+        result['inserted'] += inserted
+        result['updated'] += updated
+        result['skipped'] += len(errors)
+        result['errors'].extend(sorted(errors)[:MAX_ERRORS - len(result['errors'])])
+        if progress is not None:
+            progress(result)
+    return result
+
+
+# ---------------------------------------------------------------- export
+
+def _export_query(kind):
+    if kind == 'cities':
+        columns = [City.id] + [getattr(City, field) for field in CITY_FIELDS]
+        return db.select(*columns).order_by(City.id)
+    columns = [
+        Activity.id, Activity.city_id, City.country.label('city_country'), City.name.label('city_name'),
+    ] + [getattr(Activity, field) for field in ACTIVITY_FIELDS]
+    return db.select(*columns).join(City, City.id == Activity.city_id).order_by(Activity.id)
+
+
+def export_catalogue(engine, kind, f, file_format, chunk_size=5000, progress=None):
+    """Write every kind record to f, streaming chunk_size rows at a time; returns the row count"""
+    query = _export_query(kind)
+    count = 0
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=chunk_size).execute(query)
+        fields = list(result.keys())
+        writer = None
+        if file_format == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(fields)
+        for rows in result.partitions():
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(fields, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+            if progress is not None:
+                progress(count)
+    return count
+
+
+def open_file(path, mode):
+    """path opened for CSV/NDJSON text, or stdin/stdout for '-'"""
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    return open(path, mode, newline='', encoding='utf-8')
@@ -0,0 +1,201 @@
+"""
+Response compression and a pre-compressed response cache.
+
+init_compression() registers an after_request hook that gzip- or
+brotli-encodes responses the client accepts, once they reach
+COMPRESS_MIN_SIZE bytes. Brotli is used when the Brotli package is
+installed.
+
+@cached_response keeps the encoded body of a handler's 200 responses in
+an in-process cache, together with each compressed variant the first
+time a client asks for it, so a cache hit neither runs the handler nor
+compresses again. Entries expire after their timeout or when
+invalidate_cache() is called for their key prefix;
+invalidate_after_commit() does the same once a session's transaction
+commits.
+"""
+
+import gzip
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, has_app_context, make_response, request
+from sqlalchemy import event
+
+from metrics import record_cache_lookup
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSION_CACHE_KEY = 'globetrotter_response_cache'
+PENDING_INVALIDATIONS_KEY = 'pending_cache_invalidations'
+
+
+def _encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding():
+    """Best content coding the client accepts (None = identity)"""
+    return request.accept_encodings.best_match(_encodings())
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _is_compressible(response, config):
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in config['COMPRESS_MIMETYPES']
+    )
+
+
+def _set_body(response, data, encoding):
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+
+
+def init_compression(app):
+    """Compress eligible responses according to Accept-Encoding"""
+
+    @app.after_request
+    def compress_response(response):
+        config = current_app.config
+        if not config['COMPRESS_ENABLED'] or not _is_compressible(response, config):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return response
+
+        level = config['COMPRESS_BR_LEVEL'] if encoding == 'br' else config['COMPRESS_GZIP_LEVEL']
+        _set_body(response, compress(response.get_data(), encoding, level), encoding)
+        return response
+
+    app.extensions[COMPRESSION_CACHE_KEY] = ResponseCache(app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+
+
+class ResponseCache:
+    """LRU of encoded response bodies and their compressed variants"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, body, mimetype, timeout):
+        entry = {
+            'body': body,
+            'mimetype': mimetype,
+            'variants': {},
+            'expires': time.monotonic() + timeout,
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def variant(self, entry, encoding, level):
+        """Compressed body for an entry, compressed at most once per fill"""
+        data = entry['variants'].get(encoding)
+        if data is None:
+            data = compress(entry['body'], encoding, level)
+            with self.lock:
+                entry['variants'][encoding] = data
+        return data
+
+    def invalidate(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+
+def _cache():
+    return current_app.extensions[COMPRESSION_CACHE_KEY]
+
+
+def invalidate_cache(prefix):
+    """Drop cached responses whose key starts with prefix"""
+    _cache().invalidate(prefix)
+
+
+def invalidate_after_commit(session, prefix):
+    """Drop cached responses under prefix once the session's transaction commits"""
+    session.info.setdefault(PENDING_INVALIDATIONS_KEY, set()).add(prefix)
+
+
+def init_cache_invalidation(session_class):
+    """Apply invalidate_after_commit() calls when sessions of session_class commit"""
+    @event.listens_for(session_class, 'after_commit')
+    def _invalidate_pending(session):
+        prefixes = session.info.pop(PENDING_INVALIDATIONS_KEY, None)
+        if not prefixes or not has_app_context():
+            return
+        for prefix in prefixes:
+            invalidate_cache(prefix)
+
+    @event.listens_for(session_class, 'after_rollback')
+    def _drop_pending(session):
+        session.info.pop(PENDING_INVALIDATIONS_KEY, None)
+
+
+def _response_from_entry(entry):
+    config = current_app.config
+    response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+    response.vary.add('Accept-Encoding')
+
+    encoding = negotiate_encoding() if config['COMPRESS_ENABLED'] else None
+    if encoding is not None and len(entry['body']) >= config['COMPRESS_MIN_SIZE']:
+        level = config['COMPRESS_CACHE_BR_LEVEL'] if encoding == 'br' else config['COMPRESS_CACHE_GZIP_LEVEL']
+        _set_body(response, _cache().variant(entry, encoding, level), encoding)
+    return response
+
+
+def cached_response(prefix, timeout_config):
+    """Cache a handler's 200 responses under prefix + the request path and query string"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            timeout = current_app.config[timeout_config]
+            if not timeout:
+                return f(*args, **kwargs)
+
+            key = f'{prefix}:{request.full_path}'
+            entry = _cache().get(key)
+            record_cache_lookup(prefix, entry is not None)
+            if entry is None:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or not _is_compressible(response, current_app.config):
+                    return response
+                entry = _cache().set(key, response.get_data(), response.mimetype, timeout)
+            return _response_from_entry(entry)
+        return decorated
+    return decorator
@@ -0,0 +1,47 @@
+"""
+Optimistic concurrency for trips, stops and budgets.
+
+Each of these rows has a version column that SQLAlchemy checks and
+increments on every UPDATE (version_id_col), so a write based on a stale
+read fails with StaleDataError instead of silently overwriting.
+
+Responses carry the version as an ETag ("trips-12-v4"). Clients send it
+back in If-Match on PUT; a mismatch answers 412 Precondition Failed with
+the current version. Requests without If-Match keep last-writer-wins
+semantics, apart from the flush-time check.
+"""
+
+from flask import jsonify, request
+from sqlalchemy.orm.exc import StaleDataError  # noqa: F401 - re-exported for handlers
+
+
+def etag_value(obj):
+    return f'{obj.__tablename__}-{obj.id}-v{obj.version}'
+
+
+def if_match_failed(obj):
+    """True when the request's If-Match does not match obj (obj None = missing)"""
+    if_match = request.if_match
+    if not if_match:
+        return False
+    if obj is None:
+        return True
+    return not (if_match.star_tag or if_match.contains(etag_value(obj)))
+
+
+def precondition_failed(obj, message='Resource was modified by another request'):
+    """412 response describing the current version of obj"""
+    body = {'error': message}
+    if obj is not None:
+        body['current_version'] = obj.version
+    response = jsonify(body)
+    if obj is not None:
+        response.set_etag(etag_value(obj))
+    return response, 412
+
+
+def with_etag(response, obj):
+    """Attach obj's ETag to a jsonify() response"""
+    if obj is not None and obj.id is not None:
+        response.set_etag(etag_value(obj))
+    return response
@@ -7,13 +7,106 @@ class Config:
     # Flask
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
     
-    # Database - SQLite
+    # Database - SQLite by default, PostgreSQL via DATABASE_URL=postgresql://...
     SQLALCHEMY_DATABASE_URI = os.getenv(
         'DATABASE_URL',
         'sqlite:///globetrotter.db'
-    )
+    ).replace('postgres://', 'postgresql://', 1)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Read replicas (comma-separated URLs, e.g. a SQLite replica file or a
+    # PostgreSQL standby). Empty = read-only pool on the primary database.
+    SQLALCHEMY_READ_REPLICA_URIS = [
+        uri.strip().replace('postgres://', 'postgresql://', 1)
+        for uri in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if uri.strip()
+    ]
+    
+    # Connection pool (ignored for in-memory SQLite)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))  # seconds
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 3600))  # seconds
+    DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', 20))  # per reader engine
+    DB_READ_MAX_OVERFLOW = int(os.getenv('DB_READ_MAX_OVERFLOW', 20))
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))  # PostgreSQL only
+    
+    # SQLite connection profile, applied to every new connection
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),  # 256MB
+        'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64000)),  # negative = KiB (~64MB)
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),  # ms
+        'temp_store': os.getenv('SQLITE_TEMP_STORE', 'MEMORY'),
+    }
+    
+    # JSON responses: 'auto' uses orjson when installed, 'stdlib' forces json
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+    
+    # Response compression (gzip, or brotli when the Brotli package is installed)
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # bytes
+    COMPRESS_MIMETYPES = {'application/json', 'application/msgpack', 'text/plain', 'text/csv', 'text/html'}
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BR_LEVEL = 4
+    # Cached responses are compressed once per fill, so they use the best levels
+    COMPRESS_CACHE_GZIP_LEVEL = 9
+    COMPRESS_CACHE_BR_LEVEL = 11
+    
+    # In-process response cache (seconds; 0 disables caching for that endpoint)
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+    SHARED_TRIP_CACHE_SECONDS = int(os.getenv('SHARED_TRIP_CACHE_SECONDS', 60))
+    POPULAR_CITIES_CACHE_SECONDS = int(os.getenv('POPULAR_CITIES_CACHE_SECONDS', 300))
+    CITY_INFO_CACHE_SECONDS = int(os.getenv('CITY_INFO_CACHE_SECONDS', 3600))
+    
+    # Trip change events (Server-Sent Events)
+    EVENT_KEEPALIVE_SECONDS = int(os.getenv('EVENT_KEEPALIVE_SECONDS', 15))
+    EVENT_REPLAY_SIZE = int(os.getenv('EVENT_REPLAY_SIZE', 100))  # events kept per trip for reconnects
+    EVENT_REPLAY_SECONDS = int(os.getenv('EVENT_REPLAY_SECONDS', 60))  # history kept after a trip's last subscriber leaves
+    EVENT_QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', 256))  # per subscriber
+    
+    # Per-request SQL instrumentation (see instrumentation.py)
+    SQL_INSTRUMENTATION = os.getenv('SQL_INSTRUMENTATION', 'true').lower() == 'true'
+    # Server-Timing headers; unset = only in debug mode
+    SQL_TIMING_HEADERS = (
+        os.getenv('SQL_TIMING_HEADERS').lower() == 'true' if os.getenv('SQL_TIMING_HEADERS') else None
+    )
+    SQL_LOG_REQUESTS = os.getenv('SQL_LOG_REQUESTS', 'flagged')  # flagged, all or none
+    SQL_MAX_QUERIES = int(os.getenv('SQL_MAX_QUERIES', 20))
+    # Per-endpoint query limits, e.g. "get_trip=10,get_dashboard_stats=8"
+    SQL_ROUTE_MAX_QUERIES = {
+        endpoint.strip(): int(limit)
+        for endpoint, _, limit in (
+            item.partition('=') for item in os.getenv('SQL_ROUTE_MAX_QUERIES', '').split(',') if item.strip()
+        )
+    }
+    SQL_REPEATED_STATEMENT_LIMIT = int(os.getenv('SQL_REPEATED_STATEMENT_LIMIT', 5))  # same statement, one request
+    SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', 200))
+    
+    # GET /metrics (Prometheus); when set, scrapers must send "Authorization: Bearer <token>"
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    
+    # Sampling profiler (see profiling.py); also toggled at runtime via /api/admin/profiling
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.01))  # fraction of requests
+    PROFILING_ROUTES = [route.strip() for route in os.getenv('PROFILING_ROUTES', '').split(',') if route.strip()]
+    # Requests sending "<PROFILING_HEADER>: <PROFILING_TOKEN>" are always profiled (no token = off)
+    PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'X-Profile')
+    PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+    PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', 5))
+    PROFILING_OUTPUT_DIR = os.getenv('PROFILING_OUTPUT_DIR', 'profiles')
+    PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', 200))
+    
+    # Budget forecast rates, in the budget currency at cost_index 1.0
+    FORECAST_ACCOMMODATION_PER_NIGHT = float(os.getenv('FORECAST_ACCOMMODATION_PER_NIGHT', 3000))
+    FORECAST_FOOD_PER_DAY = float(os.getenv('FORECAST_FOOD_PER_DAY', 1200))
+    FORECAST_LOCAL_TRANSPORT_PER_DAY = float(os.getenv('FORECAST_LOCAL_TRANSPORT_PER_DAY', 400))
+    FORECAST_TRANSPORT_PER_ACTIVITY_HOUR = float(os.getenv('FORECAST_TRANSPORT_PER_ACTIVITY_HOUR', 50))
+    FORECAST_TRAVEL_PER_KM = float(os.getenv('FORECAST_TRAVEL_PER_KM', 6))
+    # Accommodation multipliers for January..December, e.g. "0.9,0.9,1,1,1.1,1.3,1.4,1.4,1.1,1,0.9,1.2"
+    FORECAST_MONTH_FACTORS = [float(factor) for factor in os.getenv('FORECAST_MONTH_FACTORS', ','.join(['1'] * 12)).split(',')]
+    FORECAST_MAX_SCENARIOS = int(os.getenv('FORECAST_MAX_SCENARIOS', 500))
+    
     # JWT
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
     JWT_ACCESS_TOKEN_EXPIRES = 86400  # 24 hours
@@ -21,6 +114,32 @@ class Config:
     # Groq API
     GROQ_API_KEY = os.getenv('GROQ_API_KEY', 'your-groq-api-key-here')
     
+    # User data export (GET /api/users/export): rows fetched per round trip
+    USER_EXPORT_CHUNK_SIZE = int(os.getenv('USER_EXPORT_CHUNK_SIZE', 500))
+    
+    # Trip PDF exports (see trip_export.py): rendered in the background and kept on disk
+    TRIP_EXPORT_DIR = os.getenv('TRIP_EXPORT_DIR', 'exports')
+    TRIP_PDF_WORKERS = int(os.getenv('TRIP_PDF_WORKERS', 2))
+    TRIP_PDF_WAIT_SECONDS = float(os.getenv('TRIP_PDF_WAIT_SECONDS', 5))  # then 202 and the client retries
+    TRIP_PDF_MAX_PENDING = int(os.getenv('TRIP_PDF_MAX_PENDING', 100))  # queued renders before 503
+    # TrueType (.ttf) fonts for PDF text; unset = the first Unicode font of pdf.FONT_CANDIDATES
+    # installed, 'none' = Helvetica (cp1252 only). Without a bold font, bold is drawn from the regular one.
+    TRIP_PDF_FONT = os.getenv('TRIP_PDF_FONT', '')
+    TRIP_PDF_BOLD_FONT = os.getenv('TRIP_PDF_BOLD_FONT', '')
+    
+    # LLM usage accounting (see llm_usage.py)
+    LLM_DAILY_TOKEN_QUOTA = int(os.getenv('LLM_DAILY_TOKEN_QUOTA', 200000))  # per user per UTC day; 0 = unlimited
+    LLM_USAGE_ASYNC = os.getenv('LLM_USAGE_ASYNC', 'true').lower() == 'true'
+    LLM_USAGE_BATCH_SIZE = int(os.getenv('LLM_USAGE_BATCH_SIZE', 50))
+    LLM_USAGE_FLUSH_SECONDS = float(os.getenv('LLM_USAGE_FLUSH_SECONDS', 2))
+    LLM_USAGE_MAX_PENDING = int(os.getenv('LLM_USAGE_MAX_PENDING', 10000))  # queued rows before new ones are dropped
+    # USD per million tokens, for the cost estimate in the admin report
+    LLM_PROMPT_PRICE_PER_MILLION = float(os.getenv('LLM_PROMPT_PRICE_PER_MILLION', 0.59))
+    LLM_COMPLETION_PRICE_PER_MILLION = float(os.getenv('LLM_COMPLETION_PRICE_PER_MILLION', 0.79))
+    
+    # Admin endpoints (/api/admin/...) are open to these accounts, e.g. "ops@example.com,me@example.com"
+    ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+    
     # File uploads
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = 'uploads'
@@ -0,0 +1,197 @@
+"""
+Database engine setup: SQLite connection profile, pool options and
+reader/writer routing.
+
+Handlers decorated with @prefer_reader send their queries to a reader
+engine: one of the replicas in Config.SQLALCHEMY_READ_REPLICA_URIS, or a
+read-only pool on the primary database when no replica is configured.
+Everything else, and any flush or DML statement, goes to the primary.
+"""
+
+import itertools
+import os
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+READ_ENGINES_KEY = 'globetrotter_read_engines'
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def is_memory_sqlite(uri):
+    url = make_url(uri)
+    return is_sqlite(uri) and url.database in (None, '', ':memory:')
+
+
+def build_engine_options(config, uri=None, pool_size=None, max_overflow=None):
+    """Build engine options for a database URL (defaults to the primary)"""
+    if uri is None:
+        uri = config['SQLALCHEMY_DATABASE_URI']
+        options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    else:
+        options = {}
+
+    # In-memory SQLite uses a StaticPool, which takes no sizing arguments
+    if is_memory_sqlite(uri):
+        return options
+
+    options.setdefault('pool_size', pool_size or config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', max_overflow if max_overflow is not None else config['DB_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+
+    if is_sqlite(uri):
+        connect_args = options.setdefault('connect_args', {})
+        # Pooled connections move between request threads
+        connect_args.setdefault('check_same_thread', False)
+        # Seconds the driver waits on a locked database before raising
+        connect_args.setdefault('timeout', config['SQLITE_PRAGMAS']['busy_timeout'] / 1000)
+    else:
+        options.setdefault('pool_pre_ping', True)
+        if make_url(uri).get_backend_name() == 'postgresql':
+            connect_args = options.setdefault('connect_args', {})
+            connect_args.setdefault('application_name', 'globetrotter')
+            connect_args.setdefault('options', f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}")
+
+    return options
+
+
+def icontains(column, term):
+    """Case-insensitive substring match with LIKE wildcards in the term escaped.
+
+    Compiles to ILIKE on PostgreSQL (served by the pg_trgm indexes) and to
+    lower() LIKE lower() on SQLite.
+    """
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.ilike(f'%{escaped}%', escape='\\')
+
+
+def insert_ignoring_conflicts(engine, table, index_elements):
+    """INSERT ... ON CONFLICT (index_elements) DO NOTHING for the engine's dialect
+
+    Rows clashing with the unique index (or with each other) are skipped
+    instead of failing the statement, so concurrent writers of the same
+    rows need no lookup first. The statement's rowcount is the number of
+    rows inserted.
+    """
+    insert = postgresql.insert if engine.dialect.name == 'postgresql' else sqlite.insert
+    return insert(table).on_conflict_do_nothing(index_elements=index_elements)
+
+
+def apply_sqlite_pragmas(engine, pragmas, read_only=False):
+    """Run the connection profile PRAGMAs on every new DBAPI connection"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if value is None:
+                    continue
+                cursor.execute(f"PRAGMA {name} = {value};")
+            if read_only:
+                cursor.execute("PRAGMA query_only = ON;")
+        finally:
+            cursor.close()
+
+
+def _resolve_sqlite_path(app, uri):
+    """Resolve relative SQLite paths against the instance folder, like the primary"""
+    url = make_url(uri)
+    if is_sqlite(uri) and not is_memory_sqlite(uri) and not os.path.isabs(url.database):
+        return url.set(database=os.path.join(app.instance_path, url.database))
+    return url
+
+
+def _create_read_engine(app, url):
+    engine = create_engine(
+        url,
+        **build_engine_options(
+            app.config,
+            uri=str(url),
+            pool_size=app.config['DB_READ_POOL_SIZE'],
+            max_overflow=app.config['DB_READ_MAX_OVERFLOW'],
+        )
+    )
+    apply_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'], read_only=True)
+    return engine
+
+
+def init_engines(app, db):
+    """Apply the connection profile to the primary and create the reader engines"""
+    with app.app_context():
+        engine = db.engine
+        apply_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'])
+
+        replica_uris = app.config['SQLALCHEMY_READ_REPLICA_URIS']
+        if replica_uris:
+            read_engines = [_create_read_engine(app, _resolve_sqlite_path(app, uri)) for uri in replica_uris]
+        elif is_memory_sqlite(str(engine.url)):
+            # A separate engine would open a different in-memory database
+            read_engines = [engine]
+        else:
+            read_engines = [_create_read_engine(app, engine.url)]
+
+    app.extensions[READ_ENGINES_KEY] = {
+        'engines': read_engines,
+        'cycle': itertools.cycle(read_engines),
+    }
+    return read_engines
+
+
+def _reader_for_request():
+    """Pick a reader engine once per request (round-robin across replicas)"""
+    reader = g.get('db_reader')
+    if reader is None:
+        readers = current_app.extensions.get(READ_ENGINES_KEY)
+        if readers is None:
+            return None
+        reader = next(readers['cycle'])
+        g.db_reader = reader
+    return reader
+
+
+def reader_engine():
+    """The engine this request reads from, for work outside the session (e.g. streamed responses)"""
+    return _reader_for_request()
+
+
+class RoutingSession(Session):
+    """Session that sends reads from @prefer_reader handlers to a reader engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and has_app_context()
+            and g.get('db_prefer_reader')
+        ):
+            if self._flushing or isinstance(clause, UpdateBase):
+                # Once a request writes, keep it on the primary so it reads its own writes
+                g.db_prefer_reader = False
+            else:
+                reader = _reader_for_request()
+                if reader is not None:
+                    return reader
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def prefer_reader(f):
+    """Serve a handler's reads from the reader engines"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.db_prefer_reader = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.db_prefer_reader = False
+    return decorated
@@ -0,0 +1,387 @@
+"""
+Synthetic datasets for benchmarks, load tests and `flask generate-dataset`.
+
+generate() adds users, cities, activities, trips (with stops, itinerary
+activities and a budget each) and saved destinations at a given Scale.
+Rows are built in Python with explicit ids and written with the driver's
+executemany, batch_size rows per transaction. No ORM objects are created
+and no RETURNING is needed, so millions of rows take minutes.
+The same seed and scale always give the same data.
+
+Distributions follow what real usage looks like rather than spreading
+everything evenly:
+- City popularity is Zipf-like. A few cities get most stops and saves
+  and more activities, while a long tail is rarely visited.
+- Trips per user are skewed. Some users plan many trips, many plan none.
+- Stops per trip, nights per stop and activities per stop cluster
+  around the Scale averages, with a tail of long trips.
+- Activity costs are log-normal and scaled by the city's cost_index.
+
+Every generated user signs in as dataset-user-<id>@example.com with
+DATASET_PASSWORD.
+"""
+
+import itertools
+import math
+import random
+from array import array
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from models import db, Activity, Budget, City, ItineraryActivity, SavedDestination, Stop, Trip, User, normalize_activity_name
+from ordering import spread_keys
+
+DATASET_PASSWORD = 'dataset-password'
+CATEGORIES = ('sightseeing', 'culture', 'food', 'adventure', 'shopping')
+TIMES_OF_DAY = ('morning', 'afternoon', 'evening', 'night')
+REGIONS = {
+    'Europe': ('France', 'Italy', 'Spain', 'Germany', 'UK', 'Portugal', 'Greece', 'Netherlands'),
+    'Asia': ('India', 'Japan', 'Thailand', 'Indonesia', 'Vietnam', 'China', 'Nepal', 'Sri Lanka'),
+    'North America': ('USA', 'Canada', 'Mexico'),
+    'South America': ('Brazil', 'Argentina', 'Peru', 'Chile'),
+    'Africa': ('Morocco', 'Egypt', 'Kenya', 'South Africa'),
+    'Middle East': ('UAE', 'Jordan', 'Turkey', 'Oman'),
+    'Oceania': ('Australia', 'New Zealand', 'Fiji'),
+}
+CITY_SYLLABLES = ('ka', 'lo', 'ri', 'san', 'ta', 'mar', 'vel', 'do', 'ny', 'pur', 'bad', 'ber', 'li', 'os', 'ton')
+ACTIVITY_ADJECTIVES = ('Old Town', 'Sunset', 'Hidden', 'Royal', 'Riverside', 'Night', 'Local', 'Historic', 'Grand')
+ACTIVITY_NOUNS = {
+    'sightseeing': ('Viewpoint', 'Harbour Walk', 'Tower Visit', 'Boat Tour', 'Garden'),
+    'culture': ('Museum', 'Temple', 'Palace Tour', 'Gallery', 'Heritage Walk'),
+    'food': ('Street Food Tour', 'Cooking Class', 'Market Tasting', 'Dinner Cruise', 'Tea House'),
+    'adventure': ('Trek', 'Kayaking', 'Cycling Tour', 'Zipline', 'Diving'),
+    'shopping': ('Bazaar', 'Craft Market', 'Design District', 'Night Market', 'Antique Fair'),
+}
+DURATIONS = (1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 6.0)
+# Relative frequency of 1..7 nights at a stop
+NIGHT_WEIGHTS = (15, 25, 25, 15, 10, 5, 5)
+
+CITY_POPULARITY_EXPONENT = 1.1  # stops and saves per city ~ rank ** -1.1
+CITY_ACTIVITY_EXPONENT = 0.6  # activities per city grow more slowly with popularity
+USER_TRIPS_EXPONENT = 0.8  # trips per user ~ rank ** -0.8
+PUBLIC_TRIP_SHARE = 0.1
+
+# Parents before children, for databases that enforce foreign keys
+INSERT_ORDER = (City, Activity, User, SavedDestination, Trip, Stop, ItineraryActivity, Budget)
+
+
+class Scale:
+    """How much data generate() adds (per-trip and per-user figures are averages)"""
+
+    def __init__(self, users=100, cities=200, activities=4000, trips=300,
+                 stops_per_trip=4, activities_per_stop=3, saved_per_user=3):
+        self.users = users
+        self.cities = cities
+        self.activities = activities
+        self.trips = trips
+        self.stops_per_trip = stops_per_trip
+        self.activities_per_stop = activities_per_stop
+        self.saved_per_user = saved_per_user
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def _next_id(conn, model):
+    return (conn.execute(db.select(db.func.max(model.id))).scalar() or 0) + 1
+
+
+class _TableInsert:
+    """A prepared INSERT for one table, executed through the DB-API driver
+
+    Statement compilation and per-row parameter handling are done once per
+    table instead of once per row. Column defaults are applied here, since
+    the statement bypasses SQLAlchemy's own default handling.
+    """
+
+    PLACEHOLDERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}
+
+    def __init__(self, dialect, model, columns):
+        table = model.__table__
+        self.columns = list(columns)
+        self.defaults = [
+            column for column in table.columns
+            if column.name not in columns and column.default is not None and not column.primary_key
+        ]
+        names = self.columns + [column.name for column in self.defaults]
+        self.processors = [
+            table.columns[name].type.dialect_impl(dialect).bind_processor(dialect) for name in names
+        ]
+        placeholder = self.PLACEHOLDERS.get(dialect.paramstyle)
+        if placeholder is None:
+            raise ValueError(f'Unsupported DB-API paramstyle {dialect.paramstyle!r}')
+        quote = dialect.identifier_preparer.quote
+        self.statement = (
+            f"INSERT INTO {quote(table.name)} ({', '.join(quote(name) for name in names)}) "
+            f"VALUES ({', '.join([placeholder] * len(names))})"
+        )
+
+    def execute(self, conn, rows):
+        # Callable defaults (timestamps) are evaluated once per batch
+        defaults = [
+            column.default.arg(None) if column.default.is_callable else column.default.arg
+            for column in self.defaults
+        ]
+        params = []
+        for row in rows:
+            values = [row[name] for name in self.columns] + defaults
+            params.append(tuple(
+                value if processor is None or value is None else processor(value)
+                for processor, value in zip(self.processors, values)
+            ))
+        conn.exec_driver_sql(self.statement, params)
+
+
+class _BatchWriter:
+    """Buffers rows per table and inserts them batch_size at a time"""
+
+    def __init__(self, engine, batch_size, progress=None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.progress = progress
+        self.rows = {model: [] for model in INSERT_ORDER}
+        self.inserts = {}
+        self.counts = {}
+
+    def add(self, model, row):
+        self.rows[model].append(row)
+        if len(self.rows[model]) >= self.batch_size:
+            # Rows are added parent first, so writing the tables before this one keeps references valid
+            self.flush(INSERT_ORDER[:INSERT_ORDER.index(model) + 1])
+
+    def flush(self, models=INSERT_ORDER):
+        with self.engine.begin() as conn:
+            for model in models:
+                rows = self.rows[model]
+                if rows:
+                    insert = self.inserts.get(model)
+                    if insert is None:
+                        insert = self.inserts[model] = _TableInsert(self.engine.dialect, model, rows[0])
+                    insert.execute(conn, rows)
+                    self.counts[model.__tablename__] = self.counts.get(model.__tablename__, 0) + len(rows)
+                    self.rows[model] = []
+        if self.progress is not None:
+            self.progress(dict(self.counts))
+
+
+def _zipf_cum_weights(count, exponent):
+    return list(itertools.accumulate(rank ** -exponent for rank in range(1, count + 1)))
+
+
+def _allocate(total, weights):
+    """Split total into integers proportional to weights (largest remainder)"""
+    weight_sum = sum(weights)
+    if not weight_sum:
+        return [0] * len(weights)
+    shares = [total * weight / weight_sum for weight in weights]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(weights)), key=lambda i: counts[i] - shares[i])
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def _poisson(rng, mean):
+    """Poisson sample (Knuth's method; the means used here are small)"""
+    if mean <= 0:
+        return 0
+    limit = math.exp(-mean)
+    count, product = 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def _city_name(rng, number):
+    syllables = ''.join(rng.choice(CITY_SYLLABLES) for _ in range(rng.randint(2, 3)))
+    return f'{syllables.capitalize()} {number}'
+
+
+def _reset_sequences(engine):
+    """Move PostgreSQL id sequences past the explicit ids generate() inserted"""
+    if engine.dialect.name != 'postgresql':
+        return
+    with engine.begin() as conn:
+        for model in INSERT_ORDER:
+            table = model.__tablename__
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+            ))
+
+
+def generate(engine, scale, seed=42, batch_size=5000, progress=None):
+    """Insert a synthetic dataset; returns the rows inserted per table and the id ranges used
+
+    progress, if given, is called with the running row counts after every batch.
+    """
+    rng = random.Random(seed)
+    writer = _BatchWriter(engine, batch_size, progress)
+    with engine.connect() as conn:
+        first = {model: _next_id(conn, model) for model in INSERT_ORDER}
+    now = datetime.utcnow()
+    today = date.today()
+
+    # Cities: popularity ranks are shuffled so they don't follow the ids
+    ranks = list(range(1, scale.cities + 1))
+    rng.shuffle(ranks)
+    by_rank = sorted(range(scale.cities), key=lambda i: ranks[i])  # city indexes, most popular first
+    city_cum_weights = _zipf_cum_weights(scale.cities, CITY_POPULARITY_EXPONENT)
+    regions = list(REGIONS)
+    cost_index = []
+    for i in range(scale.cities):
+        city_id = first[City] + i
+        region = rng.choice(regions)
+        cost_index.append(round(rng.uniform(0.4, 2.2), 2))
+        writer.add(City, {
+            'id': city_id,
+            'name': _city_name(rng, city_id),
+            'country': rng.choice(REGIONS[region]),
+            'region': region,
+            'description': f'Synthetic city {city_id}',
+            'cost_index': cost_index[i],
+            'popularity_score': max(1, round(100 - 20 * math.log10(ranks[i]))),
+            'latitude': round(rng.uniform(-55, 65), 4),
+            'longitude': round(rng.uniform(-180, 180), 4),
+        })
+
+    def popular_cities(count):
+        """count city indexes, drawn by popularity"""
+        if not scale.cities:
+            return []
+        return [by_rank[rank] for rank in rng.choices(range(scale.cities), cum_weights=city_cum_weights, k=count)]
+
+    # Activities: city i owns ids activity_start[i] .. activity_start[i] + activity_count[i] - 1
+    activity_count = [0] * scale.cities
+    activity_weights = [rank ** -CITY_ACTIVITY_EXPONENT for rank in range(1, scale.cities + 1)]
+    for rank, count in enumerate(_allocate(scale.activities, activity_weights)):
+        activity_count[by_rank[rank]] = count
+    activity_start = list(itertools.accumulate([first[Activity]] + activity_count[:-1])) if scale.cities else []
+    activity_costs = array('d')
+    for i in range(scale.cities):
+        names = set()
+        for j in range(activity_count[i]):
+            category = rng.choice(CATEGORIES)
+            activity_costs.append(round(rng.lognormvariate(6.5, 0.8) * cost_index[i], -1))
+            name = f'{rng.choice(ACTIVITY_ADJECTIVES)} {rng.choice(ACTIVITY_NOUNS[category])}'
+            if name in names:
+                # Names are unique per city; numbered repeats cannot clash with the plain ones
+                name = f'{name} {j + 1}'
+            names.add(name)
+            writer.add(Activity, {
+                'id': activity_start[i] + j,
+                'city_id': first[City] + i,
+                'name': name,
+                'name_key': normalize_activity_name(name),
+                'description': f'A {category} activity',
+                'category': category,
+                'estimated_cost': activity_costs[-1],
+                'duration_hours': rng.choice(DURATIONS),
+            })
+
+    # Trips per user, skewed towards a minority of frequent planners
+    trips_per_user = [0] * scale.users
+    if scale.users:
+        user_order = list(range(scale.users))
+        rng.shuffle(user_order)
+        user_cum_weights = _zipf_cum_weights(scale.users, USER_TRIPS_EXPONENT)
+        for rank in rng.choices(range(scale.users), cum_weights=user_cum_weights, k=scale.trips):
+            trips_per_user[user_order[rank]] += 1
+
+    password_hash = generate_password_hash(DATASET_PASSWORD)
+    trip_id = first[Trip]
+    stop_id = first[Stop]
+    item_id = first[ItineraryActivity]
+    budget_id = first[Budget]
+    saved_id = first[SavedDestination]
+    for n in range(scale.users):
+        user_id = first[User] + n
+        writer.add(User, {
+            'id': user_id,
+            'email': f'dataset-user-{user_id}@example.com',
+            'password_hash': password_hash,
+            'name': f'Dataset User {user_id}',
+            'created_at': now,
+            'updated_at': now,
+        })
+
+        for index in sorted(set(popular_cities(_poisson(rng, scale.saved_per_user)))):
+            writer.add(SavedDestination, {'id': saved_id, 'user_id': user_id, 'city_id': first[City] + index, 'saved_at': now})
+            saved_id += 1
+
+        for _ in range(trips_per_user[n]):
+            start = today + timedelta(days=rng.randint(-730, 365))
+            # (city index, start, end) per stop, back to back
+            stops = []
+            for index in popular_cities(1 + _poisson(rng, max(scale.stops_per_trip - 1, 0))):
+                stop_start = stops[-1][2] if stops else start
+                nights = rng.choices(range(1, len(NIGHT_WEIGHTS) + 1), weights=NIGHT_WEIGHTS)[0]
+                stops.append((index, stop_start, stop_start + timedelta(days=nights)))
+            end = stops[-1][2] if stops else start + timedelta(days=rng.randint(1, 14))
+            is_public = rng.random() < PUBLIC_TRIP_SHARE
+            writer.add(Trip, {
+                'id': trip_id,
+                'user_id': user_id,
+                'name': f'Trip {trip_id}',
+                'description': 'Synthetic trip',
+                'start_date': start,
+                'end_date': end,
+                'is_public': is_public,
+                'share_code': f'ds-{seed}-{trip_id}' if is_public else None,
+                'created_at': now,
+                'updated_at': now,
+            })
+
+            activities_cost = 0.0
+            keys = spread_keys(len(stops)) if stops else []
+            for position, (index, stop_start, stop_end) in enumerate(stops):
+                writer.add(Stop, {
+                    'id': stop_id,
+                    'trip_id': trip_id,
+                    'city_id': first[City] + index,
+                    'sort_key': keys[position],
+                    'order_index': position + 1,
+                    'start_date': stop_start,
+                    'end_date': stop_end,
+                })
+                days = (stop_end - stop_start).days
+                if activity_count[index]:
+                    for _ in range(_poisson(rng, scale.activities_per_stop)):
+                        activity_id = activity_start[index] + rng.randrange(activity_count[index])
+                        writer.add(ItineraryActivity, {
+                            'id': item_id,
+                            'stop_id': stop_id,
+                            'activity_id': activity_id,
+                            'day_number': rng.randint(1, max(days, 1)),
+                            'time_of_day': rng.choice(TIMES_OF_DAY),
+                        })
+                        item_id += 1
+                        activities_cost += activity_costs[activity_id - first[Activity]]
+                stop_id += 1
+
+            nights = (end - start).days
+            writer.add(Budget, {
+                'id': budget_id,
+                'trip_id': trip_id,
+                'accommodation_cost': nights * 3000.0,
+                'food_cost': nights * 1200.0,
+                'transport_cost': nights * 500.0,
+                'activities_cost': activities_cost,
+                'misc_cost': 0.0,
+                'total_budget': nights * 4700.0 + activities_cost,
+            })
+            budget_id += 1
+            trip_id += 1
+
+    writer.flush()
+    _reset_sequences(engine)
+
+    return {
+        'counts': writer.counts,
+        'users': (first[User], first[User] + scale.users - 1),
+        'cities': (first[City], first[City] + scale.cities - 1),
+        'trips': (first[Trip], trip_id - 1),
+    }
@@ -0,0 +1,187 @@
+"""
+Per-trip change events, streamed to clients over Server-Sent Events.
+
+Handlers call queue_event() while they change a trip. Events wait in the
+session and are published only after the transaction commits (and are
+dropped on rollback), so subscribers never see changes that did not
+happen. Each event is encoded once and fanned out to every subscriber of
+the trip's channel.
+
+The broker is in-process (LocalBroker), so subscribers only see events
+from the worker they are connected to; a broker backed by an external
+pub/sub service can replace it by implementing publish() and subscribe().
+The broker keeps the last EVENT_REPLAY_SIZE events per trip so clients
+reconnecting with Last-Event-ID miss nothing. Only trips with subscribers
+have a history: it is kept for EVENT_REPLAY_SECONDS after the last
+subscriber leaves (time to reconnect), then dropped, so trips nobody
+watches cost nothing.
+"""
+
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+
+from flask import current_app, has_app_context, request
+from sqlalchemy import event
+
+EVENTS_KEY = 'globetrotter_events'
+PENDING_KEY = 'pending_trip_events'
+
+
+class Subscription:
+    """A subscriber's queue of encoded events for one channel"""
+
+    def __init__(self, channel, max_size):
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=max_size)
+        self.closed = False
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Too slow to keep up: end the stream, the client reconnects with Last-Event-ID
+            self.closed = True
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class LocalBroker:
+    """In-process pub/sub with a short replay buffer per channel"""
+
+    def __init__(self, replay_size=100, queue_size=256, replay_seconds=60, clock=time.monotonic):
+        self.replay_size = replay_size
+        self.queue_size = queue_size
+        self.replay_seconds = replay_seconds
+        self.clock = clock
+        self.ids = itertools.count(1)
+        self.subscribers = {}
+        self.history = {}
+        self.idle_since = {}  # channel -> when its last subscriber left (history still kept)
+        self.next_prune = clock() + replay_seconds
+        self.lock = threading.Lock()
+
+    def _prune(self, now):
+        """Drop the history of channels idle for longer than the replay window (at most once per window)"""
+        if now < self.next_prune:
+            return
+        expired = [channel for channel, since in self.idle_since.items() if now - since > self.replay_seconds]
+        for channel in expired:
+            del self.idle_since[channel]
+            self.history.pop(channel, None)
+        self.next_prune = now + self.replay_seconds
+
+    def publish(self, channel, event_type, data_text):
+        with self.lock:
+            item = (next(self.ids), event_type, data_text)
+            self._prune(self.clock())
+            if channel in self.subscribers or channel in self.idle_since:
+                self.history.setdefault(channel, deque(maxlen=self.replay_size)).append(item)
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(item)
+        return item[0]
+
+    def subscribe(self, channel, last_event_id=None):
+        subscription = Subscription(channel, self.queue_size)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+            self.idle_since.pop(channel, None)
+            if last_event_id is not None:
+                for item in self.history.get(channel, ()):
+                    if item[0] > last_event_id:
+                        subscription.put(item)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+                    now = self.clock()
+                    self.idle_since[subscription.channel] = now
+                    self._prune(now)
+
+
+def trip_channel(trip_id):
+    return f'trip:{trip_id}'
+
+
+def queue_event(session, trip_id, event_type, data):
+    """Publish an event for a trip once the session's transaction commits"""
+    session.info.setdefault(PENDING_KEY, []).append((trip_id, event_type, data))
+
+
+def init_events(app, session_class):
+    broker = LocalBroker(
+        app.config['EVENT_REPLAY_SIZE'], app.config['EVENT_QUEUE_SIZE'], app.config['EVENT_REPLAY_SECONDS']
+    )
+    app.extensions[EVENTS_KEY] = broker
+
+    @event.listens_for(session_class, 'after_commit')
+    def _publish_pending(session):
+        pending = session.info.pop(PENDING_KEY, None)
+        if not pending or not has_app_context():
+            return
+        events_broker = current_app.extensions.get(EVENTS_KEY)
+        if events_broker is None:
+            return
+        for trip_id, event_type, data in pending:
+            events_broker.publish(trip_channel(trip_id), event_type, current_app.json.dumps(data))
+
+    @event.listens_for(session_class, 'after_rollback')
+    def _drop_pending(session):
+        session.info.pop(PENDING_KEY, None)
+
+    return broker
+
+
+def _format(item):
+    event_id, event_type, data_text = item
+    return f'id: {event_id}\nevent: {event_type}\ndata: {data_text}\n\n'
+
+
+def event_stream(trip_id, last_event_id=None, end_on=('trip.deleted',)):
+    """Generator of SSE frames for a trip (subscribes immediately)"""
+    broker = current_app.extensions[EVENTS_KEY]
+    keepalive = current_app.config['EVENT_KEEPALIVE_SECONDS']
+    subscription = broker.subscribe(trip_channel(trip_id), last_event_id)
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'  # reconnect delay (ms)
+            while not subscription.closed:
+                try:
+                    item = subscription.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield _format(item)
+                if item[1] in end_on:
+                    break
+        finally:
+            broker.unsubscribe(subscription)
+
+    return generate()
+
+
+def sse_response(trip_id, end_on=('trip.deleted',)):
+    """text/event-stream response for a trip, resuming after Last-Event-ID"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    response = current_app.response_class(
+        event_stream(trip_id, last_event_id, end_on),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return response
@@ -0,0 +1,109 @@
+"""
+Sparse fieldsets for API responses.
+
+    ?fields=id,name,start_date        fields of the endpoint's primary type
+    ?fields[city]=id,name             fields of a nested type
+    ?include=stops,budget             heavy relations to embed (default: endpoint's usual set)
+
+Types: trip, stop, city, activity, itinerary_activity, budget, saved_destination.
+Relations: stops, activities, budget, ai_itinerary.
+
+The same selection drives serialization (to_dict(fieldset=...)) and the
+SQL column list (Fieldset.load_only), so unrequested columns such as long
+descriptions are neither loaded nor encoded.
+"""
+
+from datetime import date
+
+from flask import request
+from sqlalchemy.orm import load_only
+
+# Columns a serialized field needs, where it isn't simply the column of the same name
+FIELD_COLUMNS = {
+    'trip': {
+        'total_days': ('start_date', 'end_date'),
+        'stops_count': (),
+        'ai_itinerary': ('ai_itinerary_meta', 'ai_day_count'),
+    },
+    'stop': {
+        'duration_days': ('start_date', 'end_date'),
+        'city': ('city_id',),
+        'order_index': ('sort_key',),
+    },
+    'itinerary_activity': {
+        'activity': ('activity_id',),
+        'estimated_cost': ('estimated_cost_override', 'activity_id'),
+    },
+    'budget': {
+        'breakdown': ('transport_cost', 'accommodation_cost', 'food_cost', 'activities_cost', 'misc_cost'),
+    },
+    'saved_destination': {
+        'city': ('city_id',),
+    },
+}
+
+
+def _split(value):
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class Fieldset:
+    """Requested fields per type and relations to include"""
+
+    def __init__(self, fields=None, include=None):
+        self.fields = fields or {}
+        self.include = include
+
+    @classmethod
+    def from_request(cls, primary_type):
+        fields = {}
+        for key, value in request.args.items():
+            if key == 'fields':
+                fields[primary_type] = _split(value)
+            elif key.startswith('fields[') and key.endswith(']'):
+                fields[key[7:-1]] = _split(value)
+
+        include = request.args.get('include')
+        return cls(fields, _split(include) if include is not None else None)
+
+    def wants(self, type_, key):
+        selected = self.fields.get(type_)
+        return selected is None or key in selected
+
+    def includes(self, relation, default):
+        if self.include is None:
+            return default
+        return relation in self.include
+
+    def columns(self, type_, obj, names):
+        """Selected attributes of obj, dates as ISO strings
+
+        Unselected attributes are never read, so columns left out by
+        load_only are not lazy-loaded one row at a time.
+        """
+        result = {}
+        for name in names:
+            if self.wants(type_, name):
+                value = getattr(obj, name)
+                result[name] = value.isoformat() if isinstance(value, date) else value
+        return result
+
+    def load_only(self, model, type_, always=()):
+        """Query option loading only the columns the selected fields need (None = all)"""
+        selected = self.fields.get(type_)
+        if selected is None:
+            return None
+
+        table_columns = model.__table__.columns
+        columns = {'id', *always}
+        for key in selected:
+            columns.update(FIELD_COLUMNS.get(type_, {}).get(key, (key,)))
+        return load_only(*[getattr(model, name) for name in columns if name in table_columns])
+
+    def apply(self, query, model, type_, always=()):
+        """Add the load_only option for type_ to a query, if fields were selected"""
+        option = self.load_only(model, type_, always)
+        return query.options(option) if option is not None else query
+
+
+ALL_FIELDS = Fieldset()
@@ -0,0 +1,315 @@
+"""
+Budget forecasts for trips, with what-if scenarios.
+
+A forecast projects each stop's accommodation, food and transport cost
+from its city's cost_index, the stop's length in nights, the hours of
+its itinerary activities and the distance from the previous stop. The
+itinerary activities' own costs are added as they are. Accommodation is
+also scaled by the month each night falls in (FORECAST_MONTH_FACTORS,
+all 1.0 by default), so moving a stop to another season changes it.
+
+Scenarios rearrange, resize or move the same stops (see build_scenarios). All
+scenarios of a request, the baseline first, become rows of S x N arrays
+(S scenarios, N stops) and every cost is computed for all of them at
+once with numpy, so evaluating hundreds of scenarios costs about as much
+as evaluating one. Rates are in the budget currency at cost_index 1.0
+and come from the FORECAST_* settings.
+"""
+
+from datetime import date
+
+import numpy as np
+
+from models import db, Activity, City, ItineraryActivity, Stop
+
+EARTH_RADIUS_KM = 6371.0
+CATEGORIES = ('accommodation', 'food', 'transport', 'activities')
+SCENARIO_KEYS = {'name', 'order', 'swap', 'nights', 'add_nights', 'cities', 'shift_days'}
+MAX_SHIFT_DAYS = 3660
+
+
+class ForecastError(Exception):
+    """A scenario could not be applied to the trip"""
+
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.message = message
+        self.index = index
+
+
+class TripInputs:
+    """Per-stop arrays of a trip, in stop order"""
+
+    def __init__(self, trip_id):
+        rows = db.session.query(
+            Stop.id, Stop.start_date, Stop.end_date, City.id, City.cost_index, City.latitude, City.longitude
+        ).join(City, Stop.city_id == City.id).filter(Stop.trip_id == trip_id).order_by(Stop.sort_key, Stop.id).all()
+
+        self.stop_ids = [row[0] for row in rows]
+        self.positions = {stop_id: position for position, stop_id in enumerate(self.stop_ids)}
+        self.start = np.array([row[1].toordinal() for row in rows], dtype=np.int64)
+        self.nights = np.array([max((row[2] - row[1]).days, 0) for row in rows], dtype=np.int64)
+        self.city_ids = np.array([row[3] for row in rows], dtype=np.int64)
+        self.cost_index = np.array([row[4] if row[4] is not None else 1.0 for row in rows], dtype=np.float64)
+        self.latitude = np.array([np.nan if row[5] is None else row[5] for row in rows], dtype=np.float64)
+        self.longitude = np.array([np.nan if row[6] is None else row[6] for row in rows], dtype=np.float64)
+
+        self.activities_cost = np.zeros(len(rows))
+        self.activity_hours = np.zeros(len(rows))
+        if rows:
+            cost = db.func.coalesce(db.func.nullif(ItineraryActivity.estimated_cost_override, 0), Activity.estimated_cost)
+            totals = db.session.query(
+                ItineraryActivity.stop_id,
+                db.func.coalesce(db.func.sum(cost), 0.0),
+                db.func.coalesce(db.func.sum(Activity.duration_hours), 0.0)
+            ).join(Activity, ItineraryActivity.activity_id == Activity.id).filter(
+                ItineraryActivity.stop_id.in_(self.stop_ids)
+            ).group_by(ItineraryActivity.stop_id)
+            for stop_id, total, hours in totals:
+                self.activities_cost[self.positions[stop_id]] = total
+                self.activity_hours[self.positions[stop_id]] = hours
+
+
+class Scenarios:
+    """S x N arrays of stop attributes, one row per scenario (row 0 = the trip as it is)"""
+
+    def __init__(self, inputs, count):
+        shape = (count, len(inputs.stop_ids))
+        # order[s, i] = which of the trip's stops is i-th in scenario s
+        self.order = np.broadcast_to(np.arange(shape[1]), shape).copy()
+        self.start = np.broadcast_to(inputs.start, shape).copy()  # date ordinals
+        self.nights = np.broadcast_to(inputs.nights, shape).copy()
+        self.city_ids = np.broadcast_to(inputs.city_ids, shape).copy()
+        self.cost_index = np.broadcast_to(inputs.cost_index, shape).copy()
+        self.latitude = np.broadcast_to(inputs.latitude, shape).copy()
+        self.longitude = np.broadcast_to(inputs.longitude, shape).copy()
+        self.activities_cost = np.broadcast_to(inputs.activities_cost, shape).copy()
+        self.activity_hours = np.broadcast_to(inputs.activity_hours, shape).copy()
+
+    def reorder(self):
+        """Apply each row's stop order to the per-stop arrays"""
+        for name in ('start', 'nights', 'city_ids', 'cost_index', 'latitude', 'longitude', 'activities_cost', 'activity_hours'):
+            setattr(self, name, np.take_along_axis(getattr(self, name), self.order, axis=1))
+
+
+def _stop_position(inputs, stop_id, index):
+    try:
+        position = inputs.positions.get(int(stop_id))
+    except (TypeError, ValueError):
+        position = None
+    if position is None:
+        raise ForecastError(f'Stop {stop_id} not found in this trip', index)
+    return position
+
+
+def _mapping(spec, key, index):
+    value = spec.get(key) or {}
+    if not isinstance(value, dict):
+        raise ForecastError(f'{key} must map stop ids to values', index)
+    return value
+
+
+def _nights(value, index):
+    try:
+        nights = int(value)
+    except (TypeError, ValueError):
+        raise ForecastError('nights must be integers', index)
+    if nights < 0:
+        raise ForecastError('nights cannot be negative', index)
+    return nights
+
+
+def _nights_delta(value, index):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ForecastError('add_nights must be integers', index)
+
+
+def _shift(value, index):
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        raise ForecastError('shift_days must be integers', index)
+    if abs(days) > MAX_SHIFT_DAYS:
+        raise ForecastError(f'shift_days cannot move a stop more than {MAX_SHIFT_DAYS} days', index)
+    return days
+
+
+def build_scenarios(inputs, specs):
+    """Scenario arrays for a list of what-if specs (row 0 is the baseline)
+
+    Each spec may contain:
+        order       every stop id of the trip, in the new order
+        swap        [stop_id, stop_id] - exchange two stops' positions
+        nights      {stop_id: nights} - new length of a stop
+        add_nights  {stop_id: delta} - lengthen (or shorten) a stop
+        cities      {stop_id: city_id} - visit another city instead
+        shift_days  days - move the whole trip, or {stop_id: days} - move a stop
+    """
+    if not isinstance(specs, list):
+        raise ForecastError('scenarios must be a list')
+    for index, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            raise ForecastError('each scenario must be an object', index)
+        for key in spec:
+            if key not in SCENARIO_KEYS:
+                raise ForecastError(f'unknown scenario key {key!r}', index)
+
+    city_ids = set()
+    for index, spec in enumerate(specs):
+        for city_id in _mapping(spec, 'cities', index).values():
+            try:
+                city_ids.add(int(city_id))
+            except (TypeError, ValueError):
+                raise ForecastError('city ids must be integers', index)
+    cities = {}
+    if city_ids:
+        rows = db.session.query(City.id, City.cost_index, City.latitude, City.longitude).filter(City.id.in_(city_ids))
+        cities = {row[0]: row[1:] for row in rows}
+
+    scenarios = Scenarios(inputs, len(specs) + 1)
+    for index, spec in enumerate(specs):
+        row = index + 1
+        # Lengths and cities are set per stop, before stops are rearranged
+        for stop_id, nights in _mapping(spec, 'nights', index).items():
+            scenarios.nights[row, _stop_position(inputs, stop_id, index)] = _nights(nights, index)
+        for stop_id, delta in _mapping(spec, 'add_nights', index).items():
+            position = _stop_position(inputs, stop_id, index)
+            scenarios.nights[row, position] = max(scenarios.nights[row, position] + _nights_delta(delta, index), 0)
+        for stop_id, city_id in _mapping(spec, 'cities', index).items():
+            position = _stop_position(inputs, stop_id, index)
+            city = cities.get(int(city_id))
+            if city is None:
+                raise ForecastError(f'City {city_id} not found', index)
+            cost_index, latitude, longitude = city
+            scenarios.city_ids[row, position] = int(city_id)
+            scenarios.cost_index[row, position] = cost_index if cost_index is not None else 1.0
+            scenarios.latitude[row, position] = np.nan if latitude is None else latitude
+            scenarios.longitude[row, position] = np.nan if longitude is None else longitude
+            # The stop's itinerary activities belong to the city it no longer visits
+            scenarios.activities_cost[row, position] = 0.0
+            scenarios.activity_hours[row, position] = 0.0
+        shift = spec.get('shift_days')
+        if isinstance(shift, dict):
+            for stop_id, days in shift.items():
+                scenarios.start[row, _stop_position(inputs, stop_id, index)] += _shift(days, index)
+        elif shift is not None:
+            scenarios.start[row] += _shift(shift, index)
+
+        if 'order' in spec:
+            if not isinstance(spec['order'], list):
+                raise ForecastError('order must be a list of stop ids', index)
+            order = [_stop_position(inputs, stop_id, index) for stop_id in spec['order']]
+            if sorted(order) != list(range(len(inputs.stop_ids))):
+                raise ForecastError('order must list every stop of the trip once', index)
+            scenarios.order[row] = order
+        if 'swap' in spec:
+            swap = spec['swap']
+            if not isinstance(swap, list) or len(swap) != 2:
+                raise ForecastError('swap must be a pair of stop ids', index)
+            first, second = (_stop_position(inputs, stop_id, index) for stop_id in swap)
+            current = list(scenarios.order[row])
+            i, j = current.index(first), current.index(second)
+            scenarios.order[row, i], scenarios.order[row, j] = second, first
+
+    scenarios.reorder()
+    return scenarios
+
+
+def leg_distances(latitude, longitude):
+    """Great-circle km from each stop's city to the next one's, per row (S x N-1, NaN when unknown)"""
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    dlat = lat[:, 1:] - lat[:, :-1]
+    dlon = lon[:, 1:] - lon[:, :-1]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, :-1]) * np.cos(lat[:, 1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def month_factors(start, nights, factors):
+    """Mean of the month factors over each stop's nights (S x N; a day trip takes its day's)"""
+    if start.size == 0:
+        return np.ones(start.shape)
+    days = np.maximum(nights, 1)
+    first = int(start.min())
+    months = np.array([date.fromordinal(day).month for day in range(first, int((start + days).max()))])
+    # Running sum of the daily factors, so any span's total is a difference of two entries
+    running = np.concatenate(([0.0], np.cumsum(np.asarray(factors, dtype=np.float64)[months - 1])))
+    return (running[start + days - first] - running[start - first]) / days
+
+
+def compute(scenarios, rates):
+    """Per-stop cost arrays (S x N) for every category, plus the inbound distances"""
+    nights = scenarios.nights.astype(np.float64)
+    days = np.maximum(nights, 1.0)
+    season = month_factors(scenarios.start, scenarios.nights, rates['month_factors'])
+    cost_index = scenarios.cost_index
+
+    distances = np.zeros_like(nights)
+    if nights.shape[1] > 1:
+        distances[:, 1:] = leg_distances(scenarios.latitude, scenarios.longitude)
+
+    local = (days * rates['local_transport_per_day'] + scenarios.activity_hours * rates['transport_per_activity_hour']) * cost_index
+    travel = np.nan_to_num(distances, nan=0.0) * rates['travel_per_km']
+    return {
+        'accommodation': nights * rates['accommodation_per_night'] * cost_index * season,
+        'food': days * rates['food_per_day'] * cost_index,
+        'transport': local + travel,
+        'activities': scenarios.activities_cost,
+    }, distances
+
+
+def rates_from_config(config):
+    if len(config['FORECAST_MONTH_FACTORS']) != 12:
+        raise ValueError('FORECAST_MONTH_FACTORS needs one factor per month')
+    return {
+        'accommodation_per_night': config['FORECAST_ACCOMMODATION_PER_NIGHT'],
+        'food_per_day': config['FORECAST_FOOD_PER_DAY'],
+        'local_transport_per_day': config['FORECAST_LOCAL_TRANSPORT_PER_DAY'],
+        'transport_per_activity_hour': config['FORECAST_TRANSPORT_PER_ACTIVITY_HOUR'],
+        'travel_per_km': config['FORECAST_TRAVEL_PER_KM'],
+        'month_factors': config['FORECAST_MONTH_FACTORS'],
+    }
+
+
+def _stop_rows(row, stop_ids, scenarios, costs, distances, stop_totals):
+    return [
+        {
+            'stop_id': int(stop_ids[row, i]),
+            'city_id': int(scenarios.city_ids[row, i]),
+            'start_date': date.fromordinal(int(scenarios.start[row, i])).isoformat(),
+            'end_date': date.fromordinal(int(scenarios.start[row, i] + scenarios.nights[row, i])).isoformat(),
+            'nights': int(scenarios.nights[row, i]),
+            'distance_km': None if np.isnan(distances[row, i]) else round(float(distances[row, i]), 1),
+            **{category: round(float(costs[category][row, i]), 2) for category in CATEGORIES},
+            'total': round(float(stop_totals[row, i]), 2),
+        }
+        for i in range(stop_ids.shape[1])
+    ]
+
+
+def forecast_trip(trip_id, specs, rates, scenario_stops=True):
+    """Baseline forecast and one forecast per scenario spec (per-stop rows optional for scenarios)"""
+    inputs = TripInputs(trip_id)
+    scenarios = build_scenarios(inputs, specs)
+    costs, distances = compute(scenarios, rates)
+
+    stop_totals = sum(costs[category] for category in CATEGORIES)
+    category_totals = {category: costs[category].sum(axis=1) for category in CATEGORIES}
+    totals = stop_totals.sum(axis=1)
+    stop_ids = np.array(inputs.stop_ids, dtype=np.int64)[scenarios.order]
+
+    results = []
+    for row in range(len(totals)):
+        result = {
+            'totals': {category: round(float(category_totals[category][row]), 2) for category in CATEGORIES},
+            'total': round(float(totals[row]), 2),
+        }
+        if row == 0 or scenario_stops:
+            result['stops'] = _stop_rows(row, stop_ids, scenarios, costs, distances, stop_totals)
+        if row > 0:
+            result['name'] = specs[row - 1].get('name')
+            result['difference'] = round(float(totals[row] - totals[0]), 2)
+        results.append(result)
+    return results[0], results[1:]
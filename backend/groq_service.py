@@ -1,12 +1,31 @@
 import requests
 from groq import Groq
 import json
+import time
 
 class GroqService:
     def __init__(self, api_key):
         self.client = Groq(api_key=api_key)
         # Updated to a supported model (see Groq deprecations docs)
         self.model = "llama-3.3-70b-versatile"
+        # Called as listener(method, seconds, usage, error) after every API call
+        self.listeners = []
+    
+    def _create_completion(self, method, **kwargs):
+        """Call the chat completions API and report the call to the listeners"""
+        started = time.perf_counter()
+        usage = error = None
+        try:
+            chat_completion = self.client.chat.completions.create(**kwargs)
+            usage = getattr(chat_completion, 'usage', None)
+            return chat_completion
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            for listener in self.listeners:
+                listener(method, elapsed, usage, error)
     
     def generate_itinerary(self, destination, days, budget_min, budget_max, preferences=None):
         """Generate a detailed travel itinerary using Groq AI"""
@@ -91,7 +110,8 @@ Format the response as JSON with this structure:
 Ensure the total stays within budget and all costs are in INR ₹."""
 
         try:
-            chat_completion = self.client.chat.completions.create(
+            chat_completion = self._create_completion(
+                'generate_itinerary',
                 messages=[
                     {
                         "role": "system",
@@ -147,7 +167,8 @@ Respond with JSON:
 }}"""
 
         try:
-            chat_completion = self.client.chat.completions.create(
+            chat_completion = self._create_completion(
+                'suggest_activities',
                 messages=[
                     {
                         "role": "system",
@@ -197,7 +218,8 @@ Respond with JSON:
 }}"""
 
         try:
-            chat_completion = self.client.chat.completions.create(
+            chat_completion = self._create_completion(
+                'get_city_info',
                 messages=[
                     {
                         "role": "system",
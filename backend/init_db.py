@@ -5,6 +5,7 @@ Run this once before starting the application: python init_db.py
 
 from app import app, db
 from models import City, Activity
+from migrations import run_migrations
 from datetime import datetime
 
 def init_database():
@@ -17,6 +18,7 @@ def init_database():
         # Create all tables
         print("Creating database tables...")
         db.create_all()
+        run_migrations(db.engine)
         print("✅ Tables created successfully!")
         
         # Check if data already exists
@@ -5,6 +5,9 @@
 DROP TABLE IF EXISTS saved_destinations CASCADE;
 DROP TABLE IF EXISTS itinerary_activities CASCADE;
 DROP TABLE IF EXISTS budgets CASCADE;
+DROP TABLE IF EXISTS llm_usage CASCADE;
+DROP TABLE IF EXISTS change_log CASCADE;
+DROP TABLE IF EXISTS itinerary_days CASCADE;
 DROP TABLE IF EXISTS stops CASCADE;
 DROP TABLE IF EXISTS activities CASCADE;
 DROP TABLE IF EXISTS trips CASCADE;
@@ -20,7 +23,8 @@ CREATE TABLE users (
     photo_url VARCHAR(255),
     language_preference VARCHAR(10) DEFAULT 'en',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sync_seq INTEGER NOT NULL DEFAULT 0
 );
 
 -- Create Cities table
@@ -42,11 +46,13 @@ CREATE TABLE activities (
     id SERIAL PRIMARY KEY,
     city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
     name VARCHAR(200) NOT NULL,
+    name_key VARCHAR(200) NOT NULL,
     description TEXT,
     category VARCHAR(50),
     estimated_cost FLOAT DEFAULT 0.0,
     duration_hours FLOAT DEFAULT 2.0,
-    image_url VARCHAR(255)
+    image_url VARCHAR(255),
+    CONSTRAINT uq_activities_city_name_key UNIQUE (city_id, name_key)
 );
 
 -- Create Trips table
@@ -60,8 +66,25 @@ CREATE TABLE trips (
     cover_photo_url VARCHAR(255),
     is_public BOOLEAN DEFAULT FALSE,
     share_code VARCHAR(50) UNIQUE,
+    ai_itinerary_meta JSONB,
+    ai_day_count INTEGER,
+    ai_total_cost FLOAT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    version INTEGER NOT NULL DEFAULT 1
+);
+
+-- Create Itinerary Days table (one row per day of a trip's AI itinerary)
+CREATE TABLE itinerary_days (
+    id SERIAL PRIMARY KEY,
+    trip_id INTEGER NOT NULL REFERENCES trips(id) ON DELETE CASCADE,
+    day_number INTEGER NOT NULL,
+    title VARCHAR(200),
+    activity_count INTEGER DEFAULT 0,
+    accommodation_cost FLOAT DEFAULT 0.0,
+    day_cost FLOAT DEFAULT 0.0,
+    payload JSONB NOT NULL,
+    CONSTRAINT uq_itinerary_days_trip_day UNIQUE (trip_id, day_number)
 );
 
 -- Create Stops table
@@ -69,10 +92,12 @@ CREATE TABLE stops (
     id SERIAL PRIMARY KEY,
     trip_id INTEGER NOT NULL REFERENCES trips(id) ON DELETE CASCADE,
     city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
+    sort_key VARCHAR(64) COLLATE "C" NOT NULL,  -- byte order, see ordering.py
     order_index INTEGER NOT NULL,
     start_date DATE NOT NULL,
     end_date DATE NOT NULL,
-    notes TEXT
+    notes TEXT,
+    version INTEGER NOT NULL DEFAULT 1
 );
 
 -- Create Itinerary Activities table
@@ -96,7 +121,8 @@ CREATE TABLE budgets (
     food_cost FLOAT DEFAULT 0.0,
     activities_cost FLOAT DEFAULT 0.0,
     misc_cost FLOAT DEFAULT 0.0,
-    currency VARCHAR(10) DEFAULT 'USD'
+    currency VARCHAR(10) DEFAULT 'USD',
+    version INTEGER NOT NULL DEFAULT 1
 );
 
 -- Create Saved Destinations table
@@ -108,13 +134,56 @@ CREATE TABLE saved_destinations (
     UNIQUE(user_id, city_id)
 );
 
--- Create indexes for better performance
+-- Latest change per synced entity, for GET /api/sync
+CREATE TABLE change_log (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    entity_type VARCHAR(40) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    trip_id INTEGER,
+    deleted BOOLEAN NOT NULL DEFAULT FALSE,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_change_log_entity UNIQUE (user_id, entity_type, entity_id)
+);
+
+-- Create LLM Usage table (one row per Groq API call)
+CREATE TABLE llm_usage (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    trip_id INTEGER,
+    endpoint VARCHAR(100),
+    method VARCHAR(50) NOT NULL,
+    model VARCHAR(100),
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms DOUBLE PRECISION,
+    success BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create indexes for better performance (kept in sync with migrations.py)
 CREATE INDEX idx_trips_user_id ON trips(user_id);
-CREATE INDEX idx_trips_share_code ON trips(share_code);
-CREATE INDEX idx_stops_trip_id ON stops(trip_id);
-CREATE INDEX idx_activities_city_id ON activities(city_id);
+CREATE INDEX idx_stops_trip_sort_key ON stops(trip_id, sort_key);
+CREATE INDEX idx_activities_city_category_cost ON activities(city_id, category, estimated_cost);
+CREATE INDEX idx_activities_category_cost ON activities(category, estimated_cost);
 CREATE INDEX idx_itinerary_activities_stop_id ON itinerary_activities(stop_id);
+CREATE INDEX idx_itinerary_activities_activity_id ON itinerary_activities(activity_id);
+CREATE INDEX idx_budgets_trip_id ON budgets(trip_id);
 CREATE INDEX idx_saved_destinations_user_id ON saved_destinations(user_id);
+CREATE INDEX idx_cities_popularity ON cities(popularity_score);
+CREATE INDEX idx_cities_country_name ON cities(country, name);
+CREATE INDEX idx_change_log_user_seq ON change_log(user_id, seq);
+CREATE INDEX idx_llm_usage_user_created ON llm_usage(user_id, created_at);
+CREATE INDEX idx_llm_usage_created ON llm_usage(created_at);
+
+-- Trigram indexes for case-insensitive substring search (ILIKE '%term%')
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_cities_name_trgm ON cities USING gin (name gin_trgm_ops);
+CREATE INDEX idx_cities_country_trgm ON cities USING gin (country gin_trgm_ops);
+CREATE INDEX idx_cities_region_trgm ON cities USING gin (region gin_trgm_ops);
+CREATE INDEX idx_activities_name_trgm ON activities USING gin (name gin_trgm_ops);
+CREATE INDEX idx_activities_description_trgm ON activities USING gin (description gin_trgm_ops);
 
 -- Insert sample cities
 INSERT INTO cities (name, country, region, description, cost_index, popularity_score, latitude, longitude) VALUES
@@ -135,36 +204,36 @@ INSERT INTO cities (name, country, region, description, cost_index, popularity_s
 ('Lisbon', 'Portugal', 'Europe', 'Coastal capital with hills, trams, and pastel buildings.', 1.0, 82, 38.7223, -9.1393);
 
 -- Insert sample activities for Paris
-INSERT INTO activities (city_id, name, description, category, estimated_cost, duration_hours) VALUES
-(1, 'Eiffel Tower Visit', 'Visit the iconic Eiffel Tower and enjoy panoramic city views.', 'sightseeing', 30, 2.5),
-(1, 'Louvre Museum', 'Explore the world''s largest art museum with Mona Lisa.', 'culture', 20, 3.0),
-(1, 'Seine River Cruise', 'Romantic boat cruise along the Seine River.', 'sightseeing', 25, 1.5),
-(1, 'Montmartre Walking Tour', 'Explore the artistic neighborhood with Sacré-Cœur.', 'culture', 15, 2.0),
-(1, 'French Cooking Class', 'Learn to cook authentic French cuisine.', 'food', 85, 3.5);
+INSERT INTO activities (city_id, name, name_key, description, category, estimated_cost, duration_hours) VALUES
+(1, 'Eiffel Tower Visit', 'eiffel tower visit', 'Visit the iconic Eiffel Tower and enjoy panoramic city views.', 'sightseeing', 30, 2.5),
+(1, 'Louvre Museum', 'louvre museum', 'Explore the world''s largest art museum with Mona Lisa.', 'culture', 20, 3.0),
+(1, 'Seine River Cruise', 'seine river cruise', 'Romantic boat cruise along the Seine River.', 'sightseeing', 25, 1.5),
+(1, 'Montmartre Walking Tour', 'montmartre walking tour', 'Explore the artistic neighborhood with Sacré-Cœur.', 'culture', 15, 2.0),
+(1, 'French Cooking Class', 'french cooking class', 'Learn to cook authentic French cuisine.', 'food', 85, 3.5);
 
 -- Insert sample activities for Tokyo
-INSERT INTO activities (city_id, name, description, category, estimated_cost, duration_hours) VALUES
-(2, 'Tokyo Skytree', 'Visit Japan''s tallest structure for breathtaking views.', 'sightseeing', 28, 2.0),
-(2, 'Senso-ji Temple', 'Historic Buddhist temple in Asakusa district.', 'culture', 0, 1.5),
-(2, 'Tsukiji Market Tour', 'Explore the famous fish market and try fresh sushi.', 'food', 40, 2.5),
-(2, 'Shibuya Crossing', 'Experience the world''s busiest pedestrian crossing.', 'sightseeing', 0, 1.0),
-(2, 'Sumo Wrestling Experience', 'Watch or participate in traditional sumo wrestling.', 'culture', 60, 2.0);
+INSERT INTO activities (city_id, name, name_key, description, category, estimated_cost, duration_hours) VALUES
+(2, 'Tokyo Skytree', 'tokyo skytree', 'Visit Japan''s tallest structure for breathtaking views.', 'sightseeing', 28, 2.0),
+(2, 'Senso-ji Temple', 'senso-ji temple', 'Historic Buddhist temple in Asakusa district.', 'culture', 0, 1.5),
+(2, 'Tsukiji Market Tour', 'tsukiji market tour', 'Explore the famous fish market and try fresh sushi.', 'food', 40, 2.5),
+(2, 'Shibuya Crossing', 'shibuya crossing', 'Experience the world''s busiest pedestrian crossing.', 'sightseeing', 0, 1.0),
+(2, 'Sumo Wrestling Experience', 'sumo wrestling experience', 'Watch or participate in traditional sumo wrestling.', 'culture', 60, 2.0);
 
 -- Insert sample activities for New York
-INSERT INTO activities (city_id, name, description, category, estimated_cost, duration_hours) VALUES
-(3, 'Statue of Liberty Tour', 'Ferry tour to the iconic Statue of Liberty.', 'sightseeing', 25, 3.0),
-(3, 'Central Park Walk', 'Stroll through Manhattan''s famous urban park.', 'sightseeing', 0, 2.0),
-(3, 'Broadway Show', 'Watch a world-class musical or play.', 'culture', 120, 2.5),
-(3, 'Empire State Building', 'Observation deck with stunning NYC views.', 'sightseeing', 42, 1.5),
-(3, 'Food Tour in Brooklyn', 'Taste diverse cuisines in Brooklyn neighborhoods.', 'food', 75, 3.0);
+INSERT INTO activities (city_id, name, name_key, description, category, estimated_cost, duration_hours) VALUES
+(3, 'Statue of Liberty Tour', 'statue of liberty tour', 'Ferry tour to the iconic Statue of Liberty.', 'sightseeing', 25, 3.0),
+(3, 'Central Park Walk', 'central park walk', 'Stroll through Manhattan''s famous urban park.', 'sightseeing', 0, 2.0),
+(3, 'Broadway Show', 'broadway show', 'Watch a world-class musical or play.', 'culture', 120, 2.5),
+(3, 'Empire State Building', 'empire state building', 'Observation deck with stunning NYC views.', 'sightseeing', 42, 1.5),
+(3, 'Food Tour in Brooklyn', 'food tour in brooklyn', 'Taste diverse cuisines in Brooklyn neighborhoods.', 'food', 75, 3.0);
 
 -- Insert sample activities for Bali
-INSERT INTO activities (city_id, name, description, category, estimated_cost, duration_hours) VALUES
-(5, 'Tanah Lot Temple', 'Visit the iconic sea temple at sunset.', 'culture', 5, 2.0),
-(5, 'Rice Terrace Walk', 'Trek through stunning Tegallalang rice terraces.', 'sightseeing', 3, 2.5),
-(5, 'Surfing Lesson', 'Learn to surf on Bali''s famous beaches.', 'adventure', 35, 2.0),
-(5, 'Ubud Monkey Forest', 'Explore sanctuary with playful monkeys.', 'sightseeing', 7, 1.5),
-(5, 'Balinese Spa Treatment', 'Relax with traditional massage and spa.', 'culture', 25, 2.0);
+INSERT INTO activities (city_id, name, name_key, description, category, estimated_cost, duration_hours) VALUES
+(5, 'Tanah Lot Temple', 'tanah lot temple', 'Visit the iconic sea temple at sunset.', 'culture', 5, 2.0),
+(5, 'Rice Terrace Walk', 'rice terrace walk', 'Trek through stunning Tegallalang rice terraces.', 'sightseeing', 3, 2.5),
+(5, 'Surfing Lesson', 'surfing lesson', 'Learn to surf on Bali''s famous beaches.', 'adventure', 35, 2.0),
+(5, 'Ubud Monkey Forest', 'ubud monkey forest', 'Explore sanctuary with playful monkeys.', 'sightseeing', 7, 1.5),
+(5, 'Balinese Spa Treatment', 'balinese spa treatment', 'Relax with traditional massage and spa.', 'culture', 25, 2.0);
 
 COMMENT ON TABLE users IS 'Stores user account information';
 COMMENT ON TABLE cities IS 'Stores city information for trip planning';
@@ -0,0 +1,155 @@
+"""
+Per-request SQL instrumentation.
+
+Engine event hooks time every statement executed while a request is
+being handled and collect, per request, the query count, total database
+time, the slowest statement and how often each statement repeated. A
+statement repeated many times in one request is usually an N+1 pattern:
+a lazy load or query inside a loop.
+
+With SQL_TIMING_HEADERS (on in debug mode by default) responses carry a
+Server-Timing header, which browser dev tools show next to each request.
+Requests over the thresholds (SQL_MAX_QUERIES, or SQL_ROUTE_MAX_QUERIES
+for an endpoint, SQL_REPEATED_STATEMENT_LIMIT, SQL_SLOW_QUERY_MS) are
+logged as one JSON line each; SQL_LOG_REQUESTS=all logs every request.
+"""
+
+import json
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+START_KEY = 'query_start_times'
+STATEMENT_LOG_LENGTH = 300
+
+
+class QueryStats:
+    """Statements executed while handling one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.statements = {}
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def repeated(self, limit):
+        """Statements run more than limit times, most frequent first"""
+        counts = [(count, statement) for statement, count in self.statements.items() if count > limit]
+        return [(statement, count) for count, statement in sorted(counts, reverse=True)]
+
+
+def current_query_stats():
+    """QueryStats of the request being handled (None outside requests or when disabled)"""
+    return g.get('query_stats') if has_request_context() else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(START_KEY, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info[START_KEY].pop()
+    stats = current_query_stats()
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - started)
+
+
+def _handle_error(exception_context):
+    # The failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get(START_KEY):
+        conn.info[START_KEY].pop()
+
+
+def _truncate(statement):
+    statement = ' '.join(statement.split())
+    if len(statement) > STATEMENT_LOG_LENGTH:
+        return statement[:STATEMENT_LOG_LENGTH] + '...'
+    return statement
+
+
+def _flags(stats, config):
+    limit = config['SQL_ROUTE_MAX_QUERIES'].get(request.endpoint, config['SQL_MAX_QUERIES'])
+    flags = []
+    if stats.count > limit:
+        flags.append('query_count')
+    if stats.repeated(config['SQL_REPEATED_STATEMENT_LIMIT']):
+        flags.append('n_plus_one')
+    if stats.slowest_seconds * 1000 >= config['SQL_SLOW_QUERY_MS']:
+        flags.append('slow_query')
+    return flags
+
+
+def _log_record(stats, response, flags, config):
+    return {
+        'event': 'request_sql',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - stats.started) * 1000, 2),
+        'queries': stats.count,
+        'db_ms': round(stats.seconds * 1000, 2),
+        'slowest_ms': round(stats.slowest_seconds * 1000, 2),
+        'slowest_statement': _truncate(stats.slowest_statement) if stats.slowest_statement else None,
+        'repeated': [
+            {'statement': _truncate(statement), 'count': count}
+            for statement, count in stats.repeated(config['SQL_REPEATED_STATEMENT_LIMIT'])[:3]
+        ],
+        'flags': flags,
+    }
+
+
+def init_query_instrumentation(app):
+    """Count and time SQL per request; report via Server-Timing and JSON log lines"""
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    if app.config['SQL_LOG_REQUESTS'] == 'all' and app.logger.getEffectiveLevel() > logging.INFO:
+        app.logger.setLevel(logging.INFO)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def report_query_stats(response):
+        stats = g.get('query_stats')  # left in g for metrics.py
+        if stats is None:
+            return response
+        config = current_app.config
+
+        timing_headers = config['SQL_TIMING_HEADERS']
+        if timing_headers is None:
+            timing_headers = current_app.debug  # app.run(debug=True) sets this after startup
+        if timing_headers:
+            elapsed_ms = (time.perf_counter() - stats.started) * 1000
+            response.headers.add('Server-Timing', f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} queries"')
+            response.headers.add('Server-Timing', f'db-slowest;dur={stats.slowest_seconds * 1000:.2f}')
+            response.headers.add('Server-Timing', f'app;dur={elapsed_ms:.2f}')
+
+        mode = config['SQL_LOG_REQUESTS']
+        if mode != 'none':
+            flags = _flags(stats, config)
+            if flags or mode == 'all':
+                level = logging.WARNING if flags else logging.INFO
+                current_app.logger.log(level, json.dumps(_log_record(stats, response, flags, config)))
+        return response
@@ -0,0 +1,285 @@
+"""
+Batch itinerary editing for PATCH /api/trips/<id>/itinerary.
+
+A batch is a list of operations on one trip's stops and itinerary
+activities. The trip's stops and activities are loaded once up front,
+which both validates ownership of every id in the batch and avoids a
+query chain per operation; all changes are then committed together.
+
+Operations (each a dict with an "op" key):
+
+    add_stop         city_id, start_date, end_date, [notes], [order_index], [ref]
+    update_stop      stop_id, [start_date], [end_date], [notes]
+    move_stop        stop_id, order_index
+    remove_stop      stop_id
+    add_activity     stop_id, activity_id, [day_number], [time_of_day], [custom_notes],
+                     [estimated_cost_override], [ref]
+    update_activity  itinerary_activity_id, [day_number], [time_of_day], [custom_notes],
+                     [estimated_cost_override]
+    move_activity    itinerary_activity_id, stop_id, [day_number], [time_of_day]
+    remove_activity  itinerary_activity_id
+
+stop_id and itinerary_activity_id may name a stop or activity added
+earlier in the same batch by its "ref".
+order_index is 1-based, as in the single-stop endpoints. Moving or
+inserting a stop only writes that stop's sort key (see ordering.py).
+"""
+
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+from models import db, Activity, City, ItineraryActivity, Stop
+from ordering import key_between, needs_rebalance
+
+ACTIVITY_FIELDS = ('day_number', 'time_of_day', 'custom_notes', 'estimated_cost_override')
+ID_FIELDS = ('city_id', 'activity_id')  # catalogue ids
+REF_FIELDS = ('stop_id', 'itinerary_activity_id')  # ids, or refs of objects added in the batch
+
+
+class ItineraryBatchError(Exception):
+    """An operation in the batch could not be applied"""
+
+    def __init__(self, message, status=400, index=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.index = index
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.fromisoformat(value).date()
+    except (TypeError, ValueError):
+        raise ItineraryBatchError(f'{name} must be an ISO date')
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _parse_order(value, upper):
+    try:
+        order = int(value)
+    except (TypeError, ValueError):
+        raise ItineraryBatchError('order_index must be an integer')
+    return max(1, min(order, upper))
+
+
+class ItineraryBatch:
+    """Applies a list of operations to one trip inside the current session"""
+
+    def __init__(self, trip):
+        self.trip = trip
+        self.stops = list(trip.stops)  # in order_index order
+        self.stops_by_id = {stop.id: stop for stop in self.stops}
+        self.items = {}
+        if self.stops:
+            items = ItineraryActivity.query.filter(ItineraryActivity.stop_id.in_(self.stops_by_id)).all()
+            self.items = {item.id: item for item in items}
+        self.created = {}  # ref -> object added in this batch
+        self.needs_rebalance = False
+        self.changes = []  # (event type, object or removal payload), see events.py
+        self.events = []
+
+    def apply(self, operations):
+        self._check_references(operations)
+        for index, operation in enumerate(operations):
+            try:
+                handler = getattr(self, f"_op_{operation.get('op')}", None)
+                if handler is None:
+                    raise ItineraryBatchError(f"Unknown op: {operation.get('op')}")
+                handler(operation)
+            except ItineraryBatchError as e:
+                e.index = index
+                raise
+
+        db.session.flush()
+        self.events = self._build_events()
+        return {ref: obj.id for ref, obj in self.created.items()}
+
+    def _build_events(self):
+        """Serialize recorded changes in their final state, skipping objects removed later"""
+        positions = {id(stop): position for position, stop in enumerate(self.stops, start=1)}
+        events = []
+        for event_type, target in self.changes:
+            if isinstance(target, dict):
+                events.append((event_type, target))
+                continue
+            state = inspect(target)
+            if not state.persistent:
+                continue
+            if isinstance(target, Stop):
+                events.append((event_type, target.to_dict(order_index=positions.get(id(target)))))
+            else:
+                events.append((event_type, target.to_dict()))
+        return events
+
+    def _check_references(self, operations):
+        """Check every catalogue id in the batch with one query per table"""
+        if not isinstance(operations, list) or not operations:
+            raise ItineraryBatchError('operations must be a non-empty list')
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                raise ItineraryBatchError('each operation must be an object', index=index)
+            for field in ID_FIELDS:
+                if operation.get(field) is not None and not _is_id(operation[field]):
+                    raise ItineraryBatchError(f'{field} must be an integer', index=index)
+            for field in REF_FIELDS:
+                value = operation.get(field)
+                if value is not None and not (_is_id(value) or isinstance(value, str)):
+                    raise ItineraryBatchError(f'{field} must be an integer or a ref', index=index)
+
+        city_ids = {op.get('city_id') for op in operations if op.get('op') == 'add_stop'}
+        activity_ids = {op.get('activity_id') for op in operations if op.get('op') == 'add_activity'}
+        if city_ids:
+            found = {row[0] for row in db.session.query(City.id).filter(City.id.in_(city_ids - {None}))}
+            self.missing_cities = city_ids - found
+        else:
+            self.missing_cities = set()
+        if activity_ids:
+            found = {row[0] for row in db.session.query(Activity.id).filter(Activity.id.in_(activity_ids - {None}))}
+            self.missing_activities = activity_ids - found
+        else:
+            self.missing_activities = set()
+
+    def _stop(self, stop_id):
+        if isinstance(stop_id, str):
+            stop = self.created.get(stop_id)
+            stop = stop if isinstance(stop, Stop) else None
+        else:
+            stop = self.stops_by_id.get(stop_id)
+        if stop is None:
+            raise ItineraryBatchError(f'Stop {stop_id} not found in this trip', status=404)
+        return stop
+
+    def _item(self, item_id):
+        if isinstance(item_id, str):
+            item = self.created.get(item_id)
+            item = item if isinstance(item, ItineraryActivity) else None
+        else:
+            item = self.items.get(item_id)
+        if item is None:
+            raise ItineraryBatchError(f'Itinerary activity {item_id} not found in this trip', status=404)
+        return item
+
+    def _place(self, stop, position):
+        """Put stop at a 1-based position and give it a key between its neighbours"""
+        self.stops.insert(position - 1, stop)
+        lower = self.stops[position - 2].sort_key if position > 1 else None
+        upper = self.stops[position].sort_key if position < len(self.stops) else None
+        stop.sort_key = key_between(lower, upper)
+        self.needs_rebalance = self.needs_rebalance or needs_rebalance(stop.sort_key)
+
+    def _remember(self, operation, obj):
+        ref = operation.get('ref')
+        if ref is not None:
+            if not isinstance(ref, str) or ref in self.created:
+                raise ItineraryBatchError('ref must be a unique string')
+            self.created[ref] = obj
+
+    def _forget(self, removed):
+        """Drop refs to objects removed later in the batch"""
+        for ref in [ref for ref, obj in self.created.items() if removed(obj)]:
+            del self.created[ref]
+
+    def _op_add_stop(self, operation):
+        city_id = operation.get('city_id')
+        if not city_id or 'start_date' not in operation or 'end_date' not in operation:
+            raise ItineraryBatchError('city_id, start_date, and end_date are required')
+        if city_id in self.missing_cities:
+            raise ItineraryBatchError(f'City {city_id} not found', status=404)
+
+        stop = Stop(
+            trip=self.trip,
+            city_id=city_id,
+            start_date=_parse_date(operation['start_date'], 'start_date'),
+            end_date=_parse_date(operation['end_date'], 'end_date'),
+            notes=operation.get('notes', '')
+        )
+        if operation.get('order_index') is None:
+            position = len(self.stops) + 1
+        else:
+            position = _parse_order(operation['order_index'], len(self.stops) + 1)
+        stop.order_index = position
+        self._place(stop, position)
+        db.session.add(stop)
+        self._remember(operation, stop)
+        self.changes.append(('stop.added', stop))
+
+    def _op_update_stop(self, operation):
+        stop = self._stop(operation.get('stop_id'))
+        if 'start_date' in operation:
+            stop.start_date = _parse_date(operation['start_date'], 'start_date')
+        if 'end_date' in operation:
+            stop.end_date = _parse_date(operation['end_date'], 'end_date')
+        if 'notes' in operation:
+            stop.notes = operation['notes']
+        self.changes.append(('stop.updated', stop))
+
+    def _op_move_stop(self, operation):
+        stop = self._stop(operation.get('stop_id'))
+        position = _parse_order(operation.get('order_index'), len(self.stops))
+        if self.stops.index(stop) != position - 1:
+            self.stops.remove(stop)
+            self._place(stop, position)
+            self.changes.append(('stop.moved', stop))
+
+    def _op_remove_stop(self, operation):
+        stop = self._stop(operation.get('stop_id'))
+        self.stops.remove(stop)
+        self.stops_by_id.pop(stop.id, None)
+        self._forget(lambda obj: obj is stop or getattr(obj, 'stop', None) is stop)
+        for item_id in [item_id for item_id, item in self.items.items() if item.stop is stop]:
+            del self.items[item_id]
+        if stop in db.session.new:
+            # Pending: dropping it from the collection discards it (delete-orphan)
+            self.trip.stops.remove(stop)
+        else:
+            db.session.delete(stop)
+            self.changes.append(('stop.removed', {'id': stop.id, 'trip_id': self.trip.id}))
+
+    def _op_add_activity(self, operation):
+        stop = self._stop(operation.get('stop_id'))
+        activity_id = operation.get('activity_id')
+        if not activity_id:
+            raise ItineraryBatchError('activity_id is required')
+        if activity_id in self.missing_activities:
+            raise ItineraryBatchError(f'Activity {activity_id} not found', status=404)
+
+        item = ItineraryActivity(
+            stop=stop,
+            activity_id=activity_id,
+            day_number=operation.get('day_number', 1),
+            time_of_day=operation.get('time_of_day', 'morning'),
+            custom_notes=operation.get('custom_notes', ''),
+            estimated_cost_override=operation.get('estimated_cost_override')
+        )
+        db.session.add(item)
+        self._remember(operation, item)
+        self.changes.append(('activity.added', item))
+
+    def _op_update_activity(self, operation):
+        item = self._item(operation.get('itinerary_activity_id'))
+        for field in ACTIVITY_FIELDS:
+            if field in operation:
+                setattr(item, field, operation[field])
+        self.changes.append(('activity.updated', item))
+
+    def _op_move_activity(self, operation):
+        item = self._item(operation.get('itinerary_activity_id'))
+        item.stop = self._stop(operation.get('stop_id'))
+        for field in ('day_number', 'time_of_day'):
+            if field in operation:
+                setattr(item, field, operation[field])
+        self.changes.append(('activity.moved', item))
+
+    def _op_remove_activity(self, operation):
+        item = self._item(operation.get('itinerary_activity_id'))
+        self.items.pop(item.id, None)
+        self._forget(lambda obj: obj is item)
+        if item in db.session.new:
+            item.stop.itinerary_activities.remove(item)
+        else:
+            db.session.delete(item)
+            self.changes.append(('activity.removed', {'id': item.id, 'stop_id': item.stop_id}))
@@ -0,0 +1,239 @@
+"""
+LLM token accounting and per-user quotas.
+
+Every Groq API call is reported by GroqService to record_call(), which
+tags it with the requesting user, endpoint and trip and hands it to a
+UsageRecorder. The recorder queues rows and a background thread writes
+them to the llm_usage table in batches (LLM_USAGE_BATCH_SIZE rows, or
+whatever arrived within LLM_USAGE_FLUSH_SECONDS), so the request path
+only pays for a queue put.
+
+Quotas are daily token budgets per user (LLM_DAILY_TOKEN_QUOTA, UTC
+days). The check counts tokens already written plus those still queued,
+and runs before a call is made, so the call that crosses the limit is
+allowed and the next one is refused.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_request_context, jsonify, request
+from flask_login import current_user
+
+from models import db, LLMUsage, User
+
+RECORDER_KEY = 'globetrotter_llm_usage'
+GROUP_COLUMNS = ('day', 'user', 'method', 'endpoint')
+
+
+class UsageRecorder:
+    """Queues usage rows and writes them in batches on a background thread"""
+
+    def __init__(self, app, batch_size, flush_seconds, max_pending, asynchronous=True):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.asynchronous = asynchronous
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.pending_tokens = {}  # user_id -> tokens queued but not written yet
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def record(self, row):
+        if not self.asynchronous:
+            self._write([row])
+            return
+
+        tokens = row['prompt_tokens'] + row['completion_tokens']
+        with self.lock:
+            if row['user_id'] is not None:
+                self.pending_tokens[row['user_id']] = self.pending_tokens.get(row['user_id'], 0) + tokens
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='llm-usage-writer', daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self._settle([row])
+            self.app.logger.warning('LLM usage queue is full; dropping a usage record')
+
+    def pending_for(self, user_id):
+        with self.lock:
+            return self.pending_tokens.get(user_id, 0)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(LLMUsage.__table__.insert(), batch)
+        except Exception as e:
+            self.app.logger.warning(f'Writing {len(batch)} LLM usage record(s) failed: {e}')
+        finally:
+            if self.asynchronous:
+                self._settle(batch)
+
+    def _settle(self, batch):
+        with self.lock:
+            for row in batch:
+                user_id = row['user_id']
+                if user_id in self.pending_tokens:
+                    self.pending_tokens[user_id] -= row['prompt_tokens'] + row['completion_tokens']
+                    if self.pending_tokens[user_id] <= 0:
+                        del self.pending_tokens[user_id]
+
+    def flush(self):
+        """Block until every queued row has been written"""
+        if self.thread is not None:
+            self.queue.join()
+
+
+def init_llm_usage(app, groq_service):
+    """Record every Groq call made through groq_service"""
+    config = app.config
+    recorder = UsageRecorder(
+        app,
+        config['LLM_USAGE_BATCH_SIZE'],
+        config['LLM_USAGE_FLUSH_SECONDS'],
+        config['LLM_USAGE_MAX_PENDING'],
+        asynchronous=config['LLM_USAGE_ASYNC'],
+    )
+    app.extensions[RECORDER_KEY] = recorder
+    atexit.register(recorder.flush)
+
+    def record_call(method, seconds, usage=None, error=None):
+        user_id = endpoint = trip_id = None
+        if has_request_context():
+            endpoint = request.endpoint
+            trip_id = (request.view_args or {}).get('trip_id')
+            if current_user.is_authenticated:
+                user_id = current_user.id
+        recorder.record({
+            'user_id': user_id,
+            'trip_id': trip_id,
+            'endpoint': endpoint,
+            'method': method,
+            'model': groq_service.model,
+            'prompt_tokens': (getattr(usage, 'prompt_tokens', 0) or 0) if usage is not None else 0,
+            'completion_tokens': (getattr(usage, 'completion_tokens', 0) or 0) if usage is not None else 0,
+            'latency_ms': round(seconds * 1000, 2),
+            'success': error is None,
+            'created_at': datetime.utcnow(),
+        })
+
+    groq_service.listeners.append(record_call)
+    return recorder
+
+
+def _start_of_day(now=None):
+    now = now or datetime.utcnow()
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def tokens_used_today(user_id):
+    """Tokens the user has used since midnight UTC, including rows not written yet"""
+    written = db.session.query(
+        db.func.coalesce(db.func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens), 0)
+    ).filter(LLMUsage.user_id == user_id, LLMUsage.created_at >= _start_of_day()).scalar()
+    return int(written) + current_app.extensions[RECORDER_KEY].pending_for(user_id)
+
+
+def quota_exceeded(user_id):
+    """True when the user has used up today's token quota (0 = unlimited)"""
+    quota = current_app.config['LLM_DAILY_TOKEN_QUOTA']
+    return bool(quota) and tokens_used_today(user_id) >= quota
+
+
+def quota_exceeded_response(user_id):
+    """429 response with the quota and when it resets"""
+    now = datetime.utcnow()
+    reset = _start_of_day(now) + timedelta(days=1)
+    response = jsonify({
+        'error': 'Daily AI usage limit reached, try again tomorrow',
+        'quota': current_app.config['LLM_DAILY_TOKEN_QUOTA'],
+        'used': tokens_used_today(user_id),
+        'resets_at': reset.isoformat() + 'Z',
+    })
+    response.headers['Retry-After'] = str(int((reset - now).total_seconds()) + 1)
+    return response, 429
+
+
+def usage_report(days, group_by):
+    """Calls, tokens, latency and estimated cost over the last days, grouped by group_by columns"""
+    columns = {
+        'day': db.func.date(LLMUsage.created_at).label('day'),
+        'user': LLMUsage.user_id.label('user_id'),
+        'method': LLMUsage.method.label('method'),
+        'endpoint': LLMUsage.endpoint.label('endpoint'),
+    }
+    keys = [columns[name] for name in group_by]
+    prompt = db.func.coalesce(db.func.sum(LLMUsage.prompt_tokens), 0)
+    completion = db.func.coalesce(db.func.sum(LLMUsage.completion_tokens), 0)
+    aggregates = [
+        db.func.count(LLMUsage.id).label('calls'),
+        db.func.sum(db.case((LLMUsage.success.is_(False), 1), else_=0)).label('errors'),
+        prompt.label('prompt_tokens'),
+        completion.label('completion_tokens'),
+        db.func.avg(LLMUsage.latency_ms).label('avg_latency_ms'),
+        db.func.max(LLMUsage.latency_ms).label('max_latency_ms'),
+    ]
+
+    since = _start_of_day() - timedelta(days=days - 1)
+    query = db.session.query(*keys, *aggregates).filter(LLMUsage.created_at >= since)
+    if keys:
+        query = query.group_by(*keys).order_by(*keys)
+    rows = [row._asdict() for row in query]
+
+    emails = {}
+    if 'user' in group_by:
+        user_ids = {row['user_id'] for row in rows if row['user_id'] is not None}
+        if user_ids:
+            emails = dict(db.session.query(User.id, User.email).filter(User.id.in_(user_ids)))
+
+    config = current_app.config
+    prompt_price = config['LLM_PROMPT_PRICE_PER_MILLION'] / 1_000_000
+    completion_price = config['LLM_COMPLETION_PRICE_PER_MILLION'] / 1_000_000
+    totals = {'calls': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'estimated_cost_usd': 0.0}
+    for row in rows:
+        row['errors'] = int(row['errors'] or 0)
+        row['prompt_tokens'] = int(row['prompt_tokens'])
+        row['completion_tokens'] = int(row['completion_tokens'])
+        row['total_tokens'] = row['prompt_tokens'] + row['completion_tokens']
+        row['avg_latency_ms'] = round(float(row['avg_latency_ms'] or 0), 2)
+        row['estimated_cost_usd'] = round(
+            row['prompt_tokens'] * prompt_price + row['completion_tokens'] * completion_price, 6
+        )
+        if 'day' in row and row['day'] is not None:
+            row['day'] = str(row['day'])
+        if 'user_id' in row:
+            row['email'] = emails.get(row['user_id'])
+        for key in totals:
+            totals[key] += row[key]
+    totals['estimated_cost_usd'] = round(totals['estimated_cost_usd'], 6)
+
+    return {
+        'since': since.date().isoformat(),
+        'group_by': list(group_by),
+        'rows': rows,
+        'totals': totals,
+    }
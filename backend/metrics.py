@@ -0,0 +1,276 @@
+"""
+In-process metrics in the Prometheus text format (GET /metrics).
+
+Counters, gauges and histograms live in this module's REGISTRY and are
+updated in place under a per-metric lock, so recording costs a dict
+lookup and an addition; nothing is sent anywhere until Prometheus
+scrapes the endpoint. Gauges whose value is only known at scrape time
+(connection pools, cache sizes) take a callback instead.
+
+init_metrics() records request latency per route, requests in flight and
+SQL per request (from instrumentation.py). Groq calls are reported by
+GroqService through record_llm_call(), and the response cache counts
+its hits and misses. Each worker process keeps its own numbers, so
+scrape every worker (Prometheus sums them with sum by (...)).
+"""
+
+import bisect
+import threading
+import time
+
+from flask import current_app, g, request
+
+from instrumentation import current_query_stats
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type_ = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, label values, extra label, value) tuples"""
+        with self.lock:
+            return [('', key, None, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_number(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_ = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is None:
+            return super().samples()
+        # callback returns {label values tuple: value}
+        return [('', key, None, value) for key, value in self.callback().items()]
+
+
+class Histogram(Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # per-bucket counts (last = above every bucket), sum
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self.lock:
+            states = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        samples = []
+        for key, counts, total in states:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', key, f'le="{_format_number(float(bound))}"', cumulative))
+            samples.append(('_sum', key, None, total))
+            samples.append(('_count', key, None, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        # Re-registering a name (another app instance) replaces the old metric
+        self.metrics = [existing for existing in self.metrics if existing.name != metric.name]
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+PROCESS_START = REGISTRY.gauge('globetrotter_process_start_time_seconds', 'Start time of the process (Unix time)')
+PROCESS_START.set(time.time())
+
+HTTP_IN_FLIGHT = REGISTRY.gauge('globetrotter_http_requests_in_flight', 'Requests being handled')
+HTTP_LATENCY = REGISTRY.histogram(
+    'globetrotter_http_request_duration_seconds', 'Time to produce a response, by route',
+    ('method', 'route', 'status')
+)
+HTTP_DB_QUERIES = REGISTRY.histogram(
+    'globetrotter_http_request_db_queries', 'SQL statements executed per request, by route',
+    ('route',), buckets=QUERY_COUNT_BUCKETS
+)
+HTTP_DB_SECONDS = REGISTRY.counter(
+    'globetrotter_http_request_db_seconds_total', 'Time spent in SQL statements, by route', ('route',)
+)
+
+LLM_LATENCY = REGISTRY.histogram(
+    'globetrotter_llm_request_duration_seconds', 'Groq API call latency, by GroqService method',
+    ('method',), buckets=LLM_LATENCY_BUCKETS
+)
+LLM_TOKENS = REGISTRY.counter(
+    'globetrotter_llm_tokens_total', 'Tokens used by Groq API calls, by method and kind (prompt, completion)',
+    ('method', 'kind')
+)
+LLM_ERRORS = REGISTRY.counter('globetrotter_llm_errors_total', 'Failed Groq API calls, by method', ('method',))
+
+CACHE_REQUESTS = REGISTRY.counter(
+    'globetrotter_cache_requests_total', 'Response cache lookups, by cache and result (hit, miss)',
+    ('cache', 'result')
+)
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def record_llm_call(method, seconds, usage=None, error=None):
+    """GroqService listener: latency, token usage and failures per method"""
+    LLM_LATENCY.observe(seconds, method=method)
+    if error is not None:
+        LLM_ERRORS.inc(method=method)
+    if usage is not None:
+        LLM_TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0, method=method, kind='prompt')
+        LLM_TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0, method=method, kind='completion')
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _pool_state(engines):
+    def collect():
+        values = {}
+        for name, engine in engines().items():
+            pool = engine.pool
+            for state, method in (('size', 'size'), ('checked_out', 'checkedout'), ('checked_in', 'checkedin')):
+                reader = getattr(pool, method, None)
+                if reader is not None:
+                    values[(name, state)] = reader()
+            if hasattr(pool, 'overflow'):
+                # QueuePool counts up from -size; only connections beyond the pool size matter
+                values[(name, 'overflow')] = max(pool.overflow(), 0)
+        return values
+    return collect
+
+
+def init_metrics(app, engines, cache_entries=None):
+    """Record request metrics for app; engines() returns {label: engine} for the pool gauges"""
+    REGISTRY.gauge(
+        'globetrotter_db_pool_connections', 'Connection pool state per engine (size, checked_out, checked_in, overflow)',
+        ('engine', 'state'), callback=_pool_state(engines)
+    )
+    if cache_entries is not None:
+        REGISTRY.gauge(
+            'globetrotter_cache_entries', 'Entries in the response cache',
+            callback=lambda: {(): cache_entries()}
+        )
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            route = _route()
+            HTTP_LATENCY.observe(
+                time.perf_counter() - started, method=request.method, route=route, status=response.status_code
+            )
+            stats = current_query_stats()
+            if stats is not None:
+                HTTP_DB_QUERIES.observe(stats.count, route=route)
+                HTTP_DB_SECONDS.inc(stats.seconds, route=route)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop('metrics_started', None) is not None:
+            HTTP_IN_FLIGHT.dec()
+
+
+def metrics_authorized():
+    token = current_app.config['METRICS_TOKEN']
+    return not token or request.headers.get('Authorization') == f'Bearer {token}'
+
+
+def render_metrics():
+    return REGISTRY.render()
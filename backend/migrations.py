@@ -0,0 +1,304 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once and is recorded in the schema_migrations table.
+On startup only the recorded version is read; the schema itself is not
+introspected unless a migration is pending.
+
+To add a migration, append a (version, description, function) entry to
+MIGRATIONS. Functions receive an open connection and must be idempotent,
+since a database created by db.create_all() already has the current
+model schema.
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+_current_version = {}
+
+
+def _is_postgres(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def _add_ai_itinerary_column(conn):
+    columns = {col['name'] for col in inspect(conn).get_columns('trips')}
+    # Databases created from the current models never had the legacy column
+    if 'ai_itinerary' not in columns and 'ai_itinerary_meta' not in columns:
+        column_type = 'JSONB' if _is_postgres(conn) else 'TEXT'
+        conn.execute(text(f"ALTER TABLE trips ADD COLUMN ai_itinerary {column_type}"))
+
+
+def _create_lookup_indexes(conn):
+    # trips.share_code already has the index created by its UNIQUE constraint
+    statements = [
+        "CREATE INDEX IF NOT EXISTS idx_trips_user_id ON trips(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_stops_trip_order ON stops(trip_id, order_index)",
+        "CREATE INDEX IF NOT EXISTS idx_activities_city_category_cost ON activities(city_id, category, estimated_cost)",
+        "CREATE INDEX IF NOT EXISTS idx_activities_category_cost ON activities(category, estimated_cost)",
+        "CREATE INDEX IF NOT EXISTS idx_itinerary_activities_stop_id ON itinerary_activities(stop_id)",
+        "CREATE INDEX IF NOT EXISTS idx_itinerary_activities_activity_id ON itinerary_activities(activity_id)",
+        "CREATE INDEX IF NOT EXISTS idx_budgets_trip_id ON budgets(trip_id)",
+        "CREATE INDEX IF NOT EXISTS idx_saved_destinations_user_id ON saved_destinations(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_cities_popularity ON cities(popularity_score)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def _postgres_search_and_jsonb(conn):
+    """Trigram indexes for ILIKE search and JSONB itineraries (PostgreSQL only)"""
+    if not _is_postgres(conn):
+        return
+
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    trigram_indexes = [
+        ('idx_cities_name_trgm', 'cities', 'name'),
+        ('idx_cities_country_trgm', 'cities', 'country'),
+        ('idx_cities_region_trgm', 'cities', 'region'),
+        ('idx_activities_name_trgm', 'activities', 'name'),
+        ('idx_activities_description_trgm', 'activities', 'description'),
+    ]
+    for index_name, table, column in trigram_indexes:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING gin ({column} gin_trgm_ops)"
+        ))
+
+    columns = {col['name']: col for col in inspect(conn).get_columns('trips')}
+    if 'ai_itinerary' in columns and not isinstance(columns['ai_itinerary']['type'], JSONB):
+        conn.execute(text(
+            "ALTER TABLE trips ALTER COLUMN ai_itinerary TYPE JSONB USING ai_itinerary::jsonb"
+        ))
+
+
+def _split_ai_itineraries(conn):
+    """Move trips.ai_itinerary blobs into itinerary_days rows and summary columns"""
+    # Core statements only: later migrations add model columns this schema lacks yet
+    from models import ItineraryDay, Trip, split_ai_itinerary
+
+    columns = {col['name'] for col in inspect(conn).get_columns('trips')}
+    json_type = 'JSONB' if _is_postgres(conn) else 'TEXT'
+    for name, column_type in [('ai_itinerary_meta', json_type), ('ai_day_count', 'INTEGER'), ('ai_total_cost', 'FLOAT')]:
+        if name not in columns:
+            conn.execute(text(f"ALTER TABLE trips ADD COLUMN {name} {column_type}"))
+    ItineraryDay.__table__.create(conn, checkfirst=True)
+
+    if 'ai_itinerary' not in columns:
+        return
+
+    rows = conn.execute(text(
+        "SELECT id, CAST(ai_itinerary AS TEXT) FROM trips WHERE ai_itinerary IS NOT NULL"
+    )).fetchall()
+    trips = Trip.__table__
+    days_table = ItineraryDay.__table__
+    for trip_id, raw in rows:
+        try:
+            document = json.loads(raw)
+        except ValueError:
+            document = None
+        if not isinstance(document, dict):
+            document = {'raw_text': raw}
+
+        meta, day_rows, total = split_ai_itinerary(document)
+        conn.execute(days_table.delete().where(days_table.c.trip_id == trip_id))
+        if day_rows:
+            conn.execute(days_table.insert(), [{
+                'trip_id': trip_id,
+                'day_number': row.day_number,
+                'title': row.title,
+                'activity_count': row.activity_count,
+                'accommodation_cost': row.accommodation_cost,
+                'day_cost': row.day_cost,
+                'payload': row.payload,
+            } for row in day_rows])
+        conn.execute(trips.update().where(trips.c.id == trip_id).values(
+            ai_itinerary_meta=meta, ai_day_count=len(day_rows), ai_total_cost=total
+        ))
+
+    # The legacy column is kept (for rollback) but no longer read or written
+    conn.execute(text("UPDATE trips SET ai_itinerary = NULL WHERE ai_itinerary IS NOT NULL"))
+
+
+def _add_stop_sort_keys(conn):
+    """Order stops by fractional sort keys instead of dense order_index values"""
+    from ordering import spread_keys
+
+    columns = {col['name'] for col in inspect(conn).get_columns('stops')}
+    if 'sort_key' not in columns:
+        # Keys must sort in byte order (see _sort_keys_byte_order)
+        collation = ' COLLATE "C"' if _is_postgres(conn) else ''
+        conn.execute(text(f"ALTER TABLE stops ADD COLUMN sort_key VARCHAR(64){collation}"))
+
+    rows = conn.execute(text(
+        "SELECT id, trip_id FROM stops WHERE sort_key IS NULL ORDER BY trip_id, order_index, id"
+    )).fetchall()
+    by_trip = {}
+    for stop_id, trip_id in rows:
+        by_trip.setdefault(trip_id, []).append(stop_id)
+    for stop_ids in by_trip.values():
+        for position, (stop_id, key) in enumerate(zip(stop_ids, spread_keys(len(stop_ids))), start=1):
+            conn.execute(
+                text("UPDATE stops SET sort_key = :key, order_index = :position WHERE id = :id"),
+                {'key': key, 'position': position, 'id': stop_id}
+            )
+
+    conn.execute(text("DROP INDEX IF EXISTS idx_stops_trip_order"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_stops_trip_sort_key ON stops(trip_id, sort_key)"))
+
+
+def _add_version_columns(conn):
+    """Version counters for optimistic concurrency on trips, stops and budgets"""
+    for table in ('trips', 'stops', 'budgets'):
+        columns = {col['name'] for col in inspect(conn).get_columns(table)}
+        if 'version' not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+def _add_change_log(conn):
+    """Per-user sync sequence and the change_log table for GET /api/sync"""
+    from models import ChangeLog
+
+    columns = {col['name'] for col in inspect(conn).get_columns('users')}
+    if 'sync_seq' not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN sync_seq INTEGER NOT NULL DEFAULT 0"))
+    ChangeLog.__table__.create(conn, checkfirst=True)
+
+
+def _add_llm_usage(conn):
+    """llm_usage table for Groq token accounting and quotas"""
+    from models import LLMUsage
+
+    LLMUsage.__table__.create(conn, checkfirst=True)
+
+
+def _create_catalogue_key_indexes(conn):
+    """Indexes on the keys catalogue imports match cities and activities by"""
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_cities_country_name ON cities(country, name)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_activities_city_name ON activities(city_id, name)"))
+
+
+def _add_activity_name_keys(conn):
+    """Unique normalized activity names per city; duplicates are merged into the oldest row"""
+    from models import normalize_activity_name
+
+    columns = {col['name'] for col in inspect(conn).get_columns('activities')}
+    if 'name_key' not in columns:
+        conn.execute(text("ALTER TABLE activities ADD COLUMN name_key VARCHAR(200)"))
+
+    kept = {}  # (city_id, name_key) -> id of the row that stays
+    merged = []
+    keys = []
+    for activity_id, city_id, name, name_key in conn.execute(text(
+        "SELECT id, city_id, name, name_key FROM activities ORDER BY id"
+    )):
+        key = name_key or normalize_activity_name(name)
+        if (city_id, key) in kept:
+            merged.append({'keep': kept[(city_id, key)], 'id': activity_id})
+            continue
+        kept[(city_id, key)] = activity_id
+        if name_key is None:
+            keys.append({'key': key, 'id': activity_id})
+
+    if merged:
+        conn.execute(text("UPDATE itinerary_activities SET activity_id = :keep WHERE activity_id = :id"), merged)
+        conn.execute(text("DELETE FROM activities WHERE id = :id"), merged)
+    if keys:
+        conn.execute(text("UPDATE activities SET name_key = :key WHERE id = :id"), keys)
+    if _is_postgres(conn):
+        conn.execute(text("ALTER TABLE activities ALTER COLUMN name_key SET NOT NULL"))
+
+    # The unique index also serves the catalogue's (city, name) lookups
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_activities_city_name_key ON activities(city_id, name_key)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS idx_activities_city_name"))
+
+
+def _sort_keys_byte_order(conn):
+    """Compare stop sort keys by byte order on PostgreSQL
+
+    ordering.py relies on ASCII order ('V' < 'k'); locale collations such as
+    en_US compare letters case-insensitively first and misorder the stops.
+    SQLite already compares bytes. Changing the collation rebuilds
+    idx_stops_trip_sort_key.
+    """
+    if _is_postgres(conn):
+        conn.execute(text('ALTER TABLE stops ALTER COLUMN sort_key TYPE VARCHAR(64) COLLATE "C"'))
+
+
+MIGRATIONS = [
+    (1, 'Add trips.ai_itinerary', _add_ai_itinerary_column),
+    (2, 'Create foreign-key and lookup indexes', _create_lookup_indexes),
+    (3, 'PostgreSQL trigram search indexes and JSONB itineraries', _postgres_search_and_jsonb),
+    (4, 'Store AI itineraries as per-day rows with summary columns', _split_ai_itineraries),
+    (5, 'Fractional sort keys for stops', _add_stop_sort_keys),
+    (6, 'Version columns on trips, stops and budgets', _add_version_columns),
+    (7, 'Change log for incremental sync', _add_change_log),
+    (8, 'LLM usage accounting', _add_llm_usage),
+    (9, 'Catalogue key indexes on cities and activities', _create_catalogue_key_indexes),
+    (10, 'Unique normalized activity names per city', _add_activity_name_keys),
+    (11, 'Byte-order collation for stop sort keys', _sort_keys_byte_order),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def get_schema_version(engine):
+    """Return the highest applied migration version (0 if none)"""
+    with engine.connect() as conn:
+        try:
+            version = conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar()
+        except Exception:
+            conn.rollback()
+            return 0
+    return version or 0
+
+
+def run_migrations(engine, verbose=False):
+    """Apply pending migrations; returns the list of versions applied"""
+    key = str(engine.url)
+    if _current_version.get(key) == LATEST_VERSION:
+        return []
+
+    current = get_schema_version(engine)
+    applied = []
+
+    if current < LATEST_VERSION:
+        with engine.connect() as conn:
+            # Tables are created by db.create_all(); nothing to migrate yet
+            if not inspect(conn).has_table('trips'):
+                return []
+
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            with engine.begin() as conn:
+                _ensure_version_table(conn)
+                already = conn.execute(
+                    text("SELECT 1 FROM schema_migrations WHERE version = :v"), {'v': version}
+                ).first()
+                if already:
+                    continue
+                migrate(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {'v': version, 'd': description, 't': datetime.utcnow()}
+                )
+            applied.append(version)
+            if verbose:
+                print(f"Applied migration {version}: {description}")
+
+    _current_version[key] = LATEST_VERSION
+    return applied
@@ -2,9 +2,37 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import object_session, validates
+from sqlalchemy.types import TypeDecorator
 import json
 
-db = SQLAlchemy()
+from database import RoutingSession
+from fieldsets import ALL_FIELDS
+from serialization import RawJSON, splice_json_array
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+class JSONText(TypeDecorator):
+    """JSON document exposed as a JSON string; stored as JSONB on PostgreSQL, TEXT elsewhere"""
+    impl = db.Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB(none_as_null=True))
+        return dialect.type_descriptor(db.Text())
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name == 'postgresql' and isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if dialect.name == 'postgresql' and value is not None and not isinstance(value, str):
+            return json.dumps(value)
+        return value
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -17,6 +45,8 @@ class User(UserMixin, db.Model):
     language_preference = db.Column(db.String(10), default='en')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Last change log sequence number; maintained by sync.py with SQL, not through the ORM
+    sync_seq = db.Column(db.Integer, nullable=False, default=0)
     
     # Relationships
     trips = db.relationship('Trip', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -41,6 +71,10 @@ class User(UserMixin, db.Model):
 
 class City(db.Model):
     __tablename__ = 'cities'
+    __table_args__ = (
+        db.Index('idx_cities_popularity', 'popularity_score'),
+        db.Index('idx_cities_country_name', 'country', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -57,27 +91,31 @@ class City(db.Model):
     activities = db.relationship('Activity', backref='city', lazy=True)
     stops = db.relationship('Stop', backref='city', lazy=True)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'country': self.country,
-            'region': self.region,
-            'description': self.description,
-            'cost_index': self.cost_index,
-            'popularity_score': self.popularity_score,
-            'latitude': self.latitude,
-            'longitude': self.longitude,
-            'image_url': self.image_url
-        }
+    def to_dict(self, fieldset=ALL_FIELDS):
+        return fieldset.columns('city', self, (
+            'id', 'name', 'country', 'region', 'description', 'cost_index',
+            'popularity_score', 'latitude', 'longitude', 'image_url'
+        ))
+
+
+def normalize_activity_name(name):
+    """Activity name compared case-insensitively, with runs of whitespace collapsed"""
+    return ' '.join(str(name).split()).lower()
 
 
 class Activity(db.Model):
     __tablename__ = 'activities'
+    __table_args__ = (
+        db.Index('idx_activities_city_category_cost', 'city_id', 'category', 'estimated_cost'),
+        db.Index('idx_activities_category_cost', 'category', 'estimated_cost'),
+        db.UniqueConstraint('city_id', 'name_key', name='uq_activities_city_name_key'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), nullable=False)
     name = db.Column(db.String(200), nullable=False)
+    # normalize_activity_name(name): one activity per name and city, whatever its case or spacing
+    name_key = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     category = db.Column(db.String(50))  # sightseeing, food, adventure, culture, shopping
     estimated_cost = db.Column(db.Float, default=0.0)
@@ -87,21 +125,23 @@ class Activity(db.Model):
     # Relationships
     itinerary_activities = db.relationship('ItineraryActivity', backref='activity', lazy=True)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'city_id': self.city_id,
-            'name': self.name,
-            'description': self.description,
-            'category': self.category,
-            'estimated_cost': self.estimated_cost,
-            'duration_hours': self.duration_hours,
-            'image_url': self.image_url
-        }
+    @validates('name')
+    def _set_name_key(self, key, name):
+        self.name_key = normalize_activity_name(name)
+        return name
+    
+    def to_dict(self, fieldset=ALL_FIELDS):
+        return fieldset.columns('activity', self, (
+            'id', 'city_id', 'name', 'description', 'category',
+            'estimated_cost', 'duration_hours', 'image_url'
+        ))
 
 
 class Trip(db.Model):
     __tablename__ = 'trips'
+    __table_args__ = (
+        db.Index('idx_trips_user_id', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -112,74 +152,228 @@ class Trip(db.Model):
     cover_photo_url = db.Column(db.String(255))
     is_public = db.Column(db.Boolean, default=False)
     share_code = db.Column(db.String(50), unique=True)
-    ai_itinerary = db.Column(db.Text)  # stored JSON from AI generator
+    # AI itinerary: days live in ItineraryDay rows; the rest of the document
+    # (budget_breakdown, tips, ...) plus summary columns stay on the trip
+    ai_itinerary_meta = db.Column(JSONText)
+    ai_day_count = db.Column(db.Integer)
+    ai_total_cost = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Incremented on every UPDATE; stale writes fail (see concurrency.py)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    
+    __mapper_args__ = {'version_id_col': version}
     
     # Relationships
-    stops = db.relationship('Stop', backref='trip', lazy=True, cascade='all, delete-orphan', order_by='Stop.order_index')
+    stops = db.relationship('Stop', backref='trip', lazy=True, cascade='all, delete-orphan', order_by='Stop.sort_key, Stop.id')
     budget = db.relationship('Budget', backref='trip', uselist=False, cascade='all, delete-orphan')
+    ai_days = db.relationship('ItineraryDay', backref='trip', lazy='dynamic', cascade='all, delete-orphan', order_by='ItineraryDay.day_number')
     
-    def to_dict(self, include_stops=False):
-        result = {
-            'id': self.id,
-            'user_id': self.user_id,
-            'name': self.name,
-            'description': self.description,
-            'start_date': self.start_date.isoformat() if self.start_date else None,
-            'end_date': self.end_date.isoformat() if self.end_date else None,
-            'cover_photo_url': self.cover_photo_url,
-            'is_public': self.is_public,
-            'share_code': self.share_code,
-            'ai_itinerary': json.loads(self.ai_itinerary) if self.ai_itinerary else None,
-            'stops_count': len(self.stops) if self.stops is not None else 0,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'total_days': (self.end_date - self.start_date).days + 1 if self.start_date and self.end_date else 0
-        }
+    def set_ai_itinerary(self, itinerary):
+        """Replace the stored AI itinerary with a generated document"""
+        session = object_session(self)
+        if session is not None and self.id is not None:
+            session.query(ItineraryDay).filter_by(trip_id=self.id).delete(synchronize_session=False)
+        
+        meta, day_rows, total = split_ai_itinerary(itinerary)
+        for row in day_rows:
+            self.ai_days.append(row)
+        
+        self.ai_itinerary_meta = meta
+        self.ai_day_count = len(day_rows)
+        self.ai_total_cost = total
+    
+    def ai_itinerary_to_dict(self, day_numbers=None):
+        """Rebuild the AI itinerary document, optionally limited to some days"""
+        if self.ai_itinerary_meta is None:
+            return None
+        
+        result = json.loads(self.ai_itinerary_meta)
+        days_query = self.ai_days
+        if day_numbers is not None:
+            days_query = days_query.filter(ItineraryDay.day_number.in_(day_numbers))
+        days = [day.to_dict() for day in days_query]
+        if days or self.ai_day_count:
+            result['days'] = days
+        return result
+    
+    def ai_itinerary_raw(self, day_numbers=None):
+        """The AI itinerary as encoded JSON, assembled from stored text without parsing"""
+        if self.ai_itinerary_meta is None:
+            return None
+        
+        payloads = db.session.query(ItineraryDay.payload).filter(ItineraryDay.trip_id == self.id)
+        if day_numbers is not None:
+            payloads = payloads.filter(ItineraryDay.day_number.in_(day_numbers))
+        payloads = [payload for (payload,) in payloads.order_by(ItineraryDay.day_number)]
+        
+        if not payloads and not self.ai_day_count:
+            return RawJSON(self.ai_itinerary_meta)
+        return RawJSON(splice_json_array(self.ai_itinerary_meta, 'days', payloads))
+    
+    def to_dict(self, include_stops=False, itinerary_days=None, fieldset=ALL_FIELDS):
+        result = fieldset.columns('trip', self, (
+            'id', 'user_id', 'name', 'description', 'start_date', 'end_date',
+            'cover_photo_url', 'is_public', 'share_code', 'ai_day_count', 'ai_total_cost',
+            'version', 'created_at', 'updated_at'
+        ))
+        if fieldset.wants('trip', 'total_days'):
+            result['total_days'] = (self.end_date - self.start_date).days + 1 if self.start_date and self.end_date else 0
+        
+        # Loads every stop, so only computed when requested
+        if fieldset.wants('trip', 'stops_count'):
+            result['stops_count'] = len(self.stops) if self.stops is not None else 0
         
-        if include_stops:
-            result['stops'] = [stop.to_dict(include_activities=True) for stop in self.stops]
-            result['budget'] = self.budget.to_dict() if self.budget else None
+        if fieldset.includes('stops', include_stops):
+            result['stops'] = [
+                stop.to_dict(include_activities=True, fieldset=fieldset, order_index=position)
+                for position, stop in enumerate(self.stops, start=1)
+            ]
+        if fieldset.includes('budget', include_stops):
+            result['budget'] = self.budget.to_dict(fieldset=fieldset) if self.budget else None
+        if fieldset.includes('ai_itinerary', include_stops):
+            result['ai_itinerary'] = self.ai_itinerary_raw(itinerary_days)
         
         return result
 
 
+class ItineraryDay(db.Model):
+    """One day of a trip's AI-generated itinerary"""
+    __tablename__ = 'itinerary_days'
+    __table_args__ = (
+        db.UniqueConstraint('trip_id', 'day_number', name='uq_itinerary_days_trip_day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trips.id'), nullable=False)
+    day_number = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(200))
+    activity_count = db.Column(db.Integer, default=0)
+    accommodation_cost = db.Column(db.Float, default=0.0)
+    day_cost = db.Column(db.Float, default=0.0)  # activities + meals + accommodation
+    payload = db.Column(JSONText, nullable=False)  # the day's JSON as generated
+    
+    @classmethod
+    def from_dict(cls, day, day_number):
+        activities = day.get('activities') if isinstance(day.get('activities'), list) else []
+        meals = day.get('meals') if isinstance(day.get('meals'), list) else []
+        accommodation = day.get('accommodation') if isinstance(day.get('accommodation'), dict) else {}
+        
+        accommodation_cost = _as_number(accommodation.get('cost')) or 0.0
+        day_cost = accommodation_cost
+        for item in activities + meals:
+            if isinstance(item, dict):
+                day_cost += _as_number(item.get('cost')) or 0.0
+        
+        title = day.get('title')
+        return cls(
+            day_number=day_number,
+            title=str(title)[:200] if title is not None else None,
+            activity_count=len(activities),
+            accommodation_cost=accommodation_cost,
+            day_cost=day_cost,
+            payload=json.dumps(day, separators=(',', ':'))
+        )
+    
+    def to_dict(self):
+        return json.loads(self.payload)
+
+
+def split_ai_itinerary(itinerary):
+    """Split an itinerary document into (meta JSON text, ItineraryDay rows, total cost)"""
+    itinerary = dict(itinerary or {})
+    days = itinerary.pop('days', None) or []
+    day_rows = []
+    used_numbers = set()
+    for day in days:
+        if not isinstance(day, dict):
+            continue
+        day_number = day.get('day')
+        if not isinstance(day_number, int) or day_number in used_numbers:
+            day_number = max(used_numbers, default=0) + 1
+        used_numbers.add(day_number)
+        day_rows.append(ItineraryDay.from_dict(day, day_number))
+    
+    breakdown = itinerary.get('budget_breakdown')
+    total = _as_number(breakdown.get('total')) if isinstance(breakdown, dict) else None
+    if total is None and day_rows:
+        total = sum(row.day_cost for row in day_rows)
+    
+    return json.dumps(itinerary, separators=(',', ':')), day_rows, total
+
+
+def _as_number(value):
+    """Coerce an AI-provided cost (number or numeric string) to float"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.replace(',', '').replace('₹', '').strip())
+        except ValueError:
+            return None
+    return None
+
+
 class Stop(db.Model):
     __tablename__ = 'stops'
+    __table_args__ = (
+        db.Index('idx_stops_trip_sort_key', 'trip_id', 'sort_key'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     trip_id = db.Column(db.Integer, db.ForeignKey('trips.id'), nullable=False)
     city_id = db.Column(db.Integer, db.ForeignKey('cities.id'), nullable=False)
+    # Stops are ordered by sort_key (see ordering.py). order_index is the
+    # position as of the last rebalance; API responses report live positions.
+    # Keys compare by byte order: the "C" collation on PostgreSQL, whose
+    # locale collations would sort 'k' before 'V' (SQLite compares bytes).
+    sort_key = db.Column(db.String(64).with_variant(db.String(64, collation='C'), 'postgresql'), nullable=False)
     order_index = db.Column(db.Integer, nullable=False)
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     notes = db.Column(db.Text)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    
+    __mapper_args__ = {'version_id_col': version}
     
     # Relationships
     itinerary_activities = db.relationship('ItineraryActivity', backref='stop', lazy=True, cascade='all, delete-orphan', order_by='ItineraryActivity.day_number, ItineraryActivity.time_of_day')
     
-    def to_dict(self, include_activities=False):
-        result = {
-            'id': self.id,
-            'trip_id': self.trip_id,
-            'city_id': self.city_id,
-            'city': self.city.to_dict() if self.city else None,
-            'order_index': self.order_index,
-            'start_date': self.start_date.isoformat() if self.start_date else None,
-            'end_date': self.end_date.isoformat() if self.end_date else None,
-            'notes': self.notes,
-            'duration_days': (self.end_date - self.start_date).days + 1 if self.start_date and self.end_date else 0
-        }
+    def position(self):
+        """1-based position of the stop within its trip"""
+        earlier = Stop.query.filter(
+            Stop.trip_id == self.trip_id,
+            db.or_(Stop.sort_key < self.sort_key, db.and_(Stop.sort_key == self.sort_key, Stop.id < self.id))
+        ).count()
+        return earlier + 1
+    
+    def to_dict(self, include_activities=False, fieldset=ALL_FIELDS, order_index=None):
+        result = fieldset.columns('stop', self, (
+            'id', 'trip_id', 'city_id', 'start_date', 'end_date', 'notes', 'version'
+        ))
+        if fieldset.wants('stop', 'duration_days'):
+            result['duration_days'] = (self.end_date - self.start_date).days + 1 if self.start_date and self.end_date else 0
+        
+        if fieldset.wants('stop', 'order_index'):
+            result['order_index'] = order_index if order_index is not None else self.position()
         
-        if include_activities:
-            result['activities'] = [activity.to_dict() for activity in self.itinerary_activities]
+        if fieldset.wants('stop', 'city'):
+            result['city'] = self.city.to_dict(fieldset=fieldset) if self.city else None
+        
+        if fieldset.includes('activities', include_activities):
+            result['activities'] = [activity.to_dict(fieldset=fieldset) for activity in self.itinerary_activities]
         
         return result
 
 
 class ItineraryActivity(db.Model):
     __tablename__ = 'itinerary_activities'
+    __table_args__ = (
+        db.Index('idx_itinerary_activities_stop_id', 'stop_id'),
+        db.Index('idx_itinerary_activities_activity_id', 'activity_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     stop_id = db.Column(db.Integer, db.ForeignKey('stops.id'), nullable=False)
@@ -189,21 +383,24 @@ class ItineraryActivity(db.Model):
     custom_notes = db.Column(db.Text)
     estimated_cost_override = db.Column(db.Float)  # Override activity's default cost
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'stop_id': self.stop_id,
-            'activity_id': self.activity_id,
-            'activity': self.activity.to_dict() if self.activity else None,
-            'day_number': self.day_number,
-            'time_of_day': self.time_of_day,
-            'custom_notes': self.custom_notes,
-            'estimated_cost': self.estimated_cost_override or (self.activity.estimated_cost if self.activity else 0)
-        }
+    def to_dict(self, fieldset=ALL_FIELDS):
+        result = fieldset.columns('itinerary_activity', self, (
+            'id', 'stop_id', 'activity_id', 'day_number', 'time_of_day', 'custom_notes'
+        ))
+        
+        if fieldset.wants('itinerary_activity', 'activity'):
+            result['activity'] = self.activity.to_dict(fieldset=fieldset) if self.activity else None
+        if fieldset.wants('itinerary_activity', 'estimated_cost'):
+            result['estimated_cost'] = self.estimated_cost_override or (self.activity.estimated_cost if self.activity else 0)
+        
+        return result
 
 
 class Budget(db.Model):
     __tablename__ = 'budgets'
+    __table_args__ = (
+        db.Index('idx_budgets_trip_id', 'trip_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     trip_id = db.Column(db.Integer, db.ForeignKey('trips.id'), nullable=False)
@@ -214,30 +411,52 @@ class Budget(db.Model):
     activities_cost = db.Column(db.Float, default=0.0)
     misc_cost = db.Column(db.Float, default=0.0)
     currency = db.Column(db.String(10), default='INR')
+    version = db.Column(db.Integer, nullable=False, default=1)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'trip_id': self.trip_id,
-            'total_budget': self.total_budget,
-            'transport_cost': self.transport_cost,
-            'accommodation_cost': self.accommodation_cost,
-            'food_cost': self.food_cost,
-            'activities_cost': self.activities_cost,
-            'misc_cost': self.misc_cost,
-            'currency': self.currency,
-            'breakdown': {
+    __mapper_args__ = {'version_id_col': version}
+    
+    COST_FIELDS = ('transport_cost', 'accommodation_cost', 'food_cost', 'activities_cost', 'misc_cost')
+    
+    @classmethod
+    def empty(cls, trip_id):
+        """Unsaved budget with every cost at zero"""
+        return cls(trip_id=trip_id, currency='INR', **{field: 0.0 for field in cls.COST_FIELDS})
+    
+    def recalculate(self, activities_cost):
+        """Set activities_cost and the total from the cost fields"""
+        self.activities_cost = float(activities_cost)
+        self.total_budget = sum(getattr(self, field) or 0.0 for field in self.COST_FIELDS)
+    
+    def to_dict(self, fieldset=ALL_FIELDS, activities_cost=None):
+        """activities_cost, when given, replaces the stored value (and the total) in the output"""
+        result = fieldset.columns('budget', self, (
+            'id', 'trip_id', 'total_budget', 'transport_cost', 'accommodation_cost',
+            'food_cost', 'activities_cost', 'misc_cost', 'currency', 'version'
+        ))
+        if activities_cost is not None:
+            activities = float(activities_cost)
+            if 'activities_cost' in result:
+                result['activities_cost'] = activities
+            if 'total_budget' in result:
+                result['total_budget'] = sum(
+                    getattr(self, field) or 0.0 for field in self.COST_FIELDS if field != 'activities_cost'
+                ) + activities
+        if fieldset.wants('budget', 'breakdown'):
+            result['breakdown'] = {
                 'transport': self.transport_cost,
                 'accommodation': self.accommodation_cost,
                 'food': self.food_cost,
-                'activities': self.activities_cost,
+                'activities': self.activities_cost if activities_cost is None else float(activities_cost),
                 'misc': self.misc_cost
             }
-        }
+        return result
 
 
 class SavedDestination(db.Model):
     __tablename__ = 'saved_destinations'
+    __table_args__ = (
+        db.Index('idx_saved_destinations_user_id', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -246,10 +465,50 @@ class SavedDestination(db.Model):
     
     city = db.relationship('City', backref='saved_by_users')
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'city': self.city.to_dict() if self.city else None,
-            'saved_at': self.saved_at.isoformat() if self.saved_at else None
-        }
+    def to_dict(self, fieldset=ALL_FIELDS):
+        result = fieldset.columns('saved_destination', self, ('id', 'user_id', 'saved_at'))
+        
+        if fieldset.wants('saved_destination', 'city'):
+            result['city'] = self.city.to_dict(fieldset=fieldset) if self.city else None
+        
+        return result
+
+
+class ChangeLog(db.Model):
+    """Latest change to one of a user's synced entities (see sync.py)"""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'entity_type', 'entity_id', name='uq_change_log_entity'),
+        db.Index('idx_change_log_user_seq', 'user_id', 'seq'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    entity_type = db.Column(db.String(40), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    trip_id = db.Column(db.Integer)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class LLMUsage(db.Model):
+    """One Groq API call and the tokens it used (see llm_usage.py)"""
+    __tablename__ = 'llm_usage'
+    __table_args__ = (
+        db.Index('idx_llm_usage_user_created', 'user_id', 'created_at'),
+        db.Index('idx_llm_usage_created', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Kept when the user or trip is deleted, so past usage still adds up
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
+    trip_id = db.Column(db.Integer)
+    endpoint = db.Column(db.String(100))
+    method = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(100))
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms = db.Column(db.Float)
+    success = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,118 @@
+"""
+Fractional ordering keys for trip stops.
+
+Stops are ordered by Stop.sort_key, a string that sorts lexicographically.
+Each key is read as a base-62 fraction (digits 0-9A-Za-z, which is also
+their ASCII order), so there is always room for another key between two
+neighbours: inserting or moving a stop writes only that stop's key.
+
+Repeated inserts at the same spot make keys longer. When a new key passes
+REBALANCE_KEY_LENGTH the trip is rebalanced in the background, which
+rewrites its keys evenly spaced; `flask rebalance-stops` does the same for
+every trip that needs it.
+"""
+
+import threading
+
+from flask import current_app
+
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+REBALANCE_KEY_LENGTH = 24  # Stop.sort_key holds 64 characters
+
+
+def key_between(lower, upper):
+    """Shortest key strictly between lower and upper (None = unbounded)"""
+    lower = lower or ''
+    key = ''
+    i = 0
+    while True:
+        low = DIGITS.index(lower[i]) if i < len(lower) else 0
+        if upper is None:
+            high = BASE
+        elif i < len(upper):
+            high = DIGITS.index(upper[i])
+        else:
+            raise ValueError(f'{lower!r} does not sort before {upper!r}')
+
+        if high - low > 1:
+            return key + DIGITS[(low + high) // 2]
+
+        key += DIGITS[low]
+        if high - low == 1:
+            # key now sorts before upper whatever follows
+            upper = None
+        i += 1
+
+
+def spread_keys(count):
+    """count evenly spaced keys, as short as possible"""
+    width = 1
+    while BASE ** width <= count:
+        width += 1
+    step = BASE ** width / (count + 1)
+
+    keys = []
+    for i in range(1, count + 1):
+        value = int(i * step)
+        digits = ''
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits = DIGITS[digit] + digits
+        # Trailing zeros don't change the fraction, and would break key_between
+        keys.append(digits.rstrip('0'))
+    return keys
+
+
+def key_for_position(keys, position):
+    """Key placing an item at 1-based position among the ordered keys"""
+    position = max(1, min(position, len(keys) + 1))
+    lower = keys[position - 2] if position > 1 else None
+    upper = keys[position - 1] if position <= len(keys) else None
+    return key_between(lower, upper)
+
+
+def trip_stop_keys(trip_id, exclude_id=None):
+    """Ordered sort keys of a trip's stops"""
+    from models import db, Stop
+
+    query = db.session.query(Stop.sort_key).filter(Stop.trip_id == trip_id)
+    if exclude_id is not None:
+        query = query.filter(Stop.id != exclude_id)
+    return [row[0] for row in query.order_by(Stop.sort_key, Stop.id)]
+
+
+def rebalance_trip_stops(trip_id):
+    """Rewrite a trip's stop keys evenly spaced (flushes, does not commit)"""
+    from models import db, Stop
+
+    stops = Stop.query.filter_by(trip_id=trip_id).order_by(Stop.sort_key, Stop.id).all()
+    for position, (stop, key) in enumerate(zip(stops, spread_keys(len(stops))), start=1):
+        stop.sort_key = key
+        stop.order_index = position
+    db.session.flush()
+    return len(stops)
+
+
+def needs_rebalance(key):
+    return key is not None and len(key) > REBALANCE_KEY_LENGTH
+
+
+def _rebalance_in_background(app, trip_id):
+    from models import db
+
+    with app.app_context():
+        try:
+            rebalance_trip_stops(trip_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f'Rebalancing stops of trip {trip_id} failed: {e}')
+
+
+def schedule_rebalance(trip_id):
+    """Rebalance a trip's stop keys on a background thread"""
+    app = current_app._get_current_object()
+    thread = threading.Thread(target=_rebalance_in_background, args=(app, trip_id), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,383 @@
+"""
+Minimal PDF writer for text documents (trip exports).
+
+Only what an itinerary needs: A4 pages of wrapped text, headings,
+indentation and horizontal rules, with no third-party package.
+
+Text is set in a TrueType font when one is given (see load_fonts): the
+glyphs a document uses are embedded as a subset with a ToUnicode map,
+so city names, AI descriptions and amounts in rupees print in any
+script the font covers, and copy out of the PDF as the same text.
+Glyphs are placed one after another, without the shaping complex
+scripts (Devanagari, Thai) use for conjuncts and vowel signs. Without
+a font file the standard Helvetica fonts are used; they are built into
+every viewer but cover WinAnsi (cp1252) only.
+
+Characters the font lacks are not printed as '?': those with a
+customary Latin spelling are transliterated (printable), accents the
+font has no precomposed letter for are dropped, and anything else is
+left out.
+
+    doc = PdfDocument(title='Paris Trip', fonts=load_fonts())
+    doc.heading('Paris Trip')
+    doc.paragraph('Five days in France.')
+    data = doc.render()
+"""
+
+import os
+import unicodedata
+import zlib
+from datetime import datetime
+
+from truetype import TrueTypeFont
+
+PAGE_WIDTH = 595  # A4, in points
+PAGE_HEIGHT = 842
+MARGIN = 56
+
+# Advance widths (1/1000 em) of characters 32-126
+_HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+DEFAULT_WIDTH = 556  # characters outside 32-126
+
+# Unicode fonts tried in order when no font file is configured: (regular, bold)
+FONT_CANDIDATES = (
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/dejavu/DejaVuSans.ttf', '/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/TTF/DejaVuSans.ttf', '/usr/share/fonts/TTF/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf', '/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf'),
+    ('/System/Library/Fonts/Supplemental/Arial Unicode.ttf', None),
+    ('/Library/Fonts/Arial Unicode.ttf', None),
+    ('C:\\Windows\\Fonts\\arial.ttf', 'C:\\Windows\\Fonts\\arialbd.ttf'),
+)
+
+# Characters without a compatibility decomposition but with a customary Latin spelling
+TRANSLITERATIONS = {
+    '\u20b9': 'Rs.',  # Indian rupee sign
+    '\u0141': 'L', '\u0142': 'l',  # Polish L with stroke
+    '\u0110': 'D', '\u0111': 'd',  # D with stroke
+    '\u0131': 'i',  # dotless i
+    '\u2212': '-',  # minus sign
+    '\u2010': '-',  # hyphen
+    '\u2011': '-',  # non-breaking hyphen
+    '\u2192': '->',
+    '\u2190': '<-',
+}
+
+
+def load_fonts(regular=None, bold=None):
+    """TrueType fonts for PdfDocument(fonts=...): {'regular': font, 'bold': font or None}
+
+    Without a regular font file, the first of FONT_CANDIDATES installed
+    is used; None when there is none (Helvetica then). Without a bold
+    font, bold text is drawn by stroking the regular glyphs.
+    """
+    if not regular:
+        for regular_path, bold_path in FONT_CANDIDATES:
+            if os.path.exists(regular_path):
+                regular = regular_path
+                if not bold and bold_path and os.path.exists(bold_path):
+                    bold = bold_path
+                break
+        else:
+            return None
+    return {'regular': TrueTypeFont(regular), 'bold': TrueTypeFont(bold) if bold else None}
+
+
+class StandardFont:
+    """A standard 14 font: built into every viewer, WinAnsi (cp1252) text only"""
+
+    def __init__(self, base, widths):
+        self.base = base
+        self.widths = widths
+
+    def covers(self, char):
+        try:
+            char.encode('cp1252')
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    def width(self, text):
+        """Advance width of text in 1/1000 em"""
+        return sum(self.widths[ord(char) - 32] if 32 <= ord(char) <= 126 else DEFAULT_WIDTH for char in text)
+
+    def encode(self, text):
+        data = text.encode('cp1252')
+        return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+    def write(self, add):
+        return add(b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % self.base.encode())
+
+
+class EmbeddedFont:
+    """A TrueType font embedded as a subset of the glyphs shown; text is written as glyph ids (Identity-H)"""
+
+    def __init__(self, font):
+        self.font = font
+        self.used = {}  # glyph id -> the character it shows
+
+    def covers(self, char):
+        return ord(char) in self.font.cmap
+
+    def width(self, text):
+        """Advance width of text in 1/1000 em"""
+        return sum(self.font.advance(self.font.cmap[ord(char)]) for char in text)
+
+    def encode(self, text):
+        glyphs = []
+        for char in text:
+            glyph = self.font.cmap[ord(char)]
+            self.used.setdefault(glyph, char)
+            glyphs.append(glyph)
+        return b'<' + ''.join(f'{glyph:04X}' for glyph in glyphs).encode() + b'>'
+
+    def write(self, add):
+        font = self.font
+        glyphs = sorted(self.used)
+        name = f'{_subset_tag(glyphs)}+{font.name}'.encode()
+        data = font.subset(glyphs)
+        font_file = add(_stream(data, b'/Length1 %d' % len(data)))
+        flags = 32 | (1 if font.fixed_pitch else 0) | (64 if font.italic_angle else 0)  # nonsymbolic
+        descriptor = add(
+            b'<< /Type /FontDescriptor /FontName /%s /Flags %d /FontBBox [%s] /ItalicAngle %g '
+            b'/Ascent %d /Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>' % (
+                name, flags, b' '.join(b'%d' % round(font.scaled(value)) for value in font.bbox),
+                font.italic_angle, round(font.scaled(font.ascent)), round(font.scaled(font.descent)),
+                round(font.scaled(font.cap_height)), font_file,
+            )
+        )
+        widths = b' '.join(b'%d [%d]' % (glyph, round(font.advance(glyph))) for glyph in glyphs)
+        descendant = add(
+            b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+            b'/FontDescriptor %d 0 R /W [%s] /CIDToGIDMap /Identity >>' % (name, descriptor, widths)
+        )
+        to_unicode = add(_stream(_to_unicode(self.used)))
+        return add(
+            b'<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H '
+            b'/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>' % (name, descendant, to_unicode)
+        )
+
+
+def _subset_tag(glyphs):
+    """Six capital letters naming a font subset, as the PDF specification asks"""
+    number = zlib.crc32(','.join(map(str, glyphs)).encode())
+    tag = ''
+    for _ in range(6):
+        number, letter = divmod(number, 26)
+        tag += chr(65 + letter)
+    return tag
+
+
+def _to_unicode(used):
+    """CMap from glyph ids back to the text they show, for search and copy"""
+    lines = [
+        b'/CIDInit /ProcSet findresource begin', b'12 dict begin', b'begincmap',
+        b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def',
+        b'/CMapName /Adobe-Identity-UCS def', b'/CMapType 2 def',
+        b'1 begincodespacerange', b'<0000> <FFFF>', b'endcodespacerange',
+    ]
+    entries = sorted(used.items())
+    for start in range(0, len(entries), 100):  # at most 100 entries per block
+        block = entries[start:start + 100]
+        lines.append(b'%d beginbfchar' % len(block))
+        lines += [b'<%04X> <%s>' % (glyph, char.encode('utf-16-be').hex().upper().encode()) for glyph, char in block]
+        lines.append(b'endbfchar')
+    lines += [b'endcmap', b'CMapName currentdict /CMap defineresource pop', b'end', b'end']
+    return b'\n'.join(lines)
+
+
+def _stream(data, entries=b''):
+    compressed = zlib.compress(data)
+    return b'<< /Length %d /Filter /FlateDecode %s>>\nstream\n%s\nendstream' % (
+        len(compressed), entries + b' ' if entries else b'', compressed
+    )
+
+
+def printable(text, font):
+    """text with the characters font lacks transliterated, stripped of accents or left out"""
+    kept = []
+    for char in text:
+        if font.covers(char):
+            kept.append(char)
+            continue
+        spelling = TRANSLITERATIONS.get(char) or unicodedata.normalize('NFKD', char)
+        kept += [part for part in spelling if font.covers(part) and not unicodedata.combining(part)]
+    return ''.join(kept)
+
+
+def text_width(text, size, font):
+    return font.width(text) * size / 1000
+
+
+def wrap(text, width, size, font):
+    """Lines of text no wider than width points (a single overlong word is split)"""
+    lines = []
+    for paragraph in str(text).splitlines() or ['']:
+        paragraph = printable(paragraph, font)
+        line = ''
+        for word in paragraph.split():
+            candidate = f'{line} {word}' if line else word
+            if text_width(candidate, size, font) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            while text_width(word, size, font) > width:
+                cut = len(word) - 1
+                while cut > 1 and text_width(word[:cut], size, font) > width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def _info_string(text):
+    """A document information string: ASCII as is, anything else as UTF-16"""
+    if str(text).isascii():
+        return b'(' + str(text).encode().replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+    return b'<FEFF' + str(text).encode('utf-16-be').hex().upper().encode() + b'>'
+
+
+class PdfDocument:
+    """Flows text onto A4 pages, top to bottom, starting a new page when one is full"""
+
+    def __init__(self, title=None, author=None, fonts=None):
+        self.title = title
+        self.author = author
+        if fonts:
+            regular = EmbeddedFont(fonts['regular'])
+            bold = EmbeddedFont(fonts['bold']) if fonts.get('bold') else regular
+        else:
+            regular = StandardFont('Helvetica', _HELVETICA_WIDTHS)
+            bold = StandardFont('Helvetica-Bold', _HELVETICA_BOLD_WIDTHS)
+        self.fonts = {'regular': regular, 'bold': bold}
+        # Without a bold face, bold text strokes the regular glyphs' outlines
+        self.stroke_bold = bold is regular
+        self.pages = []
+        self.y = 0
+        self._new_page()
+
+    def _new_page(self):
+        self.pages.append([])
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def _ensure(self, height):
+        if self.y - height < MARGIN:
+            self._new_page()
+
+    def _line(self, text, size, font, indent):
+        leading = size * 1.3
+        self._ensure(leading)
+        self.y -= leading
+        style = b''
+        if font == 'bold' and self.stroke_bold:
+            style = b' 2 Tr %g w' % (size * 0.05)
+        self.pages[-1].append(b'q BT /%s %g Tf%s %g %g Td %s Tj ET Q' % (
+            self._resource(font), size, style, MARGIN + indent, self.y, self.fonts[font].encode(text)
+        ))
+
+    def _resource(self, font):
+        return b'F2' if font == 'bold' and not self.stroke_bold else b'F1'
+
+    def text(self, text, size=10, font='regular', indent=0):
+        """Wrapped text; each line of text starts a new line"""
+        for line in wrap(text, PAGE_WIDTH - 2 * MARGIN - indent, size, self.fonts[font]):
+            self._line(line, size, font, indent)
+
+    def heading(self, text, size=16):
+        # Keep a heading on the same page as the first lines under it
+        self._ensure(size * 1.3 + 40)
+        self.space(size * 0.4)
+        self.text(text, size=size, font='bold')
+        self.space(size * 0.2)
+
+    def paragraph(self, text, size=10, indent=0):
+        self.text(text, size=size, indent=indent)
+        self.space(size * 0.5)
+
+    def space(self, points):
+        if self.y - points < MARGIN:
+            self._new_page()
+        else:
+            self.y -= points
+
+    def rule(self):
+        self._ensure(8)
+        self.y -= 4
+        self.pages[-1].append(b'0.7 G 0.5 w %g %g m %g %g l S 0 G' % (MARGIN, self.y, PAGE_WIDTH - MARGIN, self.y))
+        self.y -= 4
+
+    def render(self):
+        """The document as PDF bytes"""
+        objects = []  # object number - 1 -> bytes
+
+        def add(data):
+            objects.append(data)
+            return len(objects)
+
+        catalog = add(None)
+        pages = add(None)
+        regular = self.fonts['regular']
+        footers = []
+        for index in range(1, len(self.pages) + 1):
+            # Page numbers in the footer
+            footer = printable(f'{index} / {len(self.pages)}', regular)
+            footers.append(b'BT /F1 8 Tf %g %g Td %s Tj ET' % (
+                PAGE_WIDTH - MARGIN - text_width(footer, 8, regular), MARGIN / 2, regular.encode(footer)
+            ))
+
+        # Written after every page is encoded, so embedded subsets hold every glyph used
+        fonts = [(b'F1', regular)]
+        if not self.stroke_bold:
+            fonts.append((b'F2', self.fonts['bold']))
+        font_resources = b' '.join(b'/%s %d 0 R' % (name, font.write(add)) for name, font in fonts)
+
+        page_numbers = []
+        for commands, footer in zip(self.pages, footers):
+            content = add(_stream(b'\n'.join(commands + [footer])))
+            page_numbers.append(add(
+                b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources << /Font << %s >> >> /Contents %d 0 R >>'
+                % (pages, PAGE_WIDTH, PAGE_HEIGHT, font_resources, content)
+            ))
+
+        objects[catalog - 1] = b'<< /Type /Catalog /Pages %d 0 R >>' % pages
+        objects[pages - 1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % number for number in page_numbers), len(page_numbers)
+        )
+        info = [b'/Producer (GlobeTrotter)', b'/CreationDate (D:%s)' % datetime.utcnow().strftime('%Y%m%d%H%M%SZ').encode()]
+        if self.title:
+            info.append(b'/Title ' + _info_string(self.title))
+        if self.author:
+            info.append(b'/Author ' + _info_string(self.author))
+        info_number = add(b'<< ' + b' '.join(info) + b' >>')
+
+        output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, data in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n%s\nendobj\n' % (number, data)
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        output += b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+            len(objects) + 1, catalog, info_number, xref
+        )
+        return bytes(output)
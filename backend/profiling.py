@@ -0,0 +1,224 @@
+"""
+Opt-in sampling profiler for requests.
+
+A profiled request registers its thread with the Sampler. One background
+thread wakes every PROFILING_INTERVAL_MS, reads the current stack of
+each registered thread (sys._current_frames) and counts it. Nothing is
+traced, so a profiled request runs at close to full speed and
+unprofiled requests pay only the sampling decision.
+
+A request is profiled when the profiler is enabled and:
+- its endpoint is listed in the routes setting;
+- it carries the PROFILING_HEADER header set to PROFILING_TOKEN; or
+- it falls in the sampled fraction of requests (sample_rate).
+
+Each profile is written to PROFILING_OUTPUT_DIR as a .folded file: one
+"frame;frame;frame count" line per distinct stack, root first. That is
+the collapsed-stack format read by flamegraph.pl, speedscope and
+inferno. Cat several files together to merge them. Only the newest
+PROFILING_MAX_FILES profiles are kept.
+
+Settings start from the PROFILING_* config and can be changed at runtime
+through /api/admin/profiling; changes apply to the serving process only.
+"""
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, request
+
+PROFILER_KEY = 'globetrotter_profiler'
+MAX_STACK_DEPTH = 200
+
+
+class Collector:
+    """Stack samples of one thread"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.samples = 0
+        self.stacks = {}
+        self.filename = None
+
+
+class Sampler:
+    """Background thread sampling the stacks of registered threads"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.collectors = {}  # thread ident -> Collector
+        self.condition = threading.Condition()
+        self.thread = None
+        self.labels = {}  # code object -> frame label
+
+    def start(self, name):
+        collector = Collector(name)
+        with self.condition:
+            self.collectors[threading.get_ident()] = collector
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return collector
+
+    def stop(self):
+        with self.condition:
+            return self.collectors.pop(threading.get_ident(), None)
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            # Shortest name relative to sys.path, e.g. flask/app.py rather than an absolute path
+            prefixes = [prefix for prefix in sys.path if prefix and filename.startswith(prefix + os.sep)]
+            if prefixes:
+                filename = filename[len(max(prefixes, key=len)) + 1:]
+            # ';' separates frames in the folded format
+            label = self.labels[code] = f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+        return label
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    def _run(self):
+        while True:
+            # Sampling under the lock means a stopped collector is never written to again
+            with self.condition:
+                while not self.collectors:
+                    self.condition.wait()
+                frames = sys._current_frames()
+                for ident, collector in self.collectors.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stack = self._stack(frame)
+                        collector.stacks[stack] = collector.stacks.get(stack, 0) + 1
+                        collector.samples += 1
+                # Don't keep the sampled threads' frames alive until the next tick
+                frames = frame = None
+            time.sleep(self.interval)
+
+
+class Profiler:
+    """Sampling decisions, runtime settings and profile files for one app"""
+
+    def __init__(self, config):
+        self.enabled = config['PROFILING_ENABLED']
+        self.sample_rate = config['PROFILING_SAMPLE_RATE']
+        self.routes = set(config['PROFILING_ROUTES'])
+        self.header = config['PROFILING_HEADER']
+        self.token = config['PROFILING_TOKEN']
+        self.output_dir = config['PROFILING_OUTPUT_DIR']
+        self.max_files = config['PROFILING_MAX_FILES']
+        self.sampler = Sampler(config['PROFILING_INTERVAL_MS'] / 1000)
+        self.lock = threading.Lock()
+
+    def settings(self):
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'routes': sorted(self.routes),
+            'interval_ms': round(self.sampler.interval * 1000, 3),
+            'output_dir': os.path.abspath(self.output_dir),
+        }
+
+    def update(self, data):
+        """Apply a settings change; returns an error message or None"""
+        enabled = data.get('enabled', self.enabled)
+        sample_rate = data.get('sample_rate', self.sample_rate)
+        routes = data.get('routes', sorted(self.routes))
+        if not isinstance(enabled, bool):
+            return 'enabled must be true or false'
+        if isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float)) or not 0 <= sample_rate <= 1:
+            return 'sample_rate must be a number between 0 and 1'
+        if not isinstance(routes, list) or any(not isinstance(route, str) for route in routes):
+            return 'routes must be a list of endpoint names'
+        self.enabled, self.sample_rate, self.routes = enabled, float(sample_rate), set(routes)
+        return None
+
+    def wants(self):
+        """Whether the current request should be profiled"""
+        if not self.enabled:
+            return False
+        if request.endpoint in self.routes:
+            return True
+        if self.token:
+            supplied = request.headers.get(self.header)
+            if supplied and hmac.compare_digest(supplied, self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def write(self, collector):
+        """Write a collector's stacks as a .folded file; returns the file name"""
+        if not collector.samples:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        filename = f"{datetime.utcnow():%Y%m%dT%H%M%S.%f}-{collector.name}-{uuid.uuid4().hex[:8]}.folded"
+        with open(os.path.join(self.output_dir, filename), 'w') as f:
+            for stack, count in sorted(collector.stacks.items(), key=lambda item: -item[1]):
+                f.write(f'{stack} {count}\n')
+        self._prune()
+        return filename
+
+    def _prune(self):
+        with self.lock:
+            files = sorted(name for name in os.listdir(self.output_dir) if name.endswith('.folded'))
+            for name in files[:max(len(files) - self.max_files, 0)]:
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except OSError:
+                    pass
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the enclosed block (e.g. a CLI command) regardless of the sampling settings"""
+        collector = self.sampler.start(name)
+        try:
+            yield collector
+        finally:
+            self.sampler.stop()
+            collector.filename = self.write(collector)
+
+
+def _profile_name():
+    return (request.endpoint or 'unmatched').replace('.', '-')
+
+
+def init_profiling(app):
+    """Profile sampled requests of app (see module docstring)"""
+    profiler = Profiler(app.config)
+    app.extensions[PROFILER_KEY] = profiler
+
+    @app.before_request
+    def start_profile():
+        if profiler.wants():
+            g.profile_collector = profiler.sampler.start(_profile_name())
+
+    @app.after_request
+    def tag_profiled_response(response):
+        if g.get('profile_collector') is not None:
+            response.headers['X-Profiled'] = 'true'
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        collector = g.pop('profile_collector', None)
+        if collector is not None:
+            profiler.sampler.stop()
+            try:
+                profiler.write(collector)
+            except OSError as e:
+                app.logger.warning(f'Writing profile failed: {e}')
+
+    return profiler
@@ -0,0 +1,158 @@
+"""
+JSON serialization for API responses.
+
+FastJSONProvider replaces Flask's default provider. It encodes with
+orjson when it is installed (stdlib json otherwise) and can splice
+already-encoded JSON text (RawJSON) into a response without decoding and
+re-encoding it.
+
+Listing endpoints can also answer in a compact form (listing_response):
+?format=columnar returns one array per field instead of one object per
+row, and Accept: application/msgpack returns MessagePack when the msgpack
+package is installed.
+"""
+
+import json
+import secrets
+
+from flask import current_app, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+# orjson >= 3.9 can embed pre-encoded JSON natively
+_ORJSON_FRAGMENT = getattr(orjson, 'Fragment', None)
+
+
+class RawJSON:
+    """Already-encoded JSON text that is written into the output as-is"""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f'RawJSON({self.text[:40]!r})'
+
+
+def splice_json_array(object_text, key, item_texts):
+    """Add key: [items] to an encoded JSON object, working on the text only"""
+    inner = object_text.rstrip()[:-1].rstrip()
+    separator = '' if inner.endswith('{') else ','
+    return f'{inner}{separator}{json.dumps(key)}:[{",".join(item_texts)}]}}'
+
+
+class _Splicer:
+    """default() hook that swaps RawJSON values for placeholders, then back"""
+
+    def __init__(self, fallback, native_fragments=False):
+        self.fallback = fallback
+        self.native_fragments = native_fragments
+        self.nonce = None
+        self.fragments = []
+
+    def __call__(self, obj):
+        if isinstance(obj, RawJSON):
+            if self.native_fragments:
+                return _ORJSON_FRAGMENT(obj.text)
+            if self.nonce is None:
+                self.nonce = secrets.token_hex(8)
+            token = f'__raw_json_{self.nonce}_{len(self.fragments)}__'
+            self.fragments.append((token, obj.text))
+            return token
+        return self.fallback(obj)
+
+    def splice(self, data):
+        for token, text in self.fragments:
+            data = data.replace(f'"{token}"'.encode(), text.encode('utf-8'), 1)
+        return data
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson when available"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        backend = app.config.get('JSON_BACKEND', 'auto')
+        self.use_orjson = orjson is not None and backend in ('auto', 'orjson')
+
+    def dumps_bytes(self, obj, indent=False):
+        if self.use_orjson:
+            splicer = _Splicer(self.default, native_fragments=_ORJSON_FRAGMENT is not None)
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            data = orjson.dumps(obj, default=splicer, option=option)
+        else:
+            splicer = _Splicer(self.default)
+            data = json.dumps(
+                obj,
+                default=splicer,
+                ensure_ascii=self.ensure_ascii,
+                sort_keys=self.sort_keys,
+                indent=2 if indent else None,
+                separators=None if indent else (',', ':'),
+            ).encode('utf-8')
+
+        return splicer.splice(data)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Custom json.dumps arguments: use the stdlib path as Flask would
+            splicer = _Splicer(self.default)
+            kwargs.setdefault('default', splicer)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return splicer.splice(json.dumps(obj, **kwargs).encode('utf-8')).decode('utf-8')
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent=indent) + b'\n', mimetype=self.mimetype)
+
+
+def to_columnar(rows):
+    """Turn a list of dicts into {field: [value per row]}"""
+    columns = {}
+    for key in (rows[0] if rows else ()):
+        columns[key] = [row.get(key) for row in rows]
+    return columns
+
+
+def wants_msgpack():
+    if msgpack is None:
+        return False
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def listing_response(payload, key, status=200):
+    """Respond with payload, honouring ?format=columnar for payload[key] and Accept: application/msgpack"""
+    if request.args.get('format') == 'columnar':
+        payload[key] = to_columnar(payload[key])
+        payload['format'] = 'columnar'
+
+    if wants_msgpack():
+        response = current_app.response_class(msgpack.packb(payload, use_bin_type=True), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(payload)
+    response.vary.add('Accept')
+    response.status_code = status
+    return response
@@ -0,0 +1,274 @@
+"""
+Change log for incremental sync (GET /api/sync).
+
+Every flush that inserts, updates or deletes a trip, stop, itinerary
+activity, budget or saved destination records the change in the
+change_log table under the owning user. Each user has a monotonically
+increasing sequence (users.sync_seq) and every change takes the next
+number, so a client only needs the last number it has seen as its
+cursor. Bumping the sequence locks the user's row until commit, so a
+user's changes commit in sequence order and a cursor never skips one.
+
+The log keeps one row per entity, its latest change; a deleted entity
+keeps a tombstone row so clients holding a copy learn it is gone.
+Changes are recorded by session listeners, so handlers need no code for
+it. Writes that bypass the ORM unit of work (bulk query.delete() or
+Core statements) are not recorded.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, Activity, Budget, ChangeLog, ItineraryActivity, SavedDestination, Stop, Trip, User
+
+PENDING_KEY = 'pending_sync_changes'
+DELETED_USERS_KEY = 'deleted_sync_users'
+
+ENTITY_TYPES = {
+    Trip: 'trips',
+    Stop: 'stops',
+    ItineraryActivity: 'itinerary_activities',
+    Budget: 'budgets',
+    SavedDestination: 'saved_destinations',
+}
+
+
+def trip_of(obj):
+    """The trip a trip, stop, itinerary activity, budget or AI itinerary day belongs to"""
+    if isinstance(obj, Trip):
+        return obj
+    if isinstance(obj, ItineraryActivity):
+        stop = obj.stop if obj.stop is not None else db.session.get(Stop, obj.stop_id)
+        return stop.trip if stop is not None else None
+    if obj.trip is not None:
+        return obj.trip
+    return db.session.get(Trip, obj.trip_id) if obj.trip_id else None
+
+
+def _owner(obj):
+    """(user_id, trip) of a synced entity, read before the flush"""
+    if isinstance(obj, SavedDestination):
+        return (obj.user_id if obj.user_id is not None else obj.user.id), None
+    trip = trip_of(obj)
+    if trip is None:
+        return None, None
+    user_id = trip.user_id if trip.user_id is not None else trip.user.id
+    return user_id, trip
+
+
+def _collect(session, flush_context, instances):
+    pending = session.info.setdefault(PENDING_KEY, [])
+    changed = [(obj, False) for obj in session.new]
+    changed += [(obj, False) for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    changed += [(obj, True) for obj in session.deleted]
+
+    for obj, deleted in changed:
+        if isinstance(obj, User) and deleted:
+            session.info.setdefault(DELETED_USERS_KEY, set()).add(obj.id)
+            continue
+        if type(obj) not in ENTITY_TYPES:
+            continue
+        user_id, trip = _owner(obj)
+        if user_id is None:
+            continue
+        pending.append((obj, deleted, user_id, trip))
+        if isinstance(obj, ItineraryActivity) and trip is not None and trip.budget is not None:
+            # The budget reports the live activities cost, so it changes too
+            pending.append((trip.budget, False, user_id, trip))
+
+
+def _record(session, flush_context):
+    pending = session.info.pop(PENDING_KEY, None)
+    deleted_users = session.info.pop(DELETED_USERS_KEY, None)
+    if not pending and not deleted_users:
+        return
+
+    conn = session.connection()
+    by_user = {}
+    for obj, deleted, user_id, trip in pending or ():
+        if obj.id is None:
+            continue
+        key = (ENTITY_TYPES[type(obj)], obj.id)
+        changes = by_user.setdefault(user_id, {})
+        # A deletion wins over an update of the same entity in this flush
+        if key in changes and changes[key][1]:
+            continue
+        changes[key] = (trip.id if trip is not None else None, deleted)
+
+    for user_id in deleted_users or ():
+        by_user.pop(user_id, None)
+        conn.execute(ChangeLog.__table__.delete().where(ChangeLog.user_id == user_id))
+
+    for user_id, changes in by_user.items():
+        # Locks the user's row until commit, keeping their changes in sequence order
+        conn.execute(
+            text("UPDATE users SET sync_seq = sync_seq + :n WHERE id = :user_id"),
+            {'n': len(changes), 'user_id': user_id}
+        )
+        last_seq = conn.execute(
+            text("SELECT sync_seq FROM users WHERE id = :user_id"), {'user_id': user_id}
+        ).scalar()
+        if last_seq is None:
+            continue  # user deleted in this flush
+
+        table = ChangeLog.__table__
+        by_type = {}
+        for entity_type, entity_id in changes:
+            by_type.setdefault(entity_type, []).append(entity_id)
+        for entity_type, ids in by_type.items():
+            conn.execute(table.delete().where(
+                table.c.user_id == user_id, table.c.entity_type == entity_type, table.c.entity_id.in_(ids)
+            ))
+
+        now = datetime.utcnow()
+        first_seq = last_seq - len(changes) + 1
+        conn.execute(table.insert(), [
+            {
+                'user_id': user_id,
+                'seq': first_seq + offset,
+                'entity_type': entity_type,
+                'entity_id': entity_id,
+                'trip_id': trip_id,
+                'deleted': deleted,
+                'changed_at': now,
+            }
+            for offset, ((entity_type, entity_id), (trip_id, deleted)) in enumerate(changes.items())
+        ])
+
+
+def _discard(session, *args):
+    session.info.pop(PENDING_KEY, None)
+    session.info.pop(DELETED_USERS_KEY, None)
+
+
+def init_sync(session_class):
+    """Record synced entity changes on every flush of session_class"""
+    event.listen(session_class, 'before_flush', _collect)
+    event.listen(session_class, 'after_flush', _record)
+    event.listen(session_class, 'after_rollback', _discard)
+
+
+def current_seq(user_id):
+    return db.session.execute(
+        text("SELECT sync_seq FROM users WHERE id = :user_id"), {'user_id': user_id}
+    ).scalar() or 0
+
+
+def trip_change_seq(user_id, trip_id):
+    """Sequence number of the latest change to the trip or anything in it (0 if none is logged)"""
+    return db.session.query(db.func.max(ChangeLog.seq)).filter(
+        ChangeLog.user_id == user_id, ChangeLog.trip_id == trip_id
+    ).scalar() or 0
+
+
+def _stop_positions(trip_ids):
+    """{trip_id: [stop ids in order]} for the given trips"""
+    order = {trip_id: [] for trip_id in trip_ids}
+    if trip_ids:
+        rows = db.session.query(Stop.id, Stop.trip_id).filter(Stop.trip_id.in_(trip_ids)).order_by(
+            Stop.trip_id, Stop.sort_key, Stop.id
+        )
+        for stop_id, trip_id in rows:
+            order[trip_id].append(stop_id)
+    return order
+
+
+def _activities_costs(trip_ids):
+    """{trip_id: activities cost}, as in trip_activities_cost() but for many trips"""
+    if not trip_ids:
+        return {}
+    cost = db.func.coalesce(db.func.nullif(ItineraryActivity.estimated_cost_override, 0), Activity.estimated_cost)
+    rows = db.session.query(Stop.trip_id, db.func.coalesce(db.func.sum(cost), 0.0)).select_from(ItineraryActivity).join(
+        Activity, ItineraryActivity.activity_id == Activity.id
+    ).join(Stop, ItineraryActivity.stop_id == Stop.id).filter(Stop.trip_id.in_(trip_ids)).group_by(Stop.trip_id)
+    return {trip_id: float(total) for trip_id, total in rows}
+
+
+def _serialize(user_id, ids=None, stop_trips=()):
+    """Current state of the given entities by type (ids None = all of the user's) and their trips' stop order"""
+    def scoped(query, type_):
+        if ids is None:
+            return query
+        model = next(model for model, name in ENTITY_TYPES.items() if name == type_)
+        return query.filter(model.id.in_(ids.get(type_, ())))
+
+    trips = scoped(Trip.query.options(selectinload(Trip.stops)), 'trips').filter(Trip.user_id == user_id).all()
+    stops = scoped(Stop.query.join(Trip).options(joinedload(Stop.city)), 'stops').filter(Trip.user_id == user_id).all()
+    items = scoped(
+        ItineraryActivity.query.join(Stop).join(Trip).options(joinedload(ItineraryActivity.activity)),
+        'itinerary_activities'
+    ).filter(Trip.user_id == user_id).all()
+    budgets = scoped(Budget.query.join(Trip), 'budgets').filter(Trip.user_id == user_id).all()
+    saved = scoped(
+        SavedDestination.query.options(joinedload(SavedDestination.city)), 'saved_destinations'
+    ).filter(SavedDestination.user_id == user_id).all()
+
+    stop_order = _stop_positions(sorted({stop.trip_id for stop in stops} | set(stop_trips)))
+    positions = {
+        stop_id: position
+        for stop_ids in stop_order.values()
+        for position, stop_id in enumerate(stop_ids, start=1)
+    }
+    costs = _activities_costs([budget.trip_id for budget in budgets])
+
+    changes = {
+        'trips': [trip.to_dict() for trip in trips],
+        'stops': [stop.to_dict(order_index=positions.get(stop.id)) for stop in stops],
+        'itinerary_activities': [item.to_dict() for item in items],
+        'budgets': [budget.to_dict(activities_cost=costs.get(budget.trip_id, 0.0)) for budget in budgets],
+        'saved_destinations': [item.to_dict() for item in saved],
+    }
+    return changes, stop_order
+
+
+def snapshot(user_id):
+    """Every synced entity of the user, with the cursor to sync from next"""
+    cursor = current_seq(user_id)  # read first: later changes are sent again, never missed
+    changes, stop_order = _serialize(user_id)
+    return {
+        'cursor': cursor,
+        'full': True,
+        'has_more': False,
+        'changes': changes,
+        'deleted': {type_: [] for type_ in ENTITY_TYPES.values()},
+        'stop_order': stop_order,
+    }
+
+
+def changes_since(user_id, since, limit):
+    """Entities changed or deleted after cursor since (at most limit of them)"""
+    rows = ChangeLog.query.filter(ChangeLog.user_id == user_id, ChangeLog.seq > since).order_by(
+        ChangeLog.seq
+    ).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    ids = {}
+    deleted = {type_: [] for type_ in ENTITY_TYPES.values()}
+    stop_trips = set()
+    for row in rows:
+        if row.deleted:
+            deleted[row.entity_type].append(row.entity_id)
+        else:
+            ids.setdefault(row.entity_type, []).append(row.entity_id)
+        if row.entity_type == 'stops' and row.trip_id is not None:
+            stop_trips.add(row.trip_id)
+
+    changes, stop_order = _serialize(user_id, ids, stop_trips)
+
+    # Logged as changed but gone now (e.g. removed by a bulk delete)
+    for type_, entities in changes.items():
+        found = {entity['id'] for entity in entities}
+        deleted[type_].extend(entity_id for entity_id in ids.get(type_, ()) if entity_id not in found)
+
+    return {
+        'cursor': rows[-1].seq if rows else since,
+        'full': False,
+        'has_more': has_more,
+        'changes': changes,
+        'deleted': deleted,
+        # Moving a stop shifts its neighbours' positions, so send whole orders
+        'stop_order': stop_order,
+    }
@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its configuration when it is imported, so point it at a
+# scratch SQLite database before any test imports it. A PostgreSQL
+# DATABASE_URL is kept for test_postgres.py, which connects by itself.
+SCRATCH_DIR = tempfile.mkdtemp(prefix='globetrotter-tests-')
+os.environ.setdefault('TEST_POSTGRES_URL', os.getenv('DATABASE_URL', ''))
+os.environ['DATABASE_URL'] = f'sqlite:///{SCRATCH_DIR}/globetrotter.db'
+os.environ['DATABASE_REPLICA_URLS'] = ''
+os.environ['TRIP_EXPORT_DIR'] = os.path.join(SCRATCH_DIR, 'exports')
+os.environ['PROFILING_OUTPUT_DIR'] = os.path.join(SCRATCH_DIR, 'profiles')
+os.environ['LLM_USAGE_ASYNC'] = 'false'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    from migrations import run_migrations
+    from models import db
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        run_migrations(db.engine)
+    return app
+
+
+@pytest.fixture
+def database(app):
+    """The app's database, emptied (and the response cache cleared) before each test"""
+    from compression import COMPRESSION_CACHE_KEY
+    from models import db
+
+    with app.app_context():
+        with db.engine.begin() as conn:
+            for table in reversed(db.metadata.sorted_tables):
+                conn.execute(table.delete())
+        app.extensions[COMPRESSION_CACHE_KEY].invalidate('')
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(client):
+    """A registered user, logged in on client"""
+    response = client.post('/api/auth/register', json={'email': 'ana@example.com', 'password': 'secret', 'name': 'Ana'})
+    assert response.status_code == 201
+    return response.get_json()['user']
+
+
+@pytest.fixture
+def cities(database):
+    from models import Activity, City
+
+    paris = City(name='Paris', country='France', region='Europe', cost_index=1.5, popularity_score=95,
+                 latitude=48.8566, longitude=2.3522)
+    rome = City(name='Rome', country='Italy', region='Europe', cost_index=1.3, popularity_score=89,
+                latitude=41.9028, longitude=12.4964)
+    database.session.add_all([paris, rome])
+    database.session.flush()
+    database.session.add_all([
+        Activity(city_id=paris.id, name='Louvre Museum', category='culture', estimated_cost=1700, duration_hours=3),
+        Activity(city_id=paris.id, name='Seine Cruise', category='sightseeing', estimated_cost=1200, duration_hours=1),
+        Activity(city_id=rome.id, name='Colosseum', category='culture', estimated_cost=1500, duration_hours=2.5),
+    ])
+    database.session.commit()
+    return {city.name: city.id for city in (paris, rome)}
+
+
+@pytest.fixture
+def trip(client, user, cities):
+    """A trip of user's with a Paris stop and a Rome stop"""
+    response = client.post('/api/trips', json={'name': 'Europe', 'start_date': '2026-05-01', 'end_date': '2026-05-07'})
+    assert response.status_code == 201
+    trip = response.get_json()['trip']
+    for city, start, end in (('Paris', '2026-05-01', '2026-05-04'), ('Rome', '2026-05-04', '2026-05-07')):
+        response = client.post(f"/api/trips/{trip['id']}/stops",
+                               json={'city_id': cities[city], 'start_date': start, 'end_date': end})
+        assert response.status_code == 201
+    return client.get(f"/api/trips/{trip['id']}").get_json()['trip']
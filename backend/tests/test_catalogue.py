@@ -0,0 +1,118 @@
+"""flask import-catalogue / export-catalogue (catalogue.py)"""
+
+import csv
+import io
+import json
+
+import pytest
+
+from catalogue import import_catalogue
+from models import Activity, City
+
+
+@pytest.fixture
+def cli(app, database):
+    runner = app.test_cli_runner()
+
+    def invoke(*args, input=None):
+        return runner.invoke(args=list(args), input=input)
+
+    return invoke
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_import_cities_csv(cli, database, cities, tmp_path):
+    path = write(tmp_path / 'cities.csv', (
+        'name,country,region,cost_index,popularity_score,latitude,longitude\n'
+        'Paris,France,,1.8,,,\n'
+        'Lisbon,Portugal,Europe,1.1,80,38.7223,-9.1393\n'
+        'Nowhere,,Europe,1,1,0,0\n'
+        'Porto,Portugal,Europe,cheap,70,41.15,-8.61\n'
+    ))
+    result = cli('import-catalogue', 'cities', path)
+    assert result.exit_code == 0, result.output
+    assert '  line 4: country is required' in result.output
+    assert "  line 5: cost_index has an invalid value 'cheap'" in result.output
+    assert 'Read 4 cities' in result.output and '1 inserted, 1 updated, 2 skipped.' in result.output
+
+    paris = database.session.get(City, cities['Paris'])
+    # Empty cells leave the stored values alone
+    assert (paris.cost_index, paris.region, paris.popularity_score) == (1.8, 'Europe', 95)
+    lisbon = City.query.filter_by(name='Lisbon').one()
+    assert (lisbon.country, lisbon.latitude, lisbon.popularity_score) == ('Portugal', 38.7223, 80)
+
+
+def test_import_activities_ndjson(cli, database, cities, tmp_path):
+    records = [
+        {'name': '  louvre   MUSEUM ', 'city_country': 'France', 'city_name': 'Paris', 'estimated_cost': 1900},
+        {'name': 'Trevi Fountain', 'city_id': cities['Rome'], 'category': 'sightseeing', 'description': 'Coins'},
+        {'name': 'Trevi Fountain', 'city_id': cities['Rome'], 'description': None},
+        {'name': 'Big Ben', 'city_country': 'UK', 'city_name': 'London'},
+        {'name': 'Lost', 'city_id': 999},
+        {'name': 'No city'},
+    ]
+    text = '\n'.join(json.dumps(record) for record in records) + '\n{not json\n\n[1]\n'
+    result = cli('import-catalogue', 'activities', write(tmp_path / 'activities.jsonl', text), '--chunk-size', '2')
+    assert result.exit_code == 0, result.output
+    for line in ("line 4: unknown city 'London' in 'UK'", 'line 5: unknown city_id 999',
+                 'line 6: city_country and city_name (or city_id) are required',
+                 'line 7: invalid JSON', 'line 9: expected a JSON object'):
+        assert line in result.output
+    assert '1 inserted, 2 updated, 5 skipped.' in result.output
+
+    louvre = Activity.query.filter_by(city_id=cities['Paris'], name_key='louvre museum').one()
+    assert (louvre.name, louvre.estimated_cost, louvre.category) == ('louvre   MUSEUM', 1900, 'culture')
+    trevi = Activity.query.filter_by(name='Trevi Fountain').one()
+    # The second chunk updates the row the first inserted; null clears the description
+    assert (trevi.category, trevi.description) == ('sightseeing', None)
+
+
+def test_duplicates_within_a_chunk_keep_the_last_record(database, cities):
+    f = io.StringIO('name,country,cost_index\nOslo,Norway,2.0\nOslo,Norway,2.5\n')
+    result = import_catalogue(database.engine, 'cities', f, 'csv')
+    assert (result['read'], result['inserted'], result['updated']) == (2, 1, 0)
+    assert City.query.filter_by(name='Oslo').one().cost_index == 2.5
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'ndjson'])
+def test_export_and_reimport(cli, database, cities, tmp_path, file_format):
+    for kind in ('cities', 'activities'):
+        path = str(tmp_path / f'{kind}.{file_format}')
+        result = cli('export-catalogue', kind, path, '--chunk-size', '1')
+        assert result.exit_code == 0, result.output
+        assert f'Exported {2 if kind == "cities" else 3} {kind}' in result.output
+
+        result = cli('import-catalogue', kind, path)
+        assert result.exit_code == 0, result.output
+        assert '0 inserted' in result.output and '0 skipped' in result.output
+    assert City.query.count() == 2 and Activity.query.count() == 3
+
+    with open(tmp_path / f'activities.{file_format}', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f)) if file_format == 'csv' else [json.loads(line) for line in f]
+    assert [(row['city_country'], row['city_name'], row['name']) for row in rows] == [
+        ('France', 'Paris', 'Louvre Museum'), ('France', 'Paris', 'Seine Cruise'), ('Italy', 'Rome', 'Colosseum'),
+    ]
+
+
+def test_export_to_stdout(cli, cities):
+    result = cli('export-catalogue', 'cities', '-', '--format', 'ndjson')
+    assert result.exit_code == 0
+    names = [json.loads(line)['name'] for line in result.stdout.splitlines() if line.startswith('{')]
+    assert names == ['Paris', 'Rome']
+
+
+def test_import_from_stdin(cli, database):
+    result = cli('import-catalogue', 'cities', '-', '--format', 'csv', input='name,country\nKyoto,Japan\n')
+    assert result.exit_code == 0, result.output
+    assert City.query.filter_by(name='Kyoto').count() == 1
+
+
+def test_unknown_format(cli, tmp_path):
+    result = cli('import-catalogue', 'cities', write(tmp_path / 'cities.txt', 'name,country\n'))
+    assert result.exit_code == 2
+    assert 'Cannot tell the format' in result.output
+    assert cli('export-catalogue', 'cities', str(tmp_path / 'out.csv'), '--chunk-size', '0').exit_code == 2
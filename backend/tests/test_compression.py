@@ -0,0 +1,121 @@
+"""Response compression and the pre-compressed cache of shared trips"""
+
+import gzip
+
+import brotli
+import pytest
+
+import compression
+from compression import COMPRESSION_CACHE_KEY
+
+
+@pytest.fixture
+def shared_trip(client, trip):
+    response = client.put(f"/api/trips/{trip['id']}", json={'is_public': True})
+    assert response.status_code == 200
+    return response.get_json()['trip']
+
+
+@pytest.fixture
+def compress_calls(monkeypatch):
+    """Encodings passed to compression.compress()"""
+    calls = []
+    compress = compression.compress
+
+    def counting(data, encoding, level):
+        calls.append(encoding)
+        return compress(data, encoding, level)
+
+    monkeypatch.setattr(compression, 'compress', counting)
+    return calls
+
+
+def test_gzip_and_brotli(app, client, user, cities, monkeypatch):
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 0)
+    plain = client.get('/api/activities/search')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.vary
+
+    response = client.get('/api/activities/search', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+
+    response = client.get('/api/activities/search', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == plain.data
+
+    response = client.get('/api/activities/search', headers={'Accept-Encoding': 'gzip;q=1, br;q=0.1'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_size_threshold_and_errors(app, client, user, cities, monkeypatch):
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 10 ** 6)
+    response = client.get('/api/activities/search', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.vary
+
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 0)
+    response = client.get('/api/trips/999', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 404
+    assert 'Content-Encoding' not in response.headers
+
+    monkeypatch.setitem(app.config, 'COMPRESS_ENABLED', False)
+    response = client.get('/api/activities/search', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_shared_trip_compressed_once_per_fill(app, client, shared_trip, compress_calls, monkeypatch):
+    monkeypatch.setitem(app.config, 'COMPRESS_MIN_SIZE', 0)
+    url = f"/api/trips/shared/{shared_trip['share_code']}"
+    plain = client.get(url)
+    assert plain.status_code == 200
+    assert plain.get_json()['trip']['name'] == 'Europe'
+
+    for _ in range(3):
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert gzip.decompress(response.data) == plain.data
+        response = client.get(url, headers={'Accept-Encoding': 'br'})
+        assert brotli.decompress(response.data) == plain.data
+    assert compress_calls == ['gzip', 'br']
+
+    # A different query string is a different entry
+    assert client.get(url + '?fields=name&include=').get_json() == {'trip': {'name': 'Europe'}}
+    assert len(app.extensions[COMPRESSION_CACHE_KEY].entries) == 2
+
+
+def shared(client, trip):
+    return client.get(f"/api/trips/shared/{trip['share_code']}")
+
+
+def test_cache_invalidated_by_trip_changes(client, shared_trip, cities):
+    stop = shared_trip['stops'][0]
+    assert shared(client, shared_trip).get_json()['trip']['stops'][0]['notes'] == ''
+
+    client.put(f"/api/stops/{stop['id']}", json={'notes': 'Arrive by train'})
+    assert shared(client, shared_trip).get_json()['trip']['stops'][0]['notes'] == 'Arrive by train'
+
+    client.post(f"/api/stops/{stop['id']}/activities", json={'activity_id': 1, 'day_number': 1})
+    activities = shared(client, shared_trip).get_json()['trip']['stops'][0]['activities']
+    assert [activity['activity']['name'] for activity in activities] == ['Louvre Museum']
+
+    client.put(f"/api/trips/{shared_trip['id']}/budget", json={'food_cost': 900})
+    assert shared(client, shared_trip).get_json()['trip']['budget']['food_cost'] == 900
+
+    client.put(f"/api/trips/{shared_trip['id']}", json={'is_public': False})
+    assert shared(client, shared_trip).status_code == 403
+
+
+def test_cache_kept_for_other_trips(app, client, shared_trip):
+    other = client.post('/api/trips', json={'name': 'Elsewhere', 'start_date': '2026-08-01', 'end_date': '2026-08-03'})
+    assert other.status_code == 201
+    shared(client, shared_trip)
+    entries = dict(app.extensions[COMPRESSION_CACHE_KEY].entries)
+
+    client.put(f"/api/trips/{other.get_json()['trip']['id']}", json={'name': 'Renamed'})
+    assert dict(app.extensions[COMPRESSION_CACHE_KEY].entries) == entries
+
+
+def test_deleted_trip_is_not_served_from_cache(client, shared_trip):
+    assert shared(client, shared_trip).status_code == 200
+    assert client.delete(f"/api/trips/{shared_trip['id']}").status_code == 200
+    assert shared(client, shared_trip).status_code == 404
@@ -0,0 +1,101 @@
+"""Optimistic concurrency: version columns, ETags, If-Match and 412 responses"""
+
+import pytest
+from sqlalchemy import event, text
+
+from models import Budget, Stop, Trip
+
+
+@pytest.fixture
+def concurrent_write():
+    """Bump a row's version inside the request's own flush, as a competing writer would"""
+    listeners = []
+
+    def bump(model):
+        def before_update(mapper, connection, target):
+            connection.execute(text(f'UPDATE {model.__tablename__} SET version = version + 1 WHERE id = :id'),
+                               {'id': target.id})
+
+        event.listen(model, 'before_update', before_update, once=True)
+        listeners.append((model, before_update))
+
+    yield bump
+    for model, listener in listeners:
+        if event.contains(model, 'before_update', listener):
+            event.remove(model, 'before_update', listener)
+
+
+def test_trip_etag_and_if_match(client, trip):
+    url = f"/api/trips/{trip['id']}"
+    response = client.get(url)
+    etag = response.headers['ETag']
+    assert etag == f'"trips-{trip["id"]}-v{trip["version"]}"'
+
+    response = client.put(url, json={'name': 'Europe 2026'}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['trip']['version'] == trip['version'] + 1
+    assert response.headers['ETag'] != etag
+
+    response = client.put(url, json={'name': 'Stale edit'}, headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert response.get_json()['current_version'] == trip['version'] + 1
+    assert response.headers['ETag'] == client.get(url).headers['ETag']
+    assert client.get(url).get_json()['trip']['name'] == 'Europe 2026'
+
+    response = client.put(url, json={'name': 'Forced'}, headers={'If-Match': '*'})
+    assert response.status_code == 200
+
+    # Without If-Match the last writer wins
+    assert client.put(url, json={'name': 'Unconditional'}).status_code == 200
+
+
+def test_stop_if_match(client, trip):
+    stop = trip['stops'][0]
+    url = f"/api/stops/{stop['id']}"
+    first = client.put(url, json={'notes': 'one'}, headers={'If-Match': f'"stops-{stop["id"]}-v{stop["version"]}"'})
+    assert first.status_code == 200
+
+    response = client.put(url, json={'notes': 'two'}, headers={'If-Match': f'"stops-{stop["id"]}-v{stop["version"]}"'})
+    assert response.status_code == 412
+    assert response.get_json()['current_version'] == stop['version'] + 1
+
+    response = client.put(url, json={'notes': 'two'}, headers={'If-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['stop']['notes'] == 'two'
+
+
+def test_budget_if_match(client, trip):
+    url = f"/api/trips/{trip['id']}/budget"
+    etag = client.get(url).headers.get('ETag')
+    response = client.put(url, json={'food_cost': 900}, headers={'If-Match': etag} if etag else {})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    assert client.put(url, json={'food_cost': 950}, headers={'If-Match': etag}).status_code == 200
+    response = client.put(url, json={'food_cost': 1000}, headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert client.get(url).get_json()['budget']['food_cost'] == 950
+
+
+@pytest.mark.parametrize('model, url, body', [
+    (Trip, '/api/trips/{trip}', {'name': 'Lost update'}),
+    (Stop, '/api/stops/{stop}', {'notes': 'Lost update'}),
+    (Budget, '/api/trips/{trip}/budget', {'food_cost': 123}),
+])
+def test_write_racing_another_writer(client, database, trip, concurrent_write, model, url, body):
+    url = url.format(trip=trip['id'], stop=trip['stops'][0]['id'])
+    if model is Budget:
+        assert client.put(url, json={'food_cost': 1}).status_code == 200
+        row_id = database.session.query(Budget.id).filter_by(trip_id=trip['id']).scalar()
+    else:
+        row_id = trip['id'] if model is Trip else trip['stops'][0]['id']
+
+    concurrent_write(model)
+    response = client.put(url, json=body)
+    assert response.status_code == 412
+    assert response.get_json()['error'] == 'Resource was modified by another request'
+
+    row = database.session.get(model, row_id)
+    assert response.get_json()['current_version'] == row.version
+    for field, value in body.items():
+        assert getattr(row, field) != value
@@ -0,0 +1,72 @@
+"""flask generate-dataset and the synthetic data it writes"""
+
+from sqlalchemy import func
+
+from dataset import DATASET_PASSWORD, Scale, generate
+from models import Activity, City, ItineraryActivity, Stop, Trip, User
+from ordering import rebalance_trip_stops
+
+SIZES = ['--users', '8', '--cities', '12', '--activities', '60', '--trips', '20', '--batch-size', '50']
+
+
+def stops_by_trip(database):
+    stops = {}
+    for stop in database.session.query(Stop).order_by(Stop.trip_id, Stop.sort_key, Stop.id):
+        stops.setdefault(stop.trip_id, []).append(stop)
+    return stops
+
+
+def test_generate_dataset_command(app, database):
+    result = app.test_cli_runner().invoke(args=['generate-dataset', *SIZES])
+    assert result.exit_code == 0, result.output
+    assert 'Inserted' in result.output
+
+    assert database.session.query(User).count() == 8
+    assert database.session.query(City).count() == 12
+    assert database.session.query(Activity).count() == 60
+    assert database.session.query(Trip).count() == 20
+    assert database.session.query(Stop).count() > 0
+    assert database.session.query(ItineraryActivity).count() > 0
+
+
+def test_stop_positions_are_one_based(app, database):
+    generate(database.engine, Scale(users=5, cities=10, activities=40, trips=30), seed=7)
+
+    stops = stops_by_trip(database)
+    assert stops
+    for trip_stops in stops.values():
+        assert [stop.order_index for stop in trip_stops] == list(range(1, len(trip_stops) + 1))
+
+    # Rebalancing, as the app does after many moves, keeps the generated positions
+    trip_id, trip_stops = max(stops.items(), key=lambda item: len(item[1]))
+    expected = [(stop.id, stop.order_index) for stop in trip_stops]
+    rebalance_trip_stops(trip_id)
+    assert [(stop.id, stop.order_index) for stop in stops_by_trip(database)[trip_id]] == expected
+
+
+def test_generated_trip_through_the_api(client, database):
+    result = generate(database.engine, Scale(users=3, cities=6, activities=20, trips=12), seed=3)
+    owner, stop_count = database.session.query(Trip.user_id, func.count(Stop.id)).join(Stop).group_by(Trip.id) \
+        .order_by(func.count(Stop.id).desc()).first()
+    trip_id = database.session.query(Stop.trip_id).join(Trip).filter(Trip.user_id == owner) \
+        .group_by(Stop.trip_id).having(func.count(Stop.id) == stop_count).scalar()
+    email = database.session.get(User, owner).email
+
+    response = client.post('/api/auth/login', json={'email': email, 'password': DATASET_PASSWORD})
+    assert response.status_code == 200
+    stops = client.get(f'/api/trips/{trip_id}').get_json()['trip']['stops']
+    assert [stop['order_index'] for stop in stops] == list(range(1, stop_count + 1))
+    assert result['trips'][0] <= trip_id <= result['trips'][1]
+
+
+def test_same_seed_same_data(database):
+    scale = Scale(users=2, cities=4, activities=10, trips=5)
+    first = generate(database.engine, scale, seed=11)
+    rows = [(stop.trip_id - first['trips'][0], stop.city_id - first['cities'][0], stop.start_date, stop.order_index)
+            for stop in database.session.query(Stop).order_by(Stop.id)]
+
+    second = generate(database.engine, scale, seed=11)
+    assert second['counts'] == first['counts']
+    again = [(stop.trip_id - second['trips'][0], stop.city_id - second['cities'][0], stop.start_date, stop.order_index)
+             for stop in database.session.query(Stop).filter(Stop.trip_id >= second['trips'][0]).order_by(Stop.id)]
+    assert again == rows
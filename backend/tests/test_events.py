@@ -0,0 +1,84 @@
+"""Trip change events: the in-process broker and the Server-Sent Events streams"""
+
+import json
+
+from events import EVENTS_KEY, LocalBroker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_unwatched_channels_keep_no_history():
+    broker = LocalBroker(replay_size=3, replay_seconds=60, clock=Clock())
+    for number in range(1000):
+        broker.publish(f'trip:{number}', 'trip.updated', '{}')
+    assert broker.history == {}
+
+
+def test_replay_after_reconnect():
+    broker = LocalBroker(replay_size=3, replay_seconds=60, clock=Clock())
+    subscription = broker.subscribe('trip:1')
+    first = broker.publish('trip:1', 'stop.added', '1')
+    broker.unsubscribe(subscription)
+    for data in ('2', '3', '4'):
+        broker.publish('trip:1', 'stop.updated', data)
+
+    resumed = broker.subscribe('trip:1', last_event_id=first)
+    assert [resumed.get(timeout=0)[2] for _ in range(3)] == ['2', '3', '4']
+    assert resumed.queue.empty()
+
+
+def test_history_dropped_after_replay_window():
+    clock = Clock()
+    broker = LocalBroker(replay_size=3, replay_seconds=60, clock=clock)
+    broker.unsubscribe(broker.subscribe('trip:1'))
+    broker.unsubscribe(broker.subscribe('trip:2'))
+    broker.publish('trip:1', 'stop.added', '1')
+    watched = broker.subscribe('trip:3')
+    broker.publish('trip:3', 'stop.added', '3')
+
+    clock.now += 61
+    broker.publish('trip:1', 'stop.added', '2')
+    assert set(broker.history) == {'trip:3'}
+    assert broker.idle_since == {}
+    assert watched.get(timeout=0)[2] == '3'
+
+    broker.unsubscribe(watched)
+    clock.now += 121
+    broker.unsubscribe(broker.subscribe('trip:4'))
+    assert broker.history == {}
+    assert set(broker.idle_since) == {'trip:4'}
+
+
+def test_stream_sends_committed_changes(app, client, trip, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENT_KEEPALIVE_SECONDS', 1)
+    broker = app.extensions[EVENTS_KEY]
+    response = client.get(f"/api/trips/{trip['id']}/events")
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    frames = (frame.decode() for frame in response.response)
+    assert next(frames) == 'retry: 3000\n\n'
+
+    stop = trip['stops'][0]
+    assert client.put(f"/api/stops/{stop['id']}", json={'notes': 'Window seat'}).status_code == 200
+    frame = next(frames)
+    while frame.startswith(':'):  # keepalive
+        frame = next(frames)
+    lines = dict(line.split(': ', 1) for line in frame.strip().split('\n'))
+    assert lines['event'] == 'stop.updated'
+    assert json.loads(lines['data'])['notes'] == 'Window seat'
+
+    response.close()
+    assert f"trip:{trip['id']}" not in broker.subscribers
+    assert f"trip:{trip['id']}" in broker.idle_since
+
+
+def test_stream_of_another_users_trip(client, trip):
+    client.post('/api/auth/logout')
+    client.post('/api/auth/register', json={'email': 'bo@example.com', 'password': 'secret', 'name': 'Bo'})
+    assert client.get(f"/api/trips/{trip['id']}/events").status_code == 403
@@ -0,0 +1,85 @@
+"""Sparse fieldsets: ?fields=, ?fields[type]= and ?include="""
+
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from fieldsets import Fieldset
+from models import City, Stop
+
+
+@pytest.fixture
+def statements():
+    """SQL statements executed while the test runs"""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(Engine, 'before_cursor_execute', record)
+
+
+def test_fieldset_selection(app):
+    with app.test_request_context('/?fields=id, name&fields[city]=name&include=stops'):
+        fieldset = Fieldset.from_request('trip')
+    assert fieldset.fields == {'trip': {'id', 'name'}, 'city': {'name'}}
+    assert fieldset.wants('trip', 'name') and not fieldset.wants('trip', 'description')
+    assert fieldset.wants('budget', 'food_cost')
+    assert fieldset.includes('stops', False) and not fieldset.includes('budget', True)
+    assert fieldset.columns('city', City(id=1, name='Paris'), ('id', 'name')) == {'name': 'Paris'}
+
+    with app.test_request_context('/'):
+        fieldset = Fieldset.from_request('trip')
+    assert fieldset.includes('budget', True) and not fieldset.includes('stops', False)
+    assert fieldset.load_only(City, 'city') is None
+    assert fieldset.columns('stop', Stop(start_date=date(2026, 5, 1)), ('start_date', 'end_date')) == {
+        'start_date': '2026-05-01', 'end_date': None
+    }
+
+
+def test_load_only_columns(database):
+    fieldset = Fieldset({'stop': {'duration_days', 'order_index', 'city'}})
+    sql = str(fieldset.apply(Stop.query, Stop, 'stop', always=('trip_id',)).statement.compile())
+    for column in ('id', 'trip_id', 'start_date', 'end_date', 'sort_key', 'city_id'):
+        assert f'stops.{column}' in sql
+    assert 'stops.notes' not in sql and 'stops.version' not in sql
+
+
+def test_trip_list_fields(client, trip, statements):
+    response = client.get('/api/trips?fields=id,name')
+    assert response.status_code == 200
+    assert response.get_json()['trips'] == [{'id': trip['id'], 'name': 'Europe'}]
+    assert not any('trips.description' in statement for statement in statements)
+
+
+def test_trip_nested_fields_and_include(client, trip):
+    url = f"/api/trips/{trip['id']}?fields=id,name&include=stops&fields[stop]=id,order_index,city&fields[city]=name"
+    body = client.get(url).get_json()['trip']
+    assert set(body) == {'id', 'name', 'stops'}
+    assert body['stops'] == [
+        {'id': trip['stops'][0]['id'], 'order_index': 1, 'city': {'name': 'Paris'}},
+        {'id': trip['stops'][1]['id'], 'order_index': 2, 'city': {'name': 'Rome'}},
+    ]
+
+    body = client.get(f"/api/trips/{trip['id']}?include=").get_json()['trip']
+    assert 'stops' not in body and 'budget' not in body and 'ai_itinerary' not in body
+    assert body['name'] == 'Europe'
+
+    body = client.get(f"/api/trips/{trip['id']}?include=budget").get_json()['trip']
+    assert 'budget' in body and 'stops' not in body
+
+
+def test_city_search_fields(client, user, cities, statements):
+    response = client.get('/api/cities/search?q=par&fields=id,name')
+    assert response.status_code == 200
+    assert response.get_json()['cities'] == [{'id': cities['Paris'], 'name': 'Paris'}]
+    assert not any('cities.description' in statement for statement in statements)
+
+
+def test_unknown_fields_are_ignored(client, trip):
+    body = client.get(f"/api/trips/{trip['id']}?fields=id,nonsense&include=").get_json()['trip']
+    assert body == {'id': trip['id']}
@@ -0,0 +1,148 @@
+"""Budget forecasts and what-if scenarios (forecast.py)"""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from forecast import MAX_SHIFT_DAYS, leg_distances, month_factors
+
+PARIS_ROME_KM = 1105.8
+
+
+def with_stop(value, stop_id):
+    """value with the '{paris}' placeholders replaced by a stop id"""
+    if value == '{paris}':
+        return stop_id
+    if isinstance(value, dict):
+        return {str(stop_id) if key == '{paris}' else key: with_stop(item, stop_id) for key, item in value.items()}
+    if isinstance(value, list):
+        return [with_stop(item, stop_id) for item in value]
+    return value
+
+
+def forecast(client, trip, *scenarios, **options):
+    response = client.post(f"/api/trips/{trip['id']}/budget/forecast", json={'scenarios': list(scenarios), **options})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_baseline(client, trip):
+    response = client.get(f"/api/trips/{trip['id']}/budget/forecast")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert 'scenarios' not in body
+    paris, rome = body['forecast']['stops']
+
+    assert (paris['nights'], paris['start_date'], paris['end_date']) == (3, '2026-05-01', '2026-05-04')
+    assert paris['accommodation'] == 3 * 3000 * 1.5
+    assert paris['food'] == 3 * 1200 * 1.5
+    assert paris['transport'] == 3 * 400 * 1.5
+    assert paris['distance_km'] == 0  # first stop: no inbound leg
+    assert rome['distance_km'] == pytest.approx(PARIS_ROME_KM, abs=1)
+    assert rome['transport'] == pytest.approx(3 * 400 * 1.3 + rome['distance_km'] * 6, abs=1)
+    assert body['forecast']['total'] == pytest.approx(paris['total'] + rome['total'], abs=0.02)
+
+
+def test_activities_are_counted(client, trip):
+    client.post(f"/api/stops/{trip['stops'][0]['id']}/activities", json={'activity_id': 1, 'day_number': 1})
+    paris = forecast(client, trip)['forecast']['stops'][0]
+    assert paris['activities'] == 1700
+    assert paris['transport'] == (3 * 400 + 3 * 50) * 1.5
+
+
+def test_scenarios(client, trip, cities):
+    paris, rome = (stop['id'] for stop in trip['stops'])
+    body = forecast(
+        client, trip,
+        {'name': 'swap', 'swap': [paris, rome]},
+        {'name': 'longer', 'add_nights': {str(paris): 2}},
+        {'name': 'fixed', 'nights': {str(rome): 1}},
+        {'name': 'rome twice', 'cities': {str(paris): cities['Rome']}},
+        {'name': 'order', 'order': [rome, paris]},
+    )
+    base = body['forecast']
+    swap, longer, fixed, rome_twice, order = body['scenarios']
+    assert [scenario['name'] for scenario in body['scenarios']] == ['swap', 'longer', 'fixed', 'rome twice', 'order']
+
+    assert [stop['stop_id'] for stop in swap['stops']] == [rome, paris]
+    assert swap['stops'] == order['stops']
+    assert swap['totals']['accommodation'] == base['totals']['accommodation']
+
+    assert longer['stops'][0]['nights'] == 5
+    assert longer['difference'] == pytest.approx(2 * (3000 + 1200 + 400) * 1.5, abs=0.02)
+    assert fixed['stops'][1]['accommodation'] == 3000 * 1.3
+
+    assert rome_twice['stops'][0]['city_id'] == cities['Rome']
+    assert rome_twice['stops'][1]['distance_km'] == 0
+    assert rome_twice['difference'] < 0
+
+
+def test_shift_days_follows_month_factors(app, client, trip, monkeypatch):
+    factors = [1.0] * 12
+    factors[5] = 2.0  # June
+    monkeypatch.setitem(app.config, 'FORECAST_MONTH_FACTORS', factors)
+    paris, rome = (stop['id'] for stop in trip['stops'])
+
+    body = forecast(client, trip, {'shift_days': 31}, {'shift_days': {str(rome): 27}}, {'shift_days': -400})
+    june, straddling, last_year = body['scenarios']
+    assert june['stops'][0]['start_date'] == '2026-06-01'
+    assert june['totals']['accommodation'] == 2 * body['forecast']['totals']['accommodation']
+    assert june['totals']['food'] == body['forecast']['totals']['food']
+    # Rome moves to May 31 - June 3: one May night and two June nights
+    assert straddling['stops'][1]['accommodation'] == pytest.approx(3000 * 1.3 * 5, abs=0.02)
+    assert last_year['stops'][0]['start_date'] == (date(2026, 5, 1) - timedelta(days=400)).isoformat()
+    assert last_year['difference'] == 0
+
+
+def test_without_scenario_stops(client, trip):
+    body = forecast(client, trip, {'add_nights': {str(trip['stops'][0]['id']): 1}}, include_stops=False)
+    assert 'stops' in body['forecast']
+    assert 'stops' not in body['scenarios'][0]
+
+
+@pytest.mark.parametrize('scenarios, message, index', [
+    ({'swap': []}, 'scenarios must be a list', None),
+    ([{'swpa': [1, 2]}], "unknown scenario key 'swpa'", 0),
+    ([{}, 'swap'], 'each scenario must be an object', 1),
+    ([{'nights': {'999': 2}}], 'Stop 999 not found in this trip', 0),
+    ([{'nights': {'{paris}': -1}}], 'nights cannot be negative', 0),
+    ([{'nights': ['{paris}']}], 'nights must map stop ids to values', 0),
+    ([{}, {'add_nights': {'{paris}': 'two'}}], 'add_nights must be integers', 1),
+    ([{'cities': {'{paris}': 999}}], 'City 999 not found', 0),
+    ([{'cities': {'{paris}': 'Rome'}}], 'city ids must be integers', 0),
+    ([{'order': ['{paris}']}], 'order must list every stop of the trip once', 0),
+    ([{'swap': ['{paris}']}], 'swap must be a pair of stop ids', 0),
+    ([{'shift_days': 'soon'}], 'shift_days must be integers', 0),
+    ([{'shift_days': MAX_SHIFT_DAYS + 1}], f'shift_days cannot move a stop more than {MAX_SHIFT_DAYS} days', 0),
+])
+def test_invalid_scenarios(client, trip, scenarios, message, index):
+    scenarios = with_stop(scenarios, trip['stops'][0]['id'])
+    response = client.post(f"/api/trips/{trip['id']}/budget/forecast", json={'scenarios': scenarios})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == message
+    assert response.get_json().get('scenario_index') == index
+
+
+def test_scenario_limit(app, client, trip, monkeypatch):
+    monkeypatch.setitem(app.config, 'FORECAST_MAX_SCENARIOS', 3)
+    response = client.post(f"/api/trips/{trip['id']}/budget/forecast", json={'scenarios': [{}] * 4})
+    assert response.status_code == 400
+    assert forecast(client, trip, *[{}] * 3)['scenarios'][2]['difference'] == 0
+
+
+def test_month_factors():
+    factors = np.arange(1, 13, dtype=np.float64)  # January = 1 ... December = 12
+    start = np.array([[date(2026, 1, 30).toordinal(), date(2026, 12, 31).toordinal()]])
+    nights = np.array([[4, 0]])
+    # Jan 30, Jan 31, Feb 1, Feb 2; a day trip on Dec 31
+    assert month_factors(start, nights, factors).tolist() == [[1.5, 12.0]]
+    assert month_factors(np.zeros((2, 0), dtype=np.int64), np.zeros((2, 0), dtype=np.int64), factors).shape == (2, 0)
+
+
+def test_leg_distances():
+    latitude = np.array([[48.8566, 41.9028, np.nan]])
+    longitude = np.array([[2.3522, 12.4964, 0.0]])
+    distances = leg_distances(latitude, longitude)
+    assert distances[0, 0] == pytest.approx(PARIS_ROME_KM, abs=1)
+    assert np.isnan(distances[0, 1])
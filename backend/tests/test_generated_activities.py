@@ -0,0 +1,111 @@
+"""AI-generated activities: one INSERT ... ON CONFLICT DO NOTHING per batch"""
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+import app as app_module
+from app import save_generated_activities
+from migrations import _add_activity_name_keys
+from models import Activity
+
+SUGGESTIONS = [
+    {'name': 'Louvre  museum', 'estimated_cost': 99},
+    {'name': 'Eiffel Tower', 'category': 'sightseeing', 'estimated_cost': 2500},
+    {'name': 'eiffel tower ', 'estimated_cost': 1},
+    {'name': 'Catacombs', 'category': 'adventure', 'duration_hours': 1.5},
+    'not an activity',
+]
+
+
+@pytest.fixture
+def suggestions(monkeypatch):
+    """Make groq_service.suggest_activities return SUGGESTIONS, counting calls"""
+    calls = []
+
+    def suggest_activities(city, interests, budget_per_activity=None):
+        calls.append(city)
+        return {'activities': SUGGESTIONS}
+
+    monkeypatch.setattr(app_module.groq_service, 'suggest_activities', suggest_activities)
+    return calls
+
+
+def paris_activities(cities):
+    return {activity.name: activity for activity in Activity.query.filter_by(city_id=cities['Paris'])}
+
+
+def test_one_statement_skips_existing_names(database, cities):
+    inserts = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('INSERT'):
+            inserts.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        assert save_generated_activities(cities['Paris'], SUGGESTIONS) == 2
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+    assert len(inserts) == 1 and 'ON CONFLICT' in inserts[0].upper()
+
+    activities = paris_activities(cities)
+    assert set(activities) == {'Louvre Museum', 'Seine Cruise', 'Eiffel Tower', 'Catacombs'}
+    # Existing rows are left alone; the first of two clashing suggestions wins
+    assert activities['Louvre Museum'].estimated_cost == 1700
+    assert activities['Eiffel Tower'].estimated_cost == 2500
+    assert (activities['Catacombs'].estimated_cost, activities['Catacombs'].duration_hours) == (1000, 1.5)
+
+    assert save_generated_activities(cities['Paris'], SUGGESTIONS) == 0
+    assert save_generated_activities(cities['Rome'], SUGGESTIONS) == 3
+    assert save_generated_activities(cities['Rome'], []) == 0
+
+
+def test_unique_city_and_name_key(database, cities):
+    database.session.add(Activity(city_id=cities['Paris'], name='SEINE cruise'))
+    with pytest.raises(IntegrityError):
+        database.session.commit()
+    database.session.rollback()
+    database.session.add(Activity(city_id=cities['Rome'], name='SEINE cruise'))
+    database.session.commit()
+
+
+def test_refresh_endpoint_is_idempotent(client, user, cities, suggestions):
+    url = f"/api/cities/{cities['Paris']}/activities/refresh"
+    response = client.post(url, json={})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['new_activities_added'], body['total_activities']) == (2, 4)
+
+    body = client.post(url, json={}).get_json()
+    assert (body['new_activities_added'], body['total_activities']) == (0, 4)
+    assert suggestions == ['Paris', 'Paris']
+
+
+def test_browse_generates_for_empty_city(client, user, cities, database, suggestions):
+    Activity.query.filter_by(city_id=cities['Rome']).delete()
+    database.session.commit()
+
+    response = client.get(f"/api/cities/{cities['Rome']}/activities")
+    assert response.status_code == 200
+    assert response.get_json()['pagination']['total'] == 3
+    response = client.get(f"/api/activities/search?city_id={cities['Rome']}&q=tower")
+    assert [activity['name'] for activity in response.get_json()['activities']] == ['Eiffel Tower']
+    assert suggestions == ['Rome']
+
+
+def test_name_key_migration_merges_duplicates(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE activities (id INTEGER PRIMARY KEY, city_id INTEGER, name VARCHAR(200))'))
+        conn.execute(text('CREATE TABLE itinerary_activities (id INTEGER PRIMARY KEY, activity_id INTEGER)'))
+        conn.execute(text("INSERT INTO activities VALUES (1, 1, 'Louvre'), (2, 1, ' louvre'), (3, 2, 'Louvre')"))
+        conn.execute(text('INSERT INTO itinerary_activities VALUES (1, 2)'))
+        _add_activity_name_keys(conn)
+
+        assert conn.execute(text('SELECT id, name_key FROM activities ORDER BY id')).all() == [(1, 'louvre'), (3, 'louvre')]
+        assert conn.execute(text('SELECT activity_id FROM itinerary_activities')).scalar() == 1
+        with pytest.raises(IntegrityError):
+            conn.execute(text("INSERT INTO activities (city_id, name, name_key) VALUES (2, 'LOUVRE', 'louvre')"))
+    engine.dispose()
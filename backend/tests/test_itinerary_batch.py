@@ -0,0 +1,124 @@
+"""PATCH /api/trips/<id>/itinerary batches"""
+
+import pytest
+
+from models import ItineraryActivity, Stop
+
+
+def patch(client, trip, *operations):
+    return client.patch(f"/api/trips/{trip['id']}/itinerary", json={'operations': list(operations)})
+
+
+def stop_cities(client, trip):
+    stops = client.get(f"/api/trips/{trip['id']}").get_json()['trip']['stops']
+    return [(stop['order_index'], stop['city']['name']) for stop in stops]
+
+
+def query_count(response):
+    timing = response.headers.get('Server-Timing', '')
+    return int(timing.split('desc="', 1)[1].split(' queries', 1)[0])
+
+
+def test_batch_with_refs(client, trip, cities):
+    paris, rome = trip['stops']
+    response = patch(
+        client, trip,
+        {'op': 'add_stop', 'ref': 'nice', 'city_id': cities['Paris'], 'start_date': '2026-05-07',
+         'end_date': '2026-05-09', 'order_index': 2},
+        {'op': 'add_activity', 'ref': 'cruise', 'stop_id': 'nice', 'activity_id': 2, 'day_number': 2},
+        {'op': 'add_activity', 'stop_id': paris['id'], 'activity_id': 1, 'time_of_day': 'evening'},
+        {'op': 'move_stop', 'stop_id': rome['id'], 'order_index': 1},
+        {'op': 'update_stop', 'stop_id': paris['id'], 'notes': 'Book the Louvre'},
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    created = body['created']
+    assert set(created) == {'nice', 'cruise'}
+    assert [stop['id'] for stop in body['trip']['stops']] == [rome['id'], paris['id'], created['nice']]
+    assert body['trip']['stops'][1]['notes'] == 'Book the Louvre'
+    assert body['trip']['stops'][2]['activities'][0]['id'] == created['cruise']
+    assert body['trip']['stops'][2]['activities'][0]['day_number'] == 2
+    assert stop_cities(client, trip) == [(1, 'Rome'), (2, 'Paris'), (3, 'Paris')]
+
+
+def test_ref_removed_later_in_batch(client, database, trip, cities):
+    response = patch(
+        client, trip,
+        {'op': 'add_stop', 'ref': 'extra', 'city_id': cities['Rome'], 'start_date': '2026-05-07', 'end_date': '2026-05-08'},
+        {'op': 'add_activity', 'stop_id': 'extra', 'activity_id': 3},
+        {'op': 'remove_stop', 'stop_id': 'extra'},
+    )
+    assert response.status_code == 200
+    assert response.get_json()['created'] == {}
+    assert database.session.query(Stop).count() == 2
+    assert database.session.query(ItineraryActivity).count() == 0
+
+
+def test_failed_operation_rolls_back_the_batch(client, database, trip, cities):
+    paris, rome = trip['stops']
+    response = patch(
+        client, trip,
+        {'op': 'update_stop', 'stop_id': paris['id'], 'notes': 'changed'},
+        {'op': 'add_activity', 'stop_id': rome['id'], 'activity_id': 3},
+        {'op': 'remove_activity', 'itinerary_activity_id': 999},
+    )
+    assert response.status_code == 404
+    assert response.get_json()['operation_index'] == 2
+
+    assert database.session.get(Stop, paris['id']).notes == ''
+    assert database.session.query(ItineraryActivity).count() == 0
+
+
+@pytest.mark.parametrize('operation, status, index', [
+    ({'op': 'explode'}, 400, 1),
+    ({'op': 'add_stop', 'city_id': [1], 'start_date': '2026-05-07', 'end_date': '2026-05-08'}, 400, 1),
+    ({'op': 'add_stop', 'city_id': '1', 'start_date': '2026-05-07', 'end_date': '2026-05-08'}, 400, 1),
+    ({'op': 'add_stop', 'city_id': True, 'start_date': '2026-05-07', 'end_date': '2026-05-08'}, 400, 1),
+    ({'op': 'add_stop', 'city_id': 999, 'start_date': '2026-05-07', 'end_date': '2026-05-08'}, 404, 1),
+    ({'op': 'add_stop', 'city_id': 1, 'start_date': 'May 7', 'end_date': '2026-05-08'}, 400, 1),
+    ({'op': 'add_activity', 'stop_id': 'nowhere', 'activity_id': 1}, 404, 1),
+    ({'op': 'add_activity', 'stop_id': {'id': 1}, 'activity_id': 1}, 400, 1),
+    ({'op': 'remove_activity', 'itinerary_activity_id': [1, 2]}, 400, 1),
+    ({'op': 'move_stop', 'stop_id': 999, 'order_index': 1}, 404, 1),
+])
+def test_invalid_operations(client, trip, operation, status, index):
+    first = {'op': 'update_stop', 'stop_id': trip['stops'][0]['id'], 'notes': 'kept?'}
+    if type(operation.get('city_id')) is int and operation['city_id'] == 1:
+        operation = {**operation, 'city_id': trip['stops'][0]['city_id']}
+    response = patch(client, trip, first, operation)
+    assert response.status_code == status
+    assert response.get_json()['operation_index'] == index
+    assert client.get(f"/api/trips/{trip['id']}").get_json()['trip']['stops'][0]['notes'] == ''
+
+
+def test_invalid_batches(client, trip):
+    assert patch(client, trip).status_code == 400
+    assert patch(client, trip, 'add_stop').status_code == 400
+    response = client.patch(f"/api/trips/{trip['id']}/itinerary", json={'operations': {'op': 'remove_stop'}})
+    assert response.status_code == 400
+
+
+def test_other_users_trip(client, trip):
+    client.post('/api/auth/logout')
+    client.post('/api/auth/register', json={'email': 'bo@example.com', 'password': 'secret', 'name': 'Bo'})
+    response = patch(client, trip, {'op': 'remove_stop', 'stop_id': trip['stops'][0]['id']})
+    assert response.status_code == 403
+    assert len(trip['stops']) == 2
+
+
+def test_response_queries_do_not_grow_with_stops(app, client, trip, cities, monkeypatch):
+    monkeypatch.setitem(app.config, 'SQL_TIMING_HEADERS', True)
+    operation = {'op': 'update_stop', 'stop_id': trip['stops'][0]['id'], 'notes': 'n'}
+    before = query_count(patch(client, trip, operation))
+
+    patch(client, trip, *(
+        {'op': 'add_stop', 'city_id': cities['Rome'], 'start_date': '2026-05-07', 'end_date': '2026-05-08'}
+        for _ in range(6)
+    ))
+    stops = client.get(f"/api/trips/{trip['id']}").get_json()['trip']['stops']
+    patch(client, trip, *({'op': 'add_activity', 'stop_id': stop['id'], 'activity_id': 3} for stop in stops))
+
+    response = patch(client, trip, operation)
+    assert response.status_code == 200
+    assert len(response.get_json()['trip']['stops']) == 8
+    assert query_count(response) <= before
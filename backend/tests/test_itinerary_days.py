@@ -0,0 +1,69 @@
+"""Per-day AI itinerary storage and ?itinerary_days= selections"""
+
+import time
+
+import pytest
+
+from app import MAX_ITINERARY_DAY, parse_day_numbers
+from models import Trip
+
+ITINERARY = {
+    'summary': 'Paris and Rome',
+    'days': [{'day': number, 'title': f'Day {number}', 'activities': []} for number in range(1, 7)],
+    'budget_breakdown': {'total': 9000},
+}
+
+
+@pytest.fixture
+def planned_trip(database, trip):
+    stored = database.session.get(Trip, trip['id'])
+    stored.set_ai_itinerary(ITINERARY)
+    database.session.commit()
+    return trip
+
+
+def test_parse_day_numbers():
+    assert parse_day_numbers(None) is None
+    assert parse_day_numbers('') is None
+    assert parse_day_numbers('3, 1-2,2') == [1, 2, 3]
+    assert parse_day_numbers('5-5') == [5]
+
+
+def test_parse_day_numbers_clamps_long_ranges():
+    started = time.perf_counter()
+    assert parse_day_numbers('1-999999999') == list(range(1, MAX_ITINERARY_DAY + 1))
+    assert parse_day_numbers('400-999999999,2') == [2]
+    assert parse_day_numbers('999999999') == []
+    assert time.perf_counter() - started < 1
+
+
+@pytest.mark.parametrize('value', ['0', '-3', '1--3', '3-1', 'a', '1-b', '1.5', '1-2-3', ','.join(['1'] * 51)])
+def test_parse_day_numbers_rejects(value):
+    with pytest.raises(ValueError, match='itinerary_days'):
+        parse_day_numbers(value)
+
+
+def test_get_trip_selects_days(client, planned_trip):
+    response = client.get(f"/api/trips/{planned_trip['id']}?itinerary_days=2-3,6")
+    assert response.status_code == 200
+    itinerary = response.get_json()['trip']['ai_itinerary']
+    assert [day['day'] for day in itinerary['days']] == [2, 3, 6]
+    assert itinerary['summary'] == 'Paris and Rome'
+
+    response = client.get(f"/api/trips/{planned_trip['id']}")
+    assert [day['day'] for day in response.get_json()['trip']['ai_itinerary']['days']] == [1, 2, 3, 4, 5, 6]
+
+
+def test_shared_trip_bad_day_selection(client, planned_trip):
+    response = client.put(f"/api/trips/{planned_trip['id']}", json={'is_public': True})
+    share_code = response.get_json()['trip']['share_code']
+    client.post('/api/auth/logout')
+
+    response = client.get(f'/api/trips/shared/{share_code}?itinerary_days=5-1000000000')
+    assert response.status_code == 200
+    assert [day['day'] for day in response.get_json()['trip']['ai_itinerary']['days']] == [5, 6]
+
+    for value in ('4-2', '-1', '1,x'):
+        response = client.get(f'/api/trips/shared/{share_code}?itinerary_days={value}')
+        assert response.status_code == 400
+        assert 'itinerary_days' in response.get_json()['error']
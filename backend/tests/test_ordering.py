@@ -0,0 +1,131 @@
+"""Fractional stop sort keys (ordering.py) and stop moves through the API"""
+
+import random
+
+import pytest
+
+import app as app_module
+from models import Stop
+from ordering import (
+    DIGITS, REBALANCE_KEY_LENGTH, key_between, key_for_position, needs_rebalance, rebalance_trip_stops, spread_keys
+)
+
+
+def test_key_between_bounds():
+    assert key_between(None, None) == 'V'
+    assert key_between(None, 'U') < 'U'
+    assert key_between('U', None) > 'U'
+    assert 'A' < key_between('A', 'B') < 'B'
+    assert '0' < key_between('0', '01') < '01'
+    assert 'z' < key_between('z', None)
+    with pytest.raises(ValueError):
+        key_between('B', 'A')
+
+
+def test_key_between_random_pairs():
+    rng = random.Random(5)
+    keys = spread_keys(10)
+    for _ in range(2000):
+        keys.sort()
+        index = rng.randrange(len(keys) + 1)
+        lower = keys[index - 1] if index else None
+        upper = keys[index] if index < len(keys) else None
+        key = key_between(lower, upper)
+        assert (lower is None or lower < key) and (upper is None or key < upper)
+        assert not key.endswith('0')
+        keys.append(key)
+    assert len(set(keys)) == len(keys)
+
+
+def test_spread_keys():
+    for count in (0, 1, 2, 61, 62, 100, 5000):
+        keys = spread_keys(count)
+        assert len(keys) == count
+        assert keys == sorted(keys) and len(set(keys)) == count
+        assert all(key and not key.endswith('0') and set(key) <= set(DIGITS) for key in keys)
+    assert max(len(key) for key in spread_keys(61)) == 1
+    assert max(len(key) for key in spread_keys(3000)) == 2
+
+
+def test_key_for_position():
+    keys = ['F', 'K', 'P']
+    assert key_for_position(keys, 1) < 'F'
+    assert 'F' < key_for_position(keys, 2) < 'K'
+    assert key_for_position(keys, 4) > 'P'
+    assert key_for_position(keys, 99) > 'P'
+    assert key_for_position(keys, -3) < 'F'
+    assert key_for_position([], 1) == 'V'
+
+
+def test_repeated_inserts_need_rebalancing():
+    keys = ['U', 'V']
+    for _ in range(200):
+        keys.insert(1, key_between(keys[0], keys[1]))
+    assert keys == sorted(keys)
+    assert needs_rebalance(keys[1])
+    assert not needs_rebalance('U' * REBALANCE_KEY_LENGTH)
+    assert not needs_rebalance(None)
+
+
+def test_rebalance_trip_stops(database, trip):
+    stops = database.session.query(Stop).filter_by(trip_id=trip['id']).all()
+    stops[0].sort_key, stops[1].sort_key = 'U' + 'z' * 40, 'U' + 'y' * 40
+    database.session.commit()
+
+    assert rebalance_trip_stops(trip['id']) == 2
+    database.session.commit()
+    rebalanced = database.session.query(Stop).filter_by(trip_id=trip['id']).order_by(Stop.sort_key).all()
+    assert [stop.id for stop in rebalanced] == [stops[1].id, stops[0].id]
+    assert [stop.sort_key for stop in rebalanced] == spread_keys(2)
+    assert [stop.order_index for stop in rebalanced] == [1, 2]
+
+
+def test_inserting_and_moving_stops(client, database, trip, cities, monkeypatch):
+    scheduled = []
+    schedule = app_module.schedule_rebalance
+
+    def rebalance_now(trip_id):
+        schedule(trip_id).join()
+        scheduled.append(trip_id)
+
+    monkeypatch.setattr(app_module, 'schedule_rebalance', rebalance_now)
+    paris, rome = trip['stops']
+    url = f"/api/trips/{trip['id']}/stops"
+    # Neighbours with no short key between them, so the first insert needs a rebalance
+    database.session.get(Stop, paris['id']).sort_key = 'U'
+    database.session.get(Stop, rome['id']).sort_key = 'U' + '0' * (REBALANCE_KEY_LENGTH - 2) + '1'
+    database.session.commit()
+
+    # Always insert second: each new stop goes between the first stop and the last insert
+    for number in range(1, 31):
+        response = client.post(url, json={'city_id': cities['Rome'], 'start_date': '2026-05-04',
+                                          'end_date': '2026-05-05', 'notes': str(number), 'order_index': 2})
+        assert response.status_code == 201
+        assert response.get_json()['stop']['order_index'] == 2
+    assert scheduled and set(scheduled) == {trip['id']}
+
+    stops = client.get(f"/api/trips/{trip['id']}").get_json()['trip']['stops']
+    assert [stop['order_index'] for stop in stops] == list(range(1, 33))
+    assert [stop['notes'] for stop in stops[1:31]] == [str(number) for number in range(30, 0, -1)]
+    assert (stops[0]['id'], stops[-1]['id']) == (paris['id'], rome['id'])
+
+    response = client.put(f"/api/stops/{rome['id']}", json={'order_index': 1})
+    assert response.status_code == 200
+    assert response.get_json()['stop']['order_index'] == 1
+    stops = client.get(f"/api/trips/{trip['id']}").get_json()['trip']['stops']
+    assert [stop['id'] for stop in stops[:2]] == [rome['id'], paris['id']]
+
+    response = client.put(f"/api/stops/{rome['id']}", json={'order_index': 'first'})
+    assert response.status_code == 400
+
+
+def test_rebalance_stops_command(app, database, trip):
+    stop = database.session.query(Stop).filter_by(trip_id=trip['id']).first()
+    stop.sort_key = 'A' * (REBALANCE_KEY_LENGTH + 1)
+    database.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['rebalance-stops'])
+    assert result.exit_code == 0, result.output
+    assert 'Rebalanced stops of 1 trip(s).' in result.output
+    database.session.expire_all()
+    assert database.session.query(Stop).filter_by(trip_id=trip['id']).order_by(Stop.sort_key).first().sort_key == spread_keys(2)[0]
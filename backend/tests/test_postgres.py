@@ -0,0 +1,351 @@
+"""
+PostgreSQL integration tests: schema migrations, trigram search, JSONB
+columns and the engine options.
+
+Skipped unless DATABASE_URL points at PostgreSQL:
+
+    DATABASE_URL=postgresql://postgres@localhost/globetrotter_test python -m pytest backend/tests
+
+(conftest.py moves that URL to TEST_POSTGRES_URL and gives the app tests
+a scratch SQLite database.) Each test works in a schema of its own,
+dropped afterwards, so existing tables in the database are left alone.
+The role needs CREATE on the database and permission to create the
+pg_trgm extension.
+"""
+
+import json
+import os
+import uuid
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import NullPool
+
+from config import Config
+from database import build_engine_options, icontains
+from migrations import LATEST_VERSION, _current_version, get_schema_version, run_migrations
+from models import db, City, Trip, User
+
+DATABASE_URL = os.getenv('TEST_POSTGRES_URL', '').replace('postgres://', 'postgresql://', 1)
+STATEMENT_TIMEOUT_MS = 1500
+
+pytestmark = pytest.mark.skipif(
+    not DATABASE_URL.startswith('postgresql'), reason='set DATABASE_URL=postgresql://... to run'
+)
+
+# Tables as created by the original init_db.sql, plus the trips.ai_itinerary
+# TEXT column that db.create_all() added before the migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(120) UNIQUE NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    photo_url VARCHAR(255),
+    language_preference VARCHAR(10) DEFAULT 'en',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE cities (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    country VARCHAR(100) NOT NULL,
+    region VARCHAR(100),
+    description TEXT,
+    cost_index FLOAT DEFAULT 1.0,
+    popularity_score INTEGER DEFAULT 0,
+    latitude FLOAT,
+    longitude FLOAT,
+    image_url VARCHAR(255)
+);
+CREATE TABLE activities (
+    id SERIAL PRIMARY KEY,
+    city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
+    name VARCHAR(200) NOT NULL,
+    description TEXT,
+    category VARCHAR(50),
+    estimated_cost FLOAT DEFAULT 0.0,
+    duration_hours FLOAT DEFAULT 2.0,
+    image_url VARCHAR(255)
+);
+CREATE TABLE trips (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name VARCHAR(200) NOT NULL,
+    description TEXT,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    cover_photo_url VARCHAR(255),
+    is_public BOOLEAN DEFAULT FALSE,
+    share_code VARCHAR(50) UNIQUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ai_itinerary TEXT
+);
+CREATE TABLE stops (
+    id SERIAL PRIMARY KEY,
+    trip_id INTEGER NOT NULL REFERENCES trips(id) ON DELETE CASCADE,
+    city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
+    order_index INTEGER NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    notes TEXT
+);
+CREATE TABLE itinerary_activities (
+    id SERIAL PRIMARY KEY,
+    stop_id INTEGER NOT NULL REFERENCES stops(id) ON DELETE CASCADE,
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    day_number INTEGER NOT NULL,
+    time_of_day VARCHAR(20),
+    custom_notes TEXT,
+    estimated_cost_override FLOAT
+);
+CREATE TABLE budgets (
+    id SERIAL PRIMARY KEY,
+    trip_id INTEGER NOT NULL REFERENCES trips(id) ON DELETE CASCADE,
+    total_budget FLOAT DEFAULT 0.0,
+    transport_cost FLOAT DEFAULT 0.0,
+    accommodation_cost FLOAT DEFAULT 0.0,
+    food_cost FLOAT DEFAULT 0.0,
+    activities_cost FLOAT DEFAULT 0.0,
+    misc_cost FLOAT DEFAULT 0.0,
+    currency VARCHAR(10) DEFAULT 'USD'
+);
+CREATE TABLE saved_destinations (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    city_id INTEGER NOT NULL REFERENCES cities(id) ON DELETE CASCADE,
+    saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, city_id)
+);
+CREATE INDEX idx_trips_user_id ON trips(user_id);
+CREATE INDEX idx_trips_share_code ON trips(share_code);
+CREATE INDEX idx_stops_trip_id ON stops(trip_id);
+CREATE INDEX idx_activities_city_id ON activities(city_id);
+CREATE INDEX idx_itinerary_activities_stop_id ON itinerary_activities(stop_id);
+CREATE INDEX idx_saved_destinations_user_id ON saved_destinations(user_id);
+"""
+
+LEGACY_ITINERARY = {
+    'summary': 'Three days in Paris',
+    'days': [
+        {'day': 1, 'title': 'Arrival', 'activities': [{'name': 'Louvre', 'cost': 1700}], 'accommodation': {'cost': 4000}},
+        {'day': 2, 'title': 'Montmartre', 'activities': [], 'meals': [{'name': 'Bistro', 'cost': '₹900'}]},
+    ],
+    'budget_breakdown': {'total': '₹12,000'},
+}
+
+
+def make_config(**overrides):
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    config.update(SQLALCHEMY_DATABASE_URI=DATABASE_URL, SQLALCHEMY_ENGINE_OPTIONS={},
+                  DB_STATEMENT_TIMEOUT_MS=STATEMENT_TIMEOUT_MS, **overrides)
+    return config
+
+
+@pytest.fixture
+def engine():
+    """An engine on the app's options whose connections use a new, empty schema"""
+    schema = f'globetrotter_test_{uuid.uuid4().hex[:12]}'
+    options = build_engine_options(make_config(DB_POOL_SIZE=2, DB_MAX_OVERFLOW=0))
+    options['connect_args']['options'] += f' -c search_path={schema},public'
+    engine = create_engine(DATABASE_URL, **options)
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE SCHEMA {schema}'))
+    # Migration state is cached per URL, which every test shares
+    _current_version.clear()
+    yield engine
+    _current_version.clear()
+    engine.dispose()
+    cleanup = create_engine(DATABASE_URL, poolclass=NullPool)
+    with cleanup.begin() as conn:
+        conn.execute(text(f'DROP SCHEMA {schema} CASCADE'))
+    cleanup.dispose()
+
+
+@pytest.fixture
+def migrated(engine):
+    db.metadata.create_all(engine)
+    run_migrations(engine)
+    return engine
+
+
+def column_info(conn, table, column):
+    return conn.execute(text(
+        "SELECT data_type, collation_name, is_nullable FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+    ), {'table': table, 'column': column}).one()
+
+
+def assert_current_schema(engine):
+    with engine.connect() as conn:
+        assert column_info(conn, 'stops', 'sort_key').collation_name == 'C'
+        assert column_info(conn, 'activities', 'name_key').is_nullable == 'NO'
+        assert column_info(conn, 'trips', 'ai_itinerary_meta').data_type == 'jsonb'
+        assert column_info(conn, 'itinerary_days', 'payload').data_type == 'jsonb'
+        indexes = set(conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()"
+        )).scalars())
+    assert {
+        'idx_cities_name_trgm', 'idx_activities_name_trgm', 'idx_stops_trip_sort_key', 'uq_activities_city_name_key'
+    } <= indexes
+    assert 'idx_activities_city_name' not in indexes
+    assert 'idx_stops_trip_order' not in indexes
+
+
+def test_migrations_on_a_fresh_schema(engine):
+    db.metadata.create_all(engine)
+
+    assert run_migrations(engine) == list(range(1, LATEST_VERSION + 1))
+    assert get_schema_version(engine) == LATEST_VERSION
+    assert_current_schema(engine)
+
+    # Recorded versions are not applied again
+    _current_version.clear()
+    assert run_migrations(engine) == []
+
+
+def test_migrations_on_the_baseline_schema(engine):
+    with engine.begin() as conn:
+        conn.execute(text(BASELINE_SCHEMA))
+        user_id = conn.execute(text(
+            "INSERT INTO users (email, password_hash, name) VALUES ('a@example.com', 'x', 'A') RETURNING id"
+        )).scalar()
+        city_id = conn.execute(text(
+            "INSERT INTO cities (name, country) VALUES ('Paris', 'France') RETURNING id"
+        )).scalar()
+        louvre, duplicate, eiffel = (conn.execute(text(
+            "INSERT INTO activities (city_id, name) VALUES (:city_id, :name) RETURNING id"
+        ), {'city_id': city_id, 'name': name}).scalar() for name in ('Louvre Museum', ' louvre  MUSEUM', 'Eiffel Tower'))
+        trip_id = conn.execute(text(
+            "INSERT INTO trips (user_id, name, start_date, end_date, ai_itinerary) "
+            "VALUES (:user_id, 'Paris', '2026-01-01', '2026-01-04', :itinerary) RETURNING id"
+        ), {'user_id': user_id, 'itinerary': json.dumps(LEGACY_ITINERARY)}).scalar()
+        # Inserted out of order: the migrated sort keys must follow order_index
+        stops = {
+            order_index: conn.execute(text(
+                "INSERT INTO stops (trip_id, city_id, order_index, start_date, end_date) "
+                "VALUES (:trip_id, :city_id, :order_index, '2026-01-01', '2026-01-02') RETURNING id"
+            ), {'trip_id': trip_id, 'city_id': city_id, 'order_index': order_index}).scalar()
+            for order_index in (3, 1, 2)
+        }
+        conn.execute(text(
+            "INSERT INTO itinerary_activities (stop_id, activity_id, day_number) VALUES (:stop_id, :activity_id, 1)"
+        ), {'stop_id': stops[1], 'activity_id': duplicate})
+
+    assert run_migrations(engine) == list(range(1, LATEST_VERSION + 1))
+    assert_current_schema(engine)
+
+    with engine.connect() as conn:
+        stop_order = conn.execute(text(
+            "SELECT id FROM stops WHERE trip_id = :trip_id ORDER BY sort_key"
+        ), {'trip_id': trip_id}).scalars().all()
+        assert stop_order == [stops[1], stops[2], stops[3]]
+
+        # Duplicate activity names merged into the oldest row
+        names = conn.execute(text("SELECT id, name_key FROM activities ORDER BY id")).all()
+        assert names == [(louvre, 'louvre museum'), (eiffel, 'eiffel tower')]
+        assert conn.execute(text("SELECT activity_id FROM itinerary_activities")).scalar() == louvre
+
+        # The legacy itinerary is split into day rows and summary columns
+        trip = conn.execute(text(
+            "SELECT ai_itinerary, ai_itinerary_meta, ai_day_count, ai_total_cost, version FROM trips"
+        )).one()
+        assert trip.ai_itinerary is None
+        assert trip.ai_itinerary_meta == {'summary': 'Three days in Paris', 'budget_breakdown': {'total': '₹12,000'}}
+        assert (trip.ai_day_count, trip.ai_total_cost, trip.version) == (2, 12000.0, 1)
+        days = conn.execute(text(
+            "SELECT day_number, title, day_cost, payload ->> 'title' FROM itinerary_days ORDER BY day_number"
+        )).all()
+        assert days == [(1, 'Arrival', 5700.0, 'Arrival'), (2, 'Montmartre', 900.0, 'Montmartre')]
+        assert conn.execute(text("SELECT sync_seq FROM users")).scalar() == 0
+
+
+def test_trigram_search(migrated):
+    cities = City.__table__
+    with migrated.begin() as conn:
+        conn.execute(cities.insert(), [
+            {'name': 'Paris', 'country': 'France'},
+            {'name': 'Parma', 'country': 'Italy'},
+            {'name': '100% Pure', 'country': 'New Zealand'},
+        ])
+
+        def search(term):
+            return conn.execute(select(City.name).where(icontains(City.name, term)).order_by(City.name)).scalars().all()
+
+        assert search('PAR') == ['Paris', 'Parma']
+        assert search('0% p') == ['100% Pure']
+        assert search('_') == []
+
+        # Force the planner's hand on a table this small
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = '\n'.join(conn.execute(text(
+            "EXPLAIN SELECT id FROM cities WHERE name ILIKE :term"
+        ), {'term': '%aris%'}).scalars())
+    assert 'idx_cities_name_trgm' in plan
+
+
+def test_json_text_round_trip(migrated):
+    document = {'summary': 'Five days', 'tips': ['Carry cash', 'Book ahead'], 'budget_breakdown': {'total': 1200.5}}
+    trips = Trip.__table__
+    with migrated.begin() as conn:
+        user_id = conn.execute(User.__table__.insert().values(
+            email='b@example.com', password_hash='x', name='B'
+        ).returning(User.id)).scalar()
+        values = {'user_id': user_id, 'name': 'Trip', 'start_date': date(2026, 1, 1), 'end_date': date(2026, 1, 5)}
+        with_document = conn.execute(trips.insert().values(
+            ai_itinerary_meta=json.dumps(document), **values
+        ).returning(Trip.id)).scalar()
+        without = conn.execute(trips.insert().values(ai_itinerary_meta=None, **values).returning(Trip.id)).scalar()
+
+    with migrated.connect() as conn:
+        stored = conn.execute(select(Trip.ai_itinerary_meta).where(Trip.id == with_document)).scalar()
+        assert isinstance(stored, str)
+        assert json.loads(stored) == document
+
+        # Stored as a JSONB document (queryable), not a JSON string
+        kind = conn.execute(text(
+            "SELECT jsonb_typeof(ai_itinerary_meta) FROM trips WHERE id = :id"
+        ), {'id': with_document}).scalar()
+        assert kind == 'object'
+        found = conn.execute(text(
+            "SELECT id FROM trips WHERE ai_itinerary_meta @> CAST(:fragment AS JSONB)"
+        ), {'fragment': json.dumps({'tips': ['Book ahead']})}).scalars().all()
+        assert found == [with_document]
+
+        # None is SQL NULL, not a JSON null
+        assert conn.execute(text(
+            "SELECT ai_itinerary_meta IS NULL FROM trips WHERE id = :id"
+        ), {'id': without}).scalar() is True
+        assert conn.execute(select(Trip.ai_itinerary_meta).where(Trip.id == without)).scalar() is None
+
+
+def test_engine_options(engine):
+    options = build_engine_options(make_config())
+    assert options['pool_pre_ping'] is True
+    assert options['pool_size'] == Config.DB_POOL_SIZE
+    assert options['pool_recycle'] == Config.DB_POOL_RECYCLE
+    assert options['connect_args']['application_name'] == 'globetrotter'
+    assert f'statement_timeout={STATEMENT_TIMEOUT_MS}' in options['connect_args']['options']
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SHOW statement_timeout")).scalar() == f'{STATEMENT_TIMEOUT_MS}ms'
+        assert conn.execute(text("SHOW application_name")).scalar() == 'globetrotter'
+        with pytest.raises(DBAPIError, match='statement timeout'):
+            conn.execute(text("SELECT pg_sleep(:seconds)"), {'seconds': STATEMENT_TIMEOUT_MS / 1000 + 2})
+
+
+def test_pre_ping_replaces_dropped_connections(engine):
+    with engine.connect() as conn:
+        pid = conn.execute(text("SELECT pg_backend_pid()")).scalar()
+
+    # The pooled connection dies while idle, as after a server restart
+    admin = create_engine(DATABASE_URL, poolclass=NullPool)
+    with admin.connect() as conn:
+        assert conn.execute(text("SELECT pg_terminate_backend(:pid)"), {'pid': pid}).scalar() is True
+    admin.dispose()
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT pg_backend_pid()")).scalar() != pid
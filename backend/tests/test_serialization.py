@@ -0,0 +1,58 @@
+"""Compact activity listings: ?format=columnar and Accept: application/msgpack"""
+
+import msgpack
+
+from serialization import MSGPACK_MIMETYPE, to_columnar
+
+
+def test_to_columnar():
+    rows = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
+    assert to_columnar(rows) == {'id': [1, 2], 'name': ['a', 'b']}
+    assert to_columnar([]) == {}
+
+
+def test_json_rows_by_default(client, user, cities):
+    response = client.get(f"/api/cities/{cities['Paris']}/activities")
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert 'Accept' in response.vary
+    body = response.get_json()
+    assert 'format' not in body
+    assert [activity['name'] for activity in body['activities']] == ['Seine Cruise', 'Louvre Museum']
+
+
+def test_columnar_city_activities(client, user, cities):
+    response = client.get(f"/api/cities/{cities['Paris']}/activities?format=columnar&fields=name,estimated_cost")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['format'] == 'columnar'
+    assert body['activities'] == {'name': ['Seine Cruise', 'Louvre Museum'], 'estimated_cost': [1200, 1700]}
+    assert body['pagination']['total'] == 2
+    assert body['city']['name'] == 'Paris'
+
+
+def test_columnar_search_keeps_every_field(client, user, cities):
+    rows = client.get('/api/activities/search').get_json()['activities']
+    body = client.get('/api/activities/search?format=columnar').get_json()
+    assert body['activities'] == to_columnar(rows)
+    assert body['activities']['city_id'] == [cities['Paris'], cities['Rome'], cities['Paris']]
+
+    body = client.get('/api/activities/search?q=nothing-matches&format=columnar').get_json()
+    assert body['activities'] == {} and body['pagination']['total'] == 0
+
+
+def test_msgpack(client, user, cities):
+    json_body = client.get('/api/activities/search').get_json()
+    response = client.get('/api/activities/search', headers={'Accept': MSGPACK_MIMETYPE})
+    assert response.status_code == 200
+    assert response.mimetype == MSGPACK_MIMETYPE
+    assert msgpack.unpackb(response.data) == json_body
+    assert len(response.data) < len(client.get('/api/activities/search').data)
+
+    response = client.get('/api/activities/search?format=columnar', headers={'Accept': MSGPACK_MIMETYPE})
+    assert msgpack.unpackb(response.data)['activities']['name'] == ['Seine Cruise', 'Colosseum', 'Louvre Museum']
+
+
+def test_json_preferred_when_both_accepted(client, user, cities):
+    response = client.get('/api/activities/search', headers={'Accept': f'application/json, {MSGPACK_MIMETYPE};q=0.5'})
+    assert response.mimetype == 'application/json'
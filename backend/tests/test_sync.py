@@ -0,0 +1,92 @@
+"""GET /api/sync: snapshots, cursors, paging and tombstones"""
+
+from models import ChangeLog
+
+
+def sync(client, since=None, limit=None):
+    params = {}
+    if since is not None:
+        params['since'] = since
+    if limit is not None:
+        params['limit'] = limit
+    response = client.get('/api/sync', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def ids(body, type_):
+    return sorted(entity['id'] for entity in body['changes'][type_])
+
+
+def test_snapshot(client, trip):
+    body = sync(client)
+    assert body['full'] is True and body['has_more'] is False
+    assert ids(body, 'trips') == [trip['id']]
+    assert ids(body, 'stops') == sorted(stop['id'] for stop in trip['stops'])
+    assert body['stop_order'] == {str(trip['id']): [stop['id'] for stop in trip['stops']]}
+    assert sync(client, since=body['cursor'])['changes']['trips'] == []
+
+
+def test_changes_since_cursor(client, trip, cities):
+    cursor = sync(client)['cursor']
+    paris, rome = trip['stops']
+
+    client.put(f"/api/stops/{paris['id']}", json={'notes': 'Arrive by train'})
+    client.post('/api/saved-destinations', json={'city_id': cities['Rome']})
+    client.delete(f"/api/stops/{rome['id']}")
+
+    body = sync(client, since=cursor)
+    assert body['full'] is False and body['has_more'] is False
+    assert body['cursor'] > cursor
+    assert ids(body, 'stops') == [paris['id']]
+    assert body['changes']['stops'][0]['notes'] == 'Arrive by train'
+    assert [saved['city']['id'] for saved in body['changes']['saved_destinations']] == [cities['Rome']]
+    assert body['deleted']['stops'] == [rome['id']]
+    assert body['stop_order'] == {str(trip['id']): [paris['id']]}
+
+    # Nothing has changed since the returned cursor
+    assert sync(client, since=body['cursor'])['cursor'] == body['cursor']
+
+
+def test_paging_with_has_more(client, database, trip):
+    cursor = sync(client)['cursor']
+    for stop in trip['stops']:
+        client.put(f"/api/stops/{stop['id']}", json={'notes': 'edited'})
+    client.put(f"/api/trips/{trip['id']}", json={'name': 'Renamed'})
+
+    seen = []
+    pages = 0
+    while True:
+        body = sync(client, since=cursor, limit=1)
+        pages += 1
+        seen += [(type_, entity['id']) for type_, entities in body['changes'].items() for entity in entities]
+        assert body['cursor'] > cursor
+        cursor = body['cursor']
+        if not body['has_more']:
+            break
+    assert pages == 3
+    assert sorted(seen) == sorted([('stops', stop['id']) for stop in trip['stops']] + [('trips', trip['id'])])
+    assert database.session.query(ChangeLog).filter(ChangeLog.seq > cursor).count() == 0
+
+
+def test_deleted_trip_tombstones(client, trip):
+    cursor = sync(client)['cursor']
+    assert client.delete(f"/api/trips/{trip['id']}").status_code == 200
+
+    body = sync(client, since=cursor)
+    assert body['deleted']['trips'] == [trip['id']]
+    assert sorted(body['deleted']['stops']) == sorted(stop['id'] for stop in trip['stops'])
+    assert body['changes']['trips'] == []
+
+
+def test_other_users_changes_are_not_synced(client, trip):
+    client.post('/api/auth/logout')
+    client.post('/api/auth/register', json={'email': 'bo@example.com', 'password': 'secret', 'name': 'Bo'})
+    body = sync(client)
+    assert body['changes']['trips'] == []
+    assert sync(client, since=0)['changes']['stops'] == []
+
+
+def test_invalid_cursor(client, user):
+    assert client.get('/api/sync?since=yesterday').status_code == 400
+    assert client.get('/api/sync?since=0&limit=many').status_code == 400
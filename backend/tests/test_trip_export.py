@@ -0,0 +1,149 @@
+"""Trip exports: GET /api/trips/<id>/export.ics and export.pdf"""
+
+import shutil
+import threading
+
+import pytest
+
+import trip_export
+from models import Activity
+from trip_export import RENDERER_KEY, _fold
+
+
+@pytest.fixture
+def renderer(app):
+    """The app's PDF renderer, with no cached files left by earlier tests"""
+    renderer = app.extensions[RENDERER_KEY]
+    shutil.rmtree(renderer.directory, ignore_errors=True)
+    return renderer
+
+
+@pytest.fixture
+def planned_trip(client, database, trip):
+    """trip with two morning activities on day 1 in Paris and an all-day one in Rome"""
+    ids = {activity.name: activity.id for activity in database.session.query(Activity)}
+    paris, rome = (stop['id'] for stop in trip['stops'])
+    for stop_id, name, day, slot in ((paris, 'Louvre Museum', 1, 'morning'), (paris, 'Seine Cruise', 1, 'morning'),
+                                     (rome, 'Colosseum', 2, None)):
+        response = client.post(f'/api/stops/{stop_id}/activities',
+                               json={'activity_id': ids[name], 'day_number': day, 'time_of_day': slot})
+        assert response.status_code == 201
+    return trip
+
+
+def events(text):
+    """{SUMMARY: {property: value}} of the VEVENTs in an iCalendar text"""
+    result = {}
+    for block in text.split('BEGIN:VEVENT\r\n')[1:]:
+        properties = dict(line.split(':', 1) for line in block.split('\r\n') if ':' in line)
+        result[properties['SUMMARY']] = properties
+    return result
+
+
+def test_ics(client, planned_trip):
+    url = f"/api/trips/{planned_trip['id']}/export.ics"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/calendar'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="europe.ics"'
+    text = response.get_data(as_text=True)
+    assert text.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n') and text.endswith('END:VCALENDAR\r\n')
+
+    found = events(text)
+    assert set(found) == {'Europe', 'Paris\\, France', 'Rome\\, Italy', 'Louvre Museum', 'Seine Cruise', 'Colosseum'}
+    assert (found['Europe']['DTSTART;VALUE=DATE'], found['Europe']['DTEND;VALUE=DATE']) == ('20260501', '20260508')
+    assert found['Paris\\, France']['DTEND;VALUE=DATE'] == '20260505'
+    # Activities in the same slot follow one another
+    assert (found['Louvre Museum']['DTSTART'], found['Louvre Museum']['DTEND']) == ('20260501T090000', '20260501T120000')
+    assert (found['Seine Cruise']['DTSTART'], found['Seine Cruise']['DTEND']) == ('20260501T120000', '20260501T130000')
+    assert found['Colosseum']['DTSTART;VALUE=DATE'] == '20260505'
+    assert found['Colosseum']['LOCATION'] == 'Rome\\, Italy'
+
+
+def test_ics_etag(client, planned_trip):
+    url = f"/api/trips/{planned_trip['id']}/export.ics"
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    client.put(f"/api/stops/{planned_trip['stops'][0]['id']}", json={'notes': 'Arrive by train'})
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'DESCRIPTION:Arrive by train' in response.get_data(as_text=True)
+
+
+def test_long_lines_are_folded():
+    line = 'DESCRIPTION:' + 'é' * 100
+    folded = _fold(line)
+    assert all(len(piece.encode('utf-8')) <= 75 for piece in folded.split('\r\n'))
+    assert folded.replace('\r\n ', '') == line
+
+
+def test_other_users_trip(client, planned_trip):
+    client.post('/api/auth/logout')
+    client.post('/api/auth/register', json={'email': 'bo@example.com', 'password': 'secret', 'name': 'Bo'})
+    for extension in ('ics', 'pdf'):
+        assert client.get(f"/api/trips/{planned_trip['id']}/export.{extension}").status_code == 403
+        assert client.get(f'/api/trips/999/export.{extension}').status_code == 404
+
+
+def test_pdf(client, planned_trip, renderer, monkeypatch):
+    url = f"/api/trips/{planned_trip['id']}/export.pdf"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert 'filename=europe.pdf' in response.headers['Content-Disposition']
+    assert response.data.startswith(b'%PDF') and b'%%EOF' in response.data[-32:]
+    first = response.data
+    response.close()
+
+    # Served from disk until the trip changes
+    def fail(document, fonts=None):
+        raise AssertionError('rendered again')
+
+    monkeypatch.setattr(trip_export, 'render_pdf', fail)
+    response = client.get(url)
+    assert response.status_code == 200 and response.data == first
+    response.close()
+    cached = list(renderer._cached(planned_trip['id']))
+
+    monkeypatch.undo()
+    client.put(f"/api/stops/{planned_trip['stops'][0]['id']}", json={'notes': 'Arrive by train'})
+    response = client.get(url)
+    assert response.status_code == 200
+    response.close()
+    newer = list(renderer._cached(planned_trip['id']))
+    assert len(cached) == len(newer) == 1 and newer[0][1] > cached[0][1]
+
+
+def test_slow_pdf_answers_202(app, client, planned_trip, renderer, monkeypatch):
+    release = threading.Event()
+    render = trip_export.render_pdf
+
+    def slow(document, fonts=None):
+        release.wait(10)
+        return render(document, fonts)
+
+    monkeypatch.setattr(trip_export, 'render_pdf', slow)
+    monkeypatch.setitem(app.config, 'TRIP_PDF_WAIT_SECONDS', 0.05)
+    url = f"/api/trips/{planned_trip['id']}/export.pdf"
+    for _ in range(2):
+        response = client.get(url)
+        assert response.status_code == 202
+        assert response.headers['Retry-After'] == '2'
+        assert response.get_json()['status'] == 'rendering'
+
+    release.set()
+    monkeypatch.setitem(app.config, 'TRIP_PDF_WAIT_SECONDS', 5)
+    response = client.get(url)
+    assert response.status_code == 200 and response.data.startswith(b'%PDF')
+    response.close()
+
+
+def test_failed_pdf_render(client, planned_trip, renderer, monkeypatch):
+    def broken(document, fonts=None):
+        raise ValueError('no fonts')
+
+    monkeypatch.setattr(trip_export, 'render_pdf', broken)
+    response = client.get(f"/api/trips/{planned_trip['id']}/export.pdf")
+    assert response.status_code == 500
+    assert response.get_json()['error'] == 'Rendering the PDF failed: no fonts'
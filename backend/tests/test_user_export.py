@@ -0,0 +1,103 @@
+"""GET /api/users/export: streamed NDJSON and zip exports of a user's data"""
+
+import io
+import json
+import zipfile
+
+import pytest
+
+from models import Trip
+
+ITINERARY = {
+    'summary': 'Paris and Rome',
+    'days': [{'day': number, 'title': f'Day {number}', 'activities': []} for number in (1, 2)],
+}
+
+
+@pytest.fixture
+def owned_data(client, database, trip, cities):
+    """trip plus an itinerary, an activity, a budget and a saved destination"""
+    stored = database.session.get(Trip, trip['id'])
+    stored.set_ai_itinerary(ITINERARY)
+    database.session.commit()
+    client.post(f"/api/stops/{trip['stops'][0]['id']}/activities", json={'activity_id': 1, 'day_number': 1})
+    client.put(f"/api/trips/{trip['id']}/budget", json={'food_cost': 900})
+    client.post('/api/saved-destinations', json={'city_id': cities['Rome']})
+    return trip
+
+
+def ndjson_records(data):
+    return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+
+def test_ndjson_export(client, user, owned_data):
+    response = client.get('/api/users/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Content-Disposition'].startswith('attachment; filename="globetrotter-export-')
+    assert response.headers['Cache-Control'] == 'no-store'
+
+    records = ndjson_records(response.data)
+    assert records[0]['type'] == 'user'
+    assert records[0]['data']['email'] == 'ana@example.com'
+    assert 'password_hash' not in records[0]['data']
+
+    by_type = {}
+    for record in records[1:]:
+        by_type.setdefault(record['type'], []).append(record['data'])
+    assert [trip['name'] for trip in by_type['trips']] == ['Europe']
+    assert by_type['trips'][0]['ai_itinerary_meta'] == {'summary': 'Paris and Rome'}
+    assert [day['payload']['title'] for day in by_type['itinerary_days']] == ['Day 1', 'Day 2']
+    assert [(stop['city_name'], stop['start_date']) for stop in by_type['stops']] == [
+        ('Paris', '2026-05-01'), ('Rome', '2026-05-04')
+    ]
+    assert [item['activity_name'] for item in by_type['itinerary_activities']] == ['Louvre Museum']
+    assert by_type['budgets'][0]['food_cost'] == 900
+    assert [saved['city_country'] for saved in by_type['saved_destinations']] == ['Italy']
+
+
+def test_chunk_size_does_not_change_the_export(app, client, user, owned_data, monkeypatch):
+    def without_timestamp(data):
+        records = ndjson_records(data)
+        del records[0]['data']['exported_at']
+        return records
+
+    expected = without_timestamp(client.get('/api/users/export').data)
+    monkeypatch.setitem(app.config, 'USER_EXPORT_CHUNK_SIZE', 1)
+    response = client.get('/api/users/export')
+    assert response.is_streamed
+    assert without_timestamp(response.data) == expected
+
+
+def test_zip_export(client, user, owned_data):
+    response = client.get('/api/users/export?format=zip')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [
+            'user.json', 'trips.ndjson', 'itinerary_days.ndjson', 'stops.ndjson',
+            'itinerary_activities.ndjson', 'budgets.ndjson', 'saved_destinations.ndjson',
+        ]
+        assert json.loads(archive.read('user.json'))['name'] == 'Ana'
+        stops = ndjson_records(archive.read('stops.ndjson'))
+        assert [stop['id'] for stop in stops] == [stop['id'] for stop in owned_data['stops']]
+
+
+def test_other_users_data_is_not_exported(client, owned_data):
+    client.post('/api/auth/logout')
+    client.post('/api/auth/register', json={'email': 'bo@example.com', 'password': 'secret', 'name': 'Bo'})
+    records = ndjson_records(client.get('/api/users/export').data)
+    assert [record['type'] for record in records] == ['user']
+    assert records[0]['data']['email'] == 'bo@example.com'
+
+
+def test_invalid_requests(client, user):
+    response = client.get('/api/users/export?format=xml')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'format must be one of: ndjson, zip'
+
+    # Flask-Login sends anonymous requests to the login view
+    client.post('/api/auth/logout')
+    assert client.get('/api/users/export').status_code == 302
@@ -0,0 +1,415 @@
+"""
+Offline trip exports: iCalendar and PDF.
+
+GET /api/trips/<id>/export.ics returns the trip as calendar events,
+built on each request (it is cheap):
+- one all-day event for the trip and one for each stop;
+- one event per itinerary activity, on day day_number of its stop. The
+  time of day sets the start (TIME_SLOTS); activities sharing a slot
+  follow one another, each lasting its activity's duration_hours.
+  Activities without a time of day are all-day events. Times are
+  floating (local to wherever the traveller is).
+
+GET /api/trips/<id>/export.pdf returns the trip, its stops and budget
+and the AI itinerary as a PDF (written by pdf.py, in the Unicode font
+of TRIP_PDF_FONT or one found on the system). Rendering runs on
+background threads (TRIP_PDF_WORKERS) and the result is kept in
+TRIP_EXPORT_DIR, named by the trip's content version, so repeat
+downloads are served from disk. The content version is the trip's
+version plus the latest change_log sequence number for the trip: the
+trip version alone does not move when a stop or activity changes.
+Edits to the shared catalogue (a renamed activity) do not change it,
+so a cached PDF can show the old name until the trip itself changes.
+
+The handler reads everything the PDF shows into a plain dict, so the
+workers never touch the database, then waits up to
+TRIP_PDF_WAIT_SECONDS for the render. A slower render answers 202 and
+the client retries; concurrent requests for the same version share one
+render. Files are written under a temporary name and renamed, so
+processes sharing the directory never see half a file, and older
+versions of a trip are deleted once a newer one is written.
+"""
+
+import glob
+import os
+import queue
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import ItineraryActivity, Stop, Trip
+from pdf import PdfDocument, load_fonts
+
+RENDERER_KEY = 'globetrotter_trip_pdf'
+PRODID = '-//GlobeTrotter//Trip Export//EN'
+UID_DOMAIN = 'globetrotter'
+TIME_SLOTS = {'morning': 9, 'afternoon': 14, 'evening': 19, 'night': 21}  # start hour
+DEFAULT_DURATION_HOURS = 2.0
+
+
+class RendererBusy(Exception):
+    """Too many PDFs are waiting to be rendered"""
+
+
+def load_trip(trip_id):
+    """The trip with its stops, cities, itinerary activities and budget loaded up front"""
+    stops = selectinload(Trip.stops)
+    # populate_existing: eager-load objects the session already holds (e.g. after a commit) too
+    return Trip.query.options(
+        stops.joinedload(Stop.city),
+        stops.selectinload(Stop.itinerary_activities).joinedload(ItineraryActivity.activity),
+        selectinload(Trip.budget),
+    ).populate_existing().get(trip_id)
+
+
+def download_name(trip, extension):
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', trip.name or '').strip('-').lower()
+    return f'{slug or "trip"}.{extension}'
+
+
+def _dates(stop):
+    return date.fromisoformat(stop['start_date']), date.fromisoformat(stop['end_date'])
+
+
+def _place(stop):
+    city = stop.get('city') or {}
+    return ', '.join(part for part in (city.get('name'), city.get('country')) if part)
+
+
+# ---------------------------------------------------------------- iCalendar
+
+def _ics_text(value):
+    value = str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+    return value.replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Content line split into 75-octet pieces (RFC 5545 3.1), never inside a UTF-8 sequence"""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    pieces = []
+    limit = 75
+    while len(data) > limit:
+        cut = limit
+        while cut and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        pieces.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+        limit = 74  # continuation lines start with a space
+    pieces.append(data.decode('utf-8'))
+    return '\r\n '.join(pieces)
+
+
+def _event(uid, stamp, start, end, summary, description=None, location=None):
+    if isinstance(start, datetime):
+        lines = [f'DTSTART:{start:%Y%m%dT%H%M%S}', f'DTEND:{end:%Y%m%dT%H%M%S}']
+    else:
+        lines = [f'DTSTART;VALUE=DATE:{start:%Y%m%d}', f'DTEND;VALUE=DATE:{end:%Y%m%d}']
+    lines = ['BEGIN:VEVENT', f'UID:{uid}@{UID_DOMAIN}', f'DTSTAMP:{stamp}'] + lines
+    lines.append(f'SUMMARY:{_ics_text(summary)}')
+    if description:
+        lines.append(f'DESCRIPTION:{_ics_text(description)}')
+    if location:
+        lines.append(f'LOCATION:{_ics_text(location)}')
+    lines.append('END:VEVENT')
+    return lines
+
+
+def _activity_events(trip_id, stop, stamp):
+    start_date, _ = _dates(stop)
+    slot_ends = {}  # (day, slot) -> end of the previous activity in the slot
+    for item in stop.get('activities') or []:
+        activity = item.get('activity') or {}
+        day = start_date + timedelta(days=max(item['day_number'], 1) - 1)
+        notes = [activity.get('description'), item.get('custom_notes')]
+        if item.get('estimated_cost'):
+            notes.append(f'Estimated cost: {item["estimated_cost"]:g}')
+        description = '\n\n'.join(note for note in notes if note)
+        uid = f'trip-{trip_id}-activity-{item["id"]}'
+        name = activity.get('name') or 'Activity'
+
+        slot = (item.get('time_of_day') or '').lower()
+        if slot not in TIME_SLOTS:
+            yield _event(uid, stamp, day, day + timedelta(days=1), name, description, _place(stop))
+            continue
+        start = slot_ends.get((day, slot)) or datetime.combine(day, datetime.min.time()) + timedelta(hours=TIME_SLOTS[slot])
+        end = start + timedelta(hours=activity.get('duration_hours') or DEFAULT_DURATION_HOURS)
+        slot_ends[(day, slot)] = end
+        yield _event(uid, stamp, start, end, name, description, _place(stop))
+
+
+def render_ics(document):
+    """iCalendar text for a trip document (see trip_document)"""
+    updated = document.get('updated_at') or document.get('created_at')
+    stamp = (datetime.fromisoformat(updated) if updated else datetime.utcnow()).strftime('%Y%m%dT%H%M%SZ')
+    trip_id = document['id']
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_ics_text(document["name"])}',
+    ]
+    lines += _event(
+        f'trip-{trip_id}', stamp,
+        date.fromisoformat(document['start_date']), date.fromisoformat(document['end_date']) + timedelta(days=1),
+        document['name'], document.get('description'),
+    )
+    for stop in document['stops']:
+        start, end = _dates(stop)
+        lines += _event(
+            f'trip-{trip_id}-stop-{stop["id"]}', stamp, start, end + timedelta(days=1),
+            _place(stop) or 'Stop', stop.get('notes'), _place(stop),
+        )
+        for event in _activity_events(trip_id, stop, stamp):
+            lines += event
+    lines.append('END:VCALENDAR')
+    return ''.join(_fold(line) + '\r\n' for line in lines)
+
+
+# ---------------------------------------------------------------- PDF
+
+def trip_document(trip):
+    """Everything the exports show, as plain data (no database access needed afterwards)"""
+    document = trip.to_dict(include_stops=True)
+    document['ai_itinerary'] = trip.ai_itinerary_to_dict()
+    if trip.budget is not None:
+        activities_cost = sum(
+            item.get('estimated_cost') or 0 for stop in document['stops'] for item in stop['activities']
+        )
+        document['budget'] = trip.budget.to_dict(activities_cost=activities_cost)
+    return document
+
+
+def _format_date(value):
+    return date.fromisoformat(value).strftime('%d %b %Y') if value else ''
+
+
+def _money(value, currency=''):
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return str(value) if value not in (None, '') else ''
+    return f'{value:,.2f} {currency}'.strip()
+
+
+def _label(key):
+    return str(key).replace('_', ' ').capitalize()
+
+
+def _render_stops(pdf, document):
+    pdf.heading('Stops', size=14)
+    if not document['stops']:
+        pdf.paragraph('No stops yet.')
+    for position, stop in enumerate(document['stops'], start=1):
+        pdf.text(f'{position}. {_place(stop) or "Stop"}', size=12, font='bold')
+        pdf.text(
+            f'{_format_date(stop["start_date"])} - {_format_date(stop["end_date"])} ({stop["duration_days"]} days)',
+            size=9,
+        )
+        if stop.get('notes'):
+            pdf.text(stop['notes'], size=9)
+        day = None
+        for item in stop['activities']:
+            if item['day_number'] != day:
+                day = item['day_number']
+                pdf.space(3)
+                pdf.text(f'Day {day}', size=10, font='bold', indent=12)
+            activity = item.get('activity') or {}
+            line = activity.get('name') or 'Activity'
+            if item.get('time_of_day'):
+                line = f'{item["time_of_day"].capitalize()}: {line}'
+            if item.get('estimated_cost'):
+                line += f' ({_money(item["estimated_cost"])})'
+            pdf.text(line, indent=24)
+            if item.get('custom_notes'):
+                pdf.text(item['custom_notes'], size=9, indent=36)
+        pdf.space(8)
+
+
+def _render_budget(pdf, budget):
+    pdf.heading('Budget', size=14)
+    currency = budget.get('currency') or ''
+    for key, value in budget['breakdown'].items():
+        pdf.text(f'{_label(key)}: {_money(value or 0, currency)}')
+    pdf.text(f'Total: {_money(budget["total_budget"] or 0, currency)}', font='bold')
+
+
+def _render_ai_itinerary(pdf, itinerary):
+    pdf.heading('AI Itinerary', size=14)
+    for day in itinerary.get('days') or []:
+        if not isinstance(day, dict):
+            continue
+        title = f'Day {day.get("day", "")}'
+        if day.get('title'):
+            title += f': {day["title"]}'
+        pdf.text(title, size=11, font='bold')
+        for activity in day.get('activities') or []:
+            if not isinstance(activity, dict):
+                continue
+            line = ' '.join(str(part) for part in (activity.get('time'), activity.get('name')) if part)
+            if activity.get('cost'):
+                line += f' ({_money(activity["cost"])})'
+            pdf.text(line, indent=12)
+            if activity.get('description'):
+                pdf.text(activity['description'], size=9, indent=24)
+        accommodation = day.get('accommodation')
+        if isinstance(accommodation, dict) and accommodation.get('name'):
+            pdf.text(f'Stay: {accommodation["name"]} ({_money(accommodation.get("cost"))})', indent=12)
+        for meal in day.get('meals') or []:
+            if isinstance(meal, dict) and meal.get('suggestion'):
+                pdf.text(f'{_label(meal.get("type") or "meal")}: {meal["suggestion"]}', indent=12)
+        if day.get('transport_to_next_day'):
+            pdf.text(f'Onward: {day["transport_to_next_day"]}', indent=12)
+        pdf.space(8)
+
+    breakdown = itinerary.get('budget_breakdown')
+    if isinstance(breakdown, dict) and breakdown:
+        pdf.text('Estimated costs', size=11, font='bold')
+        for key, value in breakdown.items():
+            pdf.text(f'{_label(key)}: {_money(value)}', indent=12)
+        pdf.space(8)
+    tips = itinerary.get('tips')
+    if isinstance(tips, list) and tips:
+        pdf.text('Tips', size=11, font='bold')
+        for tip in tips:
+            pdf.text(f'- {tip}', indent=12)
+
+
+def render_pdf(document, fonts=None):
+    """PDF bytes for a trip document (see trip_document), in the given fonts (pdf.load_fonts)"""
+    pdf = PdfDocument(title=document['name'], author='GlobeTrotter', fonts=fonts)
+    pdf.heading(document['name'], size=20)
+    pdf.text(
+        f'{_format_date(document["start_date"])} - {_format_date(document["end_date"])} '
+        f'({document["total_days"]} days)'
+    )
+    if document.get('description'):
+        pdf.space(4)
+        pdf.paragraph(document['description'])
+    pdf.rule()
+    _render_stops(pdf, document)
+    if document.get('budget'):
+        _render_budget(pdf, document['budget'])
+    if isinstance(document.get('ai_itinerary'), dict):
+        _render_ai_itinerary(pdf, document['ai_itinerary'])
+    return pdf.render()
+
+
+class PdfRenderer:
+    """Renders trip PDFs on worker threads into a directory of cached files"""
+
+    def __init__(self, app, directory, workers, max_pending, fonts=None):
+        self.app = app
+        self.fonts = fonts
+        self.directory = os.path.abspath(directory)
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.jobs = {}  # path -> Event set when its render finishes
+        self.errors = {}  # path -> message of a failed render, until it is reported
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def path(self, trip_id, version):
+        """Cache file for a trip at a content version ((trip version, change seq))"""
+        return os.path.join(self.directory, f'trip-{trip_id}-{version[0]}-{version[1]}.pdf')
+
+    def request(self, trip_id, version, build):
+        """(path, None) when the PDF is on disk, else (None, Event set when its render finishes)
+
+        build() returns the trip document. It is only called when no
+        render of this version is already queued, in the calling
+        (request) thread.
+        """
+        path = self.path(trip_id, version)
+        if os.path.exists(path):
+            return path, None
+        with self.lock:
+            done = self.jobs.get(path)
+            if done is not None:
+                return None, done
+            done = self.jobs[path] = threading.Event()
+            self.errors.pop(path, None)
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'trip-pdf-{len(self.threads)}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        try:
+            self.queue.put_nowait((trip_id, version, path, build(), done))
+        except queue.Full:
+            self._finish(path, done)
+            raise RendererBusy('Too many exports are being rendered, try again shortly')
+        except Exception:
+            self._finish(path, done)
+            raise
+        return None, done
+
+    def error(self, path):
+        """The failure of the last render of path, if it failed (reported once)"""
+        with self.lock:
+            return self.errors.pop(path, None)
+
+    def _finish(self, path, done, error=None):
+        with self.lock:
+            self.jobs.pop(path, None)
+            if error is not None:
+                self.errors[path] = error
+        done.set()
+
+    def _run(self):
+        while True:
+            trip_id, version, path, document, done = self.queue.get()
+            error = None
+            try:
+                self._write(trip_id, version, path, render_pdf(document, self.fonts))
+            except Exception as e:
+                error = str(e)
+                self.app.logger.warning(f'Rendering the PDF of trip {trip_id} failed: {e}')
+            finally:
+                self._finish(path, done, error)
+                self.queue.task_done()
+
+    def _write(self, trip_id, version, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+        # Older versions of the trip will not be asked for again
+        for other, other_version in self._cached(trip_id):
+            if other_version < version:
+                self._remove(other)
+
+    def _cached(self, trip_id):
+        """(path, version) of the trip's files on disk"""
+        for path in glob.glob(os.path.join(self.directory, f'trip-{trip_id}-*-*.pdf')):
+            match = re.fullmatch(rf'trip-{trip_id}-(\d+)-(\d+)\.pdf', os.path.basename(path))
+            if match:
+                yield path, (int(match.group(1)), int(match.group(2)))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def discard(self, trip_id):
+        """Delete every cached PDF of a trip"""
+        for path, _ in list(self._cached(trip_id)):
+            self._remove(path)
+
+
+def init_trip_exports(app):
+    config = app.config
+    fonts = None
+    if config['TRIP_PDF_FONT'] != 'none':
+        fonts = load_fonts(config['TRIP_PDF_FONT'], config['TRIP_PDF_BOLD_FONT'])
+    if fonts is None:
+        app.logger.info('No Unicode font found for trip PDFs; text outside cp1252 is transliterated or left out')
+    renderer = PdfRenderer(
+        app, config['TRIP_EXPORT_DIR'], config['TRIP_PDF_WORKERS'], config['TRIP_PDF_MAX_PENDING'], fonts
+    )
+    app.extensions[RENDERER_KEY] = renderer
+    return renderer
@@ -0,0 +1,247 @@
+"""
+TrueType font files, read for embedding in PDFs (see pdf.py).
+
+Reads what a PDF needs from a .ttf file: the character to glyph map,
+advance widths, the metrics of the font descriptor and the PostScript
+name. subset() writes a copy holding only the outlines of the glyphs a
+document uses. Glyph ids are kept (unused glyphs are emptied, not
+renumbered), so the PDF addresses glyphs by id through an identity map.
+
+Only TrueType outlines (a glyf table) are supported; CFF-based OpenType
+fonts (.otf) and font collections (.ttc) are rejected with FontError.
+"""
+
+import struct
+
+# Tables a PDF viewer needs to draw the glyphs; everything else is dropped
+SUBSET_TABLES = ('hhea', 'maxp', 'hmtx', 'cvt ', 'fpgm', 'prep')
+
+# Composite glyph flags (the "glyf" table specification)
+ARG_1_AND_2_ARE_WORDS = 0x0001
+WE_HAVE_A_SCALE = 0x0008
+MORE_COMPONENTS = 0x0020
+WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+WE_HAVE_A_TWO_BY_TWO = 0x0080
+
+
+class FontError(ValueError):
+    """The file is not a TrueType font this module can read"""
+
+
+def _checksum(data):
+    data += b'\0' * (-len(data) % 4)
+    return sum(struct.unpack(f'>{len(data) // 4}L', data)) & 0xFFFFFFFF
+
+
+def _sfnt(tables):
+    """A font file made of the given {tag: data} tables"""
+    tags = sorted(tables)
+    power = 1 << (len(tags).bit_length() - 1)
+    header = struct.pack('>LHHHH', 0x00010000, len(tags), power * 16, power.bit_length() - 1, (len(tags) - power) * 16)
+    offset = 12 + 16 * len(tags)
+    records = bytearray()
+    body = bytearray()
+    head_offset = None
+    for tag in tags:
+        data = tables[tag]
+        if tag == 'head':
+            head_offset = offset + len(body)
+        records += struct.pack('>4sLLL', tag.encode('latin-1'), _checksum(data), offset + len(body), len(data))
+        body += data + b'\0' * (-len(data) % 4)
+    font = bytearray(header + records + body)
+    # head.checkSumAdjustment makes the whole file sum to a fixed value
+    struct.pack_into('>L', font, head_offset + 8, (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF)
+    return bytes(font)
+
+
+class TrueTypeFont:
+    """A parsed .ttf file (read-only, safe to share between threads)"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        if self.data[:4] not in (b'\x00\x01\x00\x00', b'true'):
+            raise FontError(f'{path} is not a TrueType font')
+        count = struct.unpack_from('>H', self.data, 4)[0]
+        self.tables = {}
+        for index in range(count):
+            tag, _, offset, length = struct.unpack_from('>4sLLL', self.data, 12 + 16 * index)
+            self.tables[tag.decode('latin-1')] = (offset, length)
+        missing = {'head', 'hhea', 'maxp', 'hmtx', 'loca', 'glyf', 'cmap'} - set(self.tables)
+        if missing:
+            raise FontError(f'{path} has no {", ".join(sorted(missing))} table')
+
+        head = self.table('head')
+        self.units_per_em = struct.unpack_from('>H', head, 18)[0]
+        self.bbox = struct.unpack_from('>4h', head, 36)
+        long_offsets = struct.unpack_from('>h', head, 50)[0] == 1
+        hhea = self.table('hhea')
+        self.ascent, self.descent = struct.unpack_from('>hh', hhea, 4)
+        metrics_count = struct.unpack_from('>H', hhea, 34)[0]
+        self.glyph_count = struct.unpack_from('>H', self.table('maxp'), 4)[0]
+
+        # Glyphs past the last metric share its advance width
+        advances = struct.unpack_from(f'>{2 * metrics_count}H', self.table('hmtx'))[::2]
+        self.advances = advances + advances[-1:] * (self.glyph_count - metrics_count)
+        loca = self.table('loca')
+        if long_offsets:
+            self.offsets = struct.unpack_from(f'>{self.glyph_count + 1}L', loca)
+        else:
+            self.offsets = tuple(offset * 2 for offset in struct.unpack_from(f'>{self.glyph_count + 1}H', loca))
+
+        self.cap_height = self.ascent
+        if 'OS/2' in self.tables:
+            os2 = self.table('OS/2')
+            if struct.unpack_from('>H', os2, 0)[0] >= 2 and len(os2) >= 90:
+                self.cap_height = struct.unpack_from('>h', os2, 88)[0]
+        self.italic_angle = 0.0
+        self.fixed_pitch = False
+        if 'post' in self.tables:
+            post = self.table('post')
+            self.italic_angle = struct.unpack_from('>l', post, 4)[0] / 65536
+            self.fixed_pitch = struct.unpack_from('>L', post, 12)[0] != 0
+
+        self.name = self._postscript_name() or 'Font'
+        self.cmap = self._read_cmap()
+
+    def table(self, tag):
+        offset, length = self.tables[tag]
+        return self.data[offset:offset + length]
+
+    def scaled(self, value):
+        """A font-unit value in 1/1000 em, as PDF font metrics are given"""
+        return value * 1000 / self.units_per_em
+
+    def advance(self, glyph):
+        return self.scaled(self.advances[glyph])
+
+    def _postscript_name(self):
+        if 'name' not in self.tables:
+            return None
+        names = self.table('name')
+        count, storage = struct.unpack_from('>HH', names, 2)
+        for index in range(count):
+            platform, _, _, name_id, length, offset = struct.unpack_from('>6H', names, 6 + 12 * index)
+            if name_id != 6:
+                continue
+            raw = names[storage + offset:storage + offset + length]
+            name = raw.decode('utf-16-be' if platform in (0, 3) else 'latin-1', errors='ignore')
+            # PDF names are written unescaped, so keep to plain characters
+            name = ''.join(char for char in name if (char.isascii() and char.isalnum()) or char in '-_')
+            if name:
+                return name
+        return None
+
+    def _read_cmap(self):
+        """{code point: glyph id} from the font's Unicode character map"""
+        cmap = self.table('cmap')
+        count = struct.unpack_from('>H', cmap, 2)[0]
+        subtables = {}
+        for index in range(count):
+            platform, encoding, offset = struct.unpack_from('>HHL', cmap, 4 + 8 * index)
+            subtables[(platform, encoding)] = offset
+        # Full Unicode maps (format 12) first, then Basic Multilingual Plane ones (format 4)
+        for key in ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0)):
+            offset = subtables.get(key)
+            if offset is None:
+                continue
+            table_format = struct.unpack_from('>H', cmap, offset)[0]
+            if table_format == 12:
+                return self._cmap_format_12(cmap, offset)
+            if table_format == 4:
+                return self._cmap_format_4(cmap, offset)
+        raise FontError(f'{self.name} has no Unicode character map')
+
+    @staticmethod
+    def _cmap_format_4(cmap, offset):
+        segments = struct.unpack_from('>H', cmap, offset + 6)[0] // 2
+        ends = offset + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+        mapping = {}
+        for segment in range(segments):
+            end, = struct.unpack_from('>H', cmap, ends + 2 * segment)
+            start, = struct.unpack_from('>H', cmap, starts + 2 * segment)
+            delta, = struct.unpack_from('>H', cmap, deltas + 2 * segment)
+            range_offset, = struct.unpack_from('>H', cmap, range_offsets + 2 * segment)
+            if start == 0xFFFF:
+                continue
+            for code in range(start, end + 1):
+                if range_offset == 0:
+                    glyph = (code + delta) & 0xFFFF
+                else:
+                    glyph, = struct.unpack_from(
+                        '>H', cmap, range_offsets + 2 * segment + range_offset + 2 * (code - start)
+                    )
+                    if glyph:
+                        glyph = (glyph + delta) & 0xFFFF
+                if glyph:
+                    mapping[code] = glyph
+        return mapping
+
+    @staticmethod
+    def _cmap_format_12(cmap, offset):
+        groups = struct.unpack_from('>L', cmap, offset + 12)[0]
+        mapping = {}
+        for group in range(groups):
+            first, last, glyph = struct.unpack_from('>LLL', cmap, offset + 16 + 12 * group)
+            for code in range(first, last + 1):
+                mapping[code] = glyph + code - first
+        return mapping
+
+    def _outline(self, glyph):
+        start = self.tables['glyf'][0]
+        return self.data[start + self.offsets[glyph]:start + self.offsets[glyph + 1]]
+
+    @staticmethod
+    def _components(outline):
+        """Glyph ids a composite glyph is built from (none for a simple glyph)"""
+        if len(outline) < 10 or struct.unpack_from('>h', outline, 0)[0] >= 0:
+            return []
+        components = []
+        offset = 10
+        while True:
+            flags, glyph = struct.unpack_from('>HH', outline, offset)
+            components.append(glyph)
+            offset += 4 + (4 if flags & ARG_1_AND_2_ARE_WORDS else 2)
+            if flags & WE_HAVE_A_SCALE:
+                offset += 2
+            elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+                offset += 4
+            elif flags & WE_HAVE_A_TWO_BY_TWO:
+                offset += 8
+            if not flags & MORE_COMPONENTS:
+                return components
+
+    def subset(self, glyphs):
+        """The font file with only the given glyphs' outlines (and .notdef); glyph ids are unchanged"""
+        keep = set()
+        pending = [0, *glyphs]
+        while pending:
+            glyph = pending.pop()
+            if glyph in keep or glyph >= self.glyph_count:
+                continue
+            keep.add(glyph)
+            pending.extend(self._components(self._outline(glyph)))
+
+        outlines = bytearray()
+        offsets = []
+        for glyph in range(self.glyph_count):
+            offsets.append(len(outlines))
+            if glyph in keep:
+                outline = self._outline(glyph)
+                outlines += outline + b'\0' * (-len(outline) % 4)
+        offsets.append(len(outlines))
+
+        head = bytearray(self.table('head'))
+        struct.pack_into('>h', head, 50, 1)  # long loca offsets
+        tables = {
+            'head': bytes(head),
+            'loca': struct.pack(f'>{len(offsets)}L', *offsets),
+            'glyf': bytes(outlines),
+        }
+        for tag in SUBSET_TABLES:
+            if tag in self.tables:
+                tables[tag] = self.table(tag)
+        return _sfnt(tables)
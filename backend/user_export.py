@@ -0,0 +1,157 @@
+"""
+Streamed export of a user's data (GET /api/users/export).
+
+The export covers the account and everything the user owns: trips with
+their AI itinerary days, stops, itinerary activities, budgets and saved
+destinations. Each table is read with one query whose rows are fetched
+USER_EXPORT_CHUNK_SIZE at a time (yield_per; a server-side cursor on
+PostgreSQL) and written out as they arrive, so a worker holds at most
+one chunk however many trips the user has. Rows are read straight from
+the tables with Core selects, without building ORM objects.
+
+Two formats:
+- ndjson: one {"type": ..., "data": {...}} line per row, starting with
+  the account ({"type": "user"}).
+- zip: user.json plus one NDJSON file per table. The archive is written
+  to the response as it is built (zipfile supports unseekable output).
+
+The export runs on a connection of its own, taken from the reader
+engine, after the handler has returned. On PostgreSQL it reads one
+REPEATABLE READ snapshot, so the tables agree with each other.
+"""
+
+import zipfile
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from models import Activity, Budget, City, ItineraryActivity, ItineraryDay, SavedDestination, Stop, Trip, User
+from serialization import RawJSON
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'zip': 'application/zip',
+}
+USER_FIELDS = ('id', 'email', 'name', 'photo_url', 'language_preference', 'created_at', 'updated_at')
+
+
+def _tables(user_id):
+    """(name, select) for each exported table, parents first"""
+    trips = Trip.__table__
+    stops = Stop.__table__
+    items = ItineraryActivity.__table__
+    saved = SavedDestination.__table__
+    return [
+        ('trips', select(trips).where(trips.c.user_id == user_id).order_by(trips.c.id)),
+        ('itinerary_days', select(ItineraryDay.__table__).join(trips).where(trips.c.user_id == user_id).order_by(
+            ItineraryDay.__table__.c.trip_id, ItineraryDay.__table__.c.day_number
+        )),
+        ('stops', select(stops, City.name.label('city_name'), City.country.label('city_country')).join(trips).join(
+            City.__table__, City.id == stops.c.city_id
+        ).where(trips.c.user_id == user_id).order_by(stops.c.trip_id, stops.c.sort_key, stops.c.id)),
+        ('itinerary_activities', select(items, Activity.name.label('activity_name')).join(stops).join(trips).join(
+            Activity.__table__, Activity.id == items.c.activity_id
+        ).where(trips.c.user_id == user_id).order_by(items.c.stop_id, items.c.id)),
+        ('budgets', select(Budget.__table__).join(trips).where(trips.c.user_id == user_id).order_by(
+            Budget.__table__.c.trip_id
+        )),
+        ('saved_destinations', select(saved, City.name.label('city_name'), City.country.label('city_country')).join(
+            City.__table__, City.id == saved.c.city_id
+        ).where(saved.c.user_id == user_id).order_by(saved.c.id)),
+    ]
+
+
+# Columns holding encoded JSON documents, embedded as JSON rather than strings
+JSON_COLUMNS = {'trips': ('ai_itinerary_meta',), 'itinerary_days': ('payload',)}
+
+
+def _record(keys, row, json_columns=()):
+    record = {}
+    for key, value in zip(keys, row):
+        if isinstance(value, (date, datetime)):
+            value = value.isoformat()
+        elif key in json_columns and value is not None:
+            value = RawJSON(value)
+        record[key] = value
+    return record
+
+
+class _Pipe:
+    """Write-only file whose contents are drained by the generator feeding the response"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class UserExport:
+    """The rows of one user's export, fetched chunk by chunk"""
+
+    def __init__(self, engine, user_id, dumps, chunk_size):
+        self.engine = engine
+        self.user_id = user_id
+        self.dumps = dumps  # obj -> JSON bytes
+        self.chunk_size = chunk_size
+
+    def _connect(self):
+        conn = self.engine.connect()
+        if conn.dialect.name == 'postgresql':
+            conn = conn.execution_options(isolation_level='REPEATABLE READ', postgresql_readonly=True)
+        return conn
+
+    def _user(self, conn):
+        users = User.__table__
+        row = conn.execute(
+            select(*(users.c[field] for field in USER_FIELDS)).where(users.c.id == self.user_id)
+        ).one()
+        return dict(_record(USER_FIELDS, row), exported_at=datetime.utcnow().isoformat() + 'Z')
+
+    def tables(self, conn):
+        """(table name, generator of row-chunk lists of records) for each table"""
+        for name, query in _tables(self.user_id):
+            yield name, self._chunks(conn, name, query)
+
+    def _chunks(self, conn, name, query):
+        result = conn.execution_options(yield_per=self.chunk_size).execute(query)
+        keys = list(result.keys())
+        json_columns = JSON_COLUMNS.get(name, ())
+        for rows in result.partitions():
+            yield [_record(keys, row, json_columns) for row in rows]
+
+    def ndjson(self):
+        """Generator of NDJSON bytes"""
+        with self._connect() as conn:
+            yield self.dumps({'type': 'user', 'data': self._user(conn)}) + b'\n'
+            for name, chunks in self.tables(conn):
+                for records in chunks:
+                    yield b''.join(self.dumps({'type': name, 'data': record}) + b'\n' for record in records)
+
+    def zip(self):
+        """Generator of zip archive bytes"""
+        # zipfile writes in small pieces; only whole non-empty chunks go to the response
+        return (data for data in self._zip_parts() if data)
+
+    def _zip_parts(self):
+        pipe = _Pipe()
+        with self._connect() as conn, zipfile.ZipFile(pipe, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('user.json', self.dumps(self._user(conn)) + b'\n')
+            yield pipe.drain()
+            for name, chunks in self.tables(conn):
+                # force_zip64: the entry size is unknown until the table has been read
+                with archive.open(f'{name}.ndjson', 'w', force_zip64=True) as member:
+                    for records in chunks:
+                        member.write(b''.join(self.dumps(record) + b'\n' for record in records))
+                        yield pipe.drain()
+        # Closing the archive writes the central directory
+        yield pipe.drain()